@@ -103,7 +103,25 @@ vram_group.add_argument("--novram", action="store_true", help="When lowvram isn'
 vram_group.add_argument("--cpu", action="store_true", help="To use the CPU for everything (slow).")
 
 
+parser.add_argument("--disable-mmap", action="store_true", help="Read whole safetensors files in memory instead of memory mapping them and only reading the weights that are used.")
 parser.add_argument("--disable-smart-memory", action="store_true", help="Force ComfyUI to agressively offload to regular ram instead of keeping models in vram when it can.")
+parser.add_argument("--cache-size", type=float, default=0.0, metavar="GB", help="Memory budget in GB for keeping node outputs from older prompts cached on top of the ones used by the last --cache-prompts prompts.")
+parser.add_argument("--cache-prompts", type=int, default=1, metavar="N", help="Keep the node outputs used by the last N prompts cached as long as there is free memory.")
+parser.add_argument("--cache-eviction", type=str, default="lru", choices=["lru", "cost"], help="How cached node outputs are evicted when memory is low: least recently used first or lowest execution time per byte first.")
+parser.add_argument("--cpu-node-threads", type=int, default=0, metavar="N", help="Number of threads used to run nodes marked as CPU_SAFE in parallel with the rest of the graph. 0 (the default) runs every node on the main execution thread. Ignored when the intermediate device is not the cpu (--gpu-only).")
+parser.add_argument("--workers", type=int, default=0, metavar="N", help="Execute prompts on N worker processes instead of a single thread in the server process. Queued prompts are routed to the worker that already has their models loaded when possible.")
+parser.add_argument("--worker-devices", type=str, default=None, metavar="DEVICE_IDS", help="Comma separated cuda device ids the worker processes get pinned to, in round robin order. Example: --workers 2 --worker-devices 0,1")
+parser.add_argument("--batch-prompts", type=int, default=1, metavar="COUNT", help="Fuse up to COUNT queued prompts that only differ in their seeds or prompt texts into one batched sampler run.")
+parser.add_argument("--clip-cache-dir", type=str, default=None, help="Cache the text encoder outputs on disk in this directory so prompts that were already encoded skip the text encoder, even after a restart.")
+parser.add_argument("--clip-cache-size", type=float, default=1.0, help="Maximum size in GB of the text encoder disk cache.")
+parser.add_argument("--model-cache-size", type=float, default=0, help="Keep up to this many GB of loaded checkpoints, unets, text encoders and vaes in RAM so switching back to them doesn't load them from disk again. 0 disables it.")
+parser.add_argument("--prefetch-prompts", type=int, default=0, metavar="COUNT", help="Read the model files used by the next COUNT queued prompts on a background thread while the current prompt executes, when there is enough free RAM.")
+parser.add_argument("--patch-cache-size", type=float, default=0.0, help="Maximum size in GB of the cache of weight changes reconstructed from lora/lokr/loha patches, reused when the same lora is patched again. Entries on a device are dropped when models need the memory. 0 (the default) disables it.")
+parser.add_argument("--stream-weights", action="store_true", help="In lowvram mode copy the weights of the next layer to the GPU while the current one runs instead of copying each weight when it is used.")
+parser.add_argument("--pinned-memory-size", type=float, default=0, help="Keep up to this many GB of the weights of offloaded models in a reusable pool of pinned memory so moving them back to the GPU is faster. 0 disables it.")
+parser.add_argument("--model-eviction-policy", type=str, default="default", choices=["default", "lru", "lfu", "gdsf"], help="Which loaded models get unloaded first when memory is needed: default unloads the ones not referenced anymore then the smallest, lru the least recently used, lfu the least frequently used and gdsf the ones with the lowest reload time per byte weighted by how often they are used.")
+parser.add_argument("--memory-calibration-file", type=str, default=None, help="Save the peak memory measured for each model, dtype, attention backend and input shape to this json file so the sampling and vae batch sizes use the measured values after a restart.")
+parser.add_argument("--dedup-weights", action="store_true", help="Make the weights that are identical between loaded checkpoints, text encoders, vaes and unets share the same memory in RAM. Useful with many fine tunes that share their text encoder or vae.")
 parser.add_argument("--deterministic", action="store_true", help="Make pytorch use slower deterministic algorithms when it can. Note that this might not make images deterministic in all cases.")
 
 parser.add_argument("--dont-print-server", action="store_true", help="Don't print server output.")
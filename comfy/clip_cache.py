@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import os
+import threading
+
+import torch
+import safetensors.torch
+
+from comfy.cli_args import args
+import comfy.model_management
+
+def hash_file_identity(tag, paths):
+    """Cheap identity of the weights loaded from a list of files: their paths, sizes and modification times."""
+    h = hashlib.sha256(tag.encode("utf-8"))
+    for p in paths:
+        st = os.stat(p)
+        h.update("\n{}:{}:{}".format(os.path.abspath(p), st.st_size, st.st_mtime_ns).encode("utf-8"))
+    return h.hexdigest()
+
+def update_hash(h, obj):
+    if isinstance(obj, torch.Tensor):
+        t = obj.detach().to("cpu").contiguous()
+        h.update("tensor:{}:{}:".format(t.dtype, list(t.shape)).encode("utf-8"))
+        h.update(t.reshape(-1).view(torch.uint8).numpy().tobytes())
+    elif isinstance(obj, (list, tuple)):
+        h.update("[{}:".format(len(obj)).encode("utf-8"))
+        for x in obj:
+            update_hash(h, x)
+        h.update(b"]")
+    elif isinstance(obj, dict):
+        h.update("{{{}:".format(len(obj)).encode("utf-8"))
+        for k in sorted(obj, key=repr):
+            update_hash(h, k)
+            update_hash(h, obj[k])
+        h.update(b"}")
+    else:
+        h.update("{}:{};".format(type(obj).__name__, repr(obj)).encode("utf-8"))
+
+patches_hashes = {}
+
+def hash_patches(patcher):
+    """Content hash of the weight patches of a ModelPatcher, computed once per patches_uuid."""
+    h = patches_hashes.get(patcher.patches_uuid, None)
+    if h is None:
+        m = hashlib.sha256()
+        update_hash(m, patcher.patches)
+        h = m.hexdigest()
+        if len(patches_hashes) > 256:
+            patches_hashes.clear()
+        patches_hashes[patcher.patches_uuid] = h
+    return h
+
+def encode_key(clip, tokens, options):
+    """Key of a CLIP.encode_from_tokens result or None if the CLIP weights have no known identity."""
+    if clip.weights_hash is None:
+        return None
+    h = hashlib.sha256()
+    h.update("{}\n{}\n{}\n{}\n".format(clip.weights_hash, hash_patches(clip.patcher), clip.patcher.load_device, clip.patcher.model_dtype()).encode("utf-8"))
+    update_hash(h, options)
+    update_hash(h, tokens)
+    return h.hexdigest()
+
+class ClipCache:
+    """Disk cache of text encoder outputs.
+
+    Every entry is a safetensors file sharded in subdirectories by the first characters of its key. Entries are
+    evicted least recently used first (by modification time, which is updated on every hit) once the files go over
+    max_size bytes."""
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.scan()
+
+    def scan(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for f in os.scandir(shard.path):
+                if f.name.endswith(".safetensors"):
+                    st = f.stat()
+                    self.entries[f.name[:-len(".safetensors")]] = [st.st_size, st.st_mtime]
+                    self.total_size += st.st_size
+                elif f.name.endswith(".tmp"):
+                    os.remove(f.path)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], "{}.safetensors".format(key))
+
+    def get(self, key, device=None):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            path = self.entry_path(key)
+            try:
+                out = safetensors.torch.load_file(path, device="cpu")
+                os.utime(path)
+            except Exception as e:
+                logging.warning("Could not load cached text encoder output {}: {}".format(path, e))
+                self.remove(key)
+                self.misses += 1
+                return None
+            self.entries[key][1] = os.path.getmtime(path)
+            self.hits += 1
+
+        if device is not None:
+            out = {k: v.to(device) for k, v in out.items()}
+        return out
+
+    def set(self, key, tensors):
+        tensors = {k: v.detach().to("cpu").contiguous() for k, v in tensors.items()}
+        path = self.entry_path(key)
+        with self.lock:
+            if key in self.entries:
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+            try:
+                safetensors.torch.save_file(tensors, temp_path)
+                os.replace(temp_path, path)
+            except Exception as e:
+                logging.warning("Could not save text encoder output to cache {}: {}".format(path, e))
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return
+            st = os.stat(path)
+            self.entries[key] = [st.st_size, st.st_mtime]
+            self.total_size += st.st_size
+            self.evict()
+
+    def remove(self, key):
+        size, _ = self.entries.pop(key)
+        self.total_size -= size
+        try:
+            os.remove(self.entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        if self.total_size <= self.max_size:
+            return
+        for key in sorted(self.entries, key=lambda a: self.entries[a][1]):
+            if self.total_size <= self.max_size:
+                break
+            self.remove(key)
+
+    def get_stats(self):
+        return {"entries": len(self.entries), "size": self.total_size, "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+cache = None
+
+def get_cache():
+    global cache
+    if cache is None and args.clip_cache_dir is not None:
+        cache = ClipCache(args.clip_cache_dir, int(args.clip_cache_size * 1024 * 1024 * 1024))
+    return cache
+
+def encode_cached(clip, tokens, options, encode):
+    """Returns encode() (a (cond, pooled) tuple) from the disk cache when possible and stores it otherwise."""
+    c = get_cache()
+    key = None
+    if c is not None:
+        key = encode_key(clip, tokens, options)
+
+    if key is not None:
+        out = c.get(key, device=comfy.model_management.intermediate_device())
+        if out is not None:
+            return out["cond"], out.get("pooled", None)
+
+    cond, pooled = encode()
+    if key is not None:
+        tensors = {"cond": cond}
+        if pooled is not None:
+            tensors["pooled"] = pooled
+        c.set(key, tensors)
+    return cond, pooled
@@ -85,6 +85,8 @@ class ControlBase:
         c.upscale_algorithm = self.upscale_algorithm
 
     def inference_memory_requirements(self, dtype):
+        #only the weights not loaded through a model patcher, the activations of the control models are measured with
+        #the model they run with by the memory estimator (see calc_cond_batch)
         if self.previous_controlnet is not None:
             return self.previous_controlnet.inference_memory_requirements(dtype)
         return 0
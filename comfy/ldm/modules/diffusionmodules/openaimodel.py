@@ -844,8 +844,20 @@ class UNetModel(nn.Module):
             assert y.shape[0] == x.shape[0]
             emb = emb + self.label_emb(y)
 
+        #block cache patch: on cached steps only the input and output blocks down to cache depth run, the features
+        #of the deeper blocks come from the last full step
+        block_cache = None
+        cached_h = None
+        cache_output_id = -1
+        if "unet_block_cache" in transformer_patches and control is None and transformer_patches["unet_block_cache"][-1].depth < len(self.input_blocks) - 1:
+            block_cache = transformer_patches["unet_block_cache"][-1]
+            cache_output_id = len(self.output_blocks) - 1 - block_cache.depth
+            cached_h = block_cache.load(x, transformer_options)
+
         h = x
         for id, module in enumerate(self.input_blocks):
+            if cached_h is not None and id > block_cache.depth:
+                break
             transformer_options["block"] = ("input", id)
             h = forward_timestep_embed(module, h, emb, context, transformer_options, time_context=time_context, num_video_frames=num_video_frames, image_only_indicator=image_only_indicator)
             h = apply_control(h, control, 'input')
@@ -861,12 +873,19 @@ class UNetModel(nn.Module):
                     h = p(h, transformer_options)
 
         transformer_options["block"] = ("middle", 0)
-        if self.middle_block is not None:
-            h = forward_timestep_embed(self.middle_block, h, emb, context, transformer_options, time_context=time_context, num_video_frames=num_video_frames, image_only_indicator=image_only_indicator)
-        h = apply_control(h, control, 'middle')
+        if cached_h is not None:
+            h = cached_h
+        else:
+            if self.middle_block is not None:
+                h = forward_timestep_embed(self.middle_block, h, emb, context, transformer_options, time_context=time_context, num_video_frames=num_video_frames, image_only_indicator=image_only_indicator)
+            h = apply_control(h, control, 'middle')
 
 
         for id, module in enumerate(self.output_blocks):
+            if cached_h is not None and id < cache_output_id:
+                continue
+            if block_cache is not None and cached_h is None and id == cache_output_id:
+                block_cache.store(h, transformer_options)
             transformer_options["block"] = ("output", id)
             hsp = hs.pop()
             hsp = apply_control(hsp, control, 'output')
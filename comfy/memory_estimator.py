@@ -0,0 +1,153 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+
+import torch
+
+from comfy.cli_args import args
+import comfy.model_management
+
+def attention_backend():
+    if comfy.model_management.xformers_enabled():
+        return "xformers"
+    elif comfy.model_management.pytorch_attention_enabled():
+        return "pytorch"
+    elif args.use_split_cross_attention:
+        return "split"
+    elif args.use_quad_cross_attention:
+        return "sub_quad"
+    return "default"
+
+def model_key(model, dtype, *extra):
+    return (model.__class__.__name__, str(dtype), attention_backend()) + extra
+
+def control_key(control):
+    """The classes of a chain of control models, they run with the model so their activations are measured with it."""
+    out = []
+    while control is not None:
+        out.append(control.__class__.__name__)
+        control = control.previous_controlnet
+    return tuple(out)
+
+class MemoryEstimator:
+    """Calibration table of the peak memory used by the forward of a model, measured on cuda devices.
+
+    Entries are keyed by the model class, dtype, attention backend and the shape of the input without the batch
+    dimension and hold the highest peak seen for each batch size. The peak of a batch size that wasn't measured
+    is the one of the smallest larger batch measured, or the line through the two largest ones so the memory that
+    doesn't scale with the batch isn't multiplied by it. Models without an entry for a shape use the estimate of
+    their memory formula. The table is saved to path by save_if_updated so the measurements are reused after a
+    restart."""
+    SAFETY_MARGIN = 1.1
+    VERSION = 2
+
+    def __init__(self, path=None):
+        self.path = path
+        self.table = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+        self.saved_updates = 0
+        if path is not None:
+            self.table = self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version", None) == self.VERSION:
+                return data["entries"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning("could not load the memory calibration table {}: {}".format(self.path, e))
+        return {}
+
+    def save_if_updated(self):
+        """Writes the table if it changed since the last save, merged with the file since other processes might
+        have written to it."""
+        if self.path is None or self.saved_updates == self.updates:
+            return
+        with self.lock:
+            self.saved_updates = self.updates
+            table = self.load()
+            for k, peaks in self.table.items():
+                entry = table.setdefault(k, {})
+                for batch, peak in peaks.items():
+                    entry[batch] = max(peak, entry.get(batch, 0))
+            self.table = table
+
+        tmp = "{}.tmp".format(self.path)
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"version": self.VERSION, "entries": table}, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logging.warning("could not save the memory calibration table {}: {}".format(self.path, e))
+
+    def entry_key(self, key, input_shape):
+        return "|".join(list(map(str, key)) + ["x".join(map(str, input_shape[1:]))])
+
+    def peak(self, peaks, batch):
+        larger = [p for b, p in peaks if b >= batch]
+        if len(larger) > 0:
+            return min(larger)
+        b2, p2 = peaks[-1]
+        if len(peaks) == 1:
+            return p2 * batch / b2
+        b1, p1 = peaks[-2]
+        per_item = max((p2 - p1) / (b2 - b1), 0)
+        return p2 + per_item * (batch - b2)
+
+    def measured_peaks(self, key, input_shape):
+        peaks = self.table.get(self.entry_key(key, input_shape), None)
+        if peaks is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return sorted((int(b), p) for b, p in peaks.items())
+
+    def estimate(self, key, input_shape, fallback):
+        peaks = self.measured_peaks(key, input_shape)
+        if peaks is None:
+            return fallback
+        return self.peak(peaks, input_shape[0]) * self.SAFETY_MARGIN
+
+    def max_batch(self, key, input_shape, memory, fallback):
+        """Largest batch up to input_shape[0] that fits in memory, at least 1."""
+        peaks = self.measured_peaks(key, input_shape)
+        if peaks is None:
+            return fallback
+        batch = 1
+        while batch < input_shape[0] and self.peak(peaks, batch + 1) * self.SAFETY_MARGIN < memory:
+            batch += 1
+        return batch
+
+    def record(self, key, input_shape, peak):
+        k = self.entry_key(key, input_shape)
+        batch = str(input_shape[0])
+        with self.lock:
+            peaks = self.table.setdefault(k, {})
+            if peak <= peaks.get(batch, 0):
+                return
+            peaks[batch] = peak
+            self.updates += 1
+
+    @contextlib.contextmanager
+    def measure(self, key, input_shape, device):
+        """Records the peak memory allocated on device while the block runs, nothing is recorded if it raises."""
+        if not comfy.model_management.is_device_cuda(device):
+            yield
+            return
+        start = torch.cuda.memory_allocated(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        yield
+        self.record(key, input_shape, torch.cuda.max_memory_allocated(device) - start)
+
+    def get_stats(self):
+        return {"entries": len(self.table), "hits": self.hits, "misses": self.misses}
+
+estimator = MemoryEstimator(args.memory_calibration_file)
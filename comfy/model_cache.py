@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from comfy.cli_args import args
+import comfy.model_management
+import comfy.model_patcher
+import comfy.weight_dedup
+
+def dtype_options():
+    return tuple((k, v) for k, v in sorted(vars(args).items()) if "fp" in k or "bf16" in k or k in ("cpu", "directml", "lowvram", "novram", "highvram", "gpu_only"))
+
+def loaded_size(obj):
+    if obj is None:
+        return 0
+    elif isinstance(obj, (list, tuple)):
+        return sum(map(loaded_size, obj))
+    elif isinstance(obj, comfy.model_patcher.ModelPatcher):
+        return comfy.model_management.module_size(obj.model, exclude_shared=True)
+    elif isinstance(getattr(obj, "patcher", None), comfy.model_patcher.ModelPatcher):
+        return loaded_size(obj.patcher)
+    return 0
+
+def clone_loaded(obj):
+    """Fresh copy of a cached loader result sharing the weights: models get cloned so patches applied by
+    the caller don't end up in the cache."""
+    if isinstance(obj, tuple):
+        return tuple(map(clone_loaded, obj))
+    elif isinstance(obj, list):
+        return list(map(clone_loaded, obj))
+    elif hasattr(obj, "clone"):
+        return obj.clone()
+    return obj
+
+class ModelCache:
+    """Keeps loaded models in RAM so loading the same file again doesn't read it from disk.
+
+    Entries are keyed by the loader, its options, the dtype command line options and the paths and modification
+    times of the files. The least recently used ones are dropped when they go over max_size bytes. Dropping an
+    entry only drops the reference kept by the cache, models still used by a prompt stay alive."""
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        size = loaded_size(value)
+        if size > self.max_size:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.total_size += size
+            while self.total_size > self.max_size:
+                k, (_, s) = self.entries.popitem(last=False)
+                self.total_size -= s
+                logging.debug("model cache: dropping {}".format(k))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+
+    def get_stats(self):
+        return {"entries": len(self.entries), "size": self.total_size, "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+def tag_source(obj, paths):
+    #the worker pool routes prompts to the worker that has the models of their files loaded
+    paths = frozenset(os.path.abspath(p) for p in paths)
+    for m in comfy.weight_dedup.loaded_modules(obj):
+        m.source_paths = paths
+
+cache = ModelCache(int(args.model_cache_size * 1024 * 1024 * 1024))
+
+def cached_load(name, paths, options, load):
+    """Returns load() or a clone of the result of a previous identical load if it is still cached."""
+    if cache.max_size <= 0:
+        out = load()
+        tag_source(out, paths)
+        comfy.weight_dedup.dedup_loaded(out)
+        return out
+
+    key = (name, repr(options), dtype_options()) + tuple((os.path.abspath(p), os.path.getmtime(p)) for p in paths)
+    out = cache.get(key)
+    if out is None:
+        out = load()
+        tag_source(out, paths)
+        comfy.weight_dedup.dedup_loaded(out)
+        cache.set(key, out)
+    else:
+        logging.info("Using cached model for {}".format(", ".join(paths)))
+    return clone_loaded(out)
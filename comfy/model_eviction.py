@@ -0,0 +1,150 @@
+import weakref
+
+class ModelStats:
+    def __init__(self):
+        self.size = 0
+        self.load_time = None
+        self.loads = 0
+        self.uses = 0
+        self.last_use = 0
+        self.priority = 0.0
+
+    def reload_cost(self):
+        if self.load_time is not None:
+            return self.load_time
+        return self.size / (1024 * 1024 * 1024) #no measurement yet, assume 1GB/s
+
+class EvictionPolicy:
+    """Decides which loaded model free_memory unloads first: the ones with the lowest sort_key.
+
+    Models are identified by their torch module (shared by the clones of a ModelPatcher) and their stats are
+    forgotten when the module is deleted. Recency and frequency use a counter of the loads and uses, not time."""
+    name = "default"
+
+    def __init__(self):
+        self.stats = weakref.WeakKeyDictionary()
+        self.clock = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_time = 0.0
+
+    def model_stats(self, key):
+        s = self.stats.get(key, None)
+        if s is None:
+            s = ModelStats()
+            self.stats[key] = s
+        return s
+
+    def record_load(self, key, size, load_time):
+        s = self.model_stats(key)
+        s.size = size
+        s.load_time = load_time
+        s.loads += 1
+        self.loads += 1
+        self.load_time += load_time
+        self.record_use(key)
+
+    def record_use(self, key):
+        self.clock += 1
+        s = self.model_stats(key)
+        s.uses += 1
+        s.last_use = self.clock
+        self.update_priority(s)
+
+    def record_evict(self, key):
+        self.evictions += 1
+
+    def update_priority(self, s):
+        pass
+
+    def sort_key(self, key, size, refcount):
+        #the models referenced the least (not used by outputs anymore) then the smallest
+        return (refcount, size)
+
+    def get_stats(self):
+        return {"policy": self.name, "models": len(self.stats), "loads": self.loads, "evictions": self.evictions, "load_time": self.load_time}
+
+class LRUPolicy(EvictionPolicy):
+    name = "lru"
+
+    def sort_key(self, key, size, refcount):
+        return self.model_stats(key).last_use
+
+class LFUPolicy(EvictionPolicy):
+    name = "lfu"
+
+    def sort_key(self, key, size, refcount):
+        s = self.model_stats(key)
+        return (s.uses, s.last_use)
+
+class GDSFPolicy(EvictionPolicy):
+    """Greedy Dual Size Frequency: priority = L + uses * reload cost / size, L is raised to the priority of each
+    evicted model so models that haven't been used for a while eventually go even if they are expensive to reload."""
+    name = "gdsf"
+
+    def __init__(self):
+        super().__init__()
+        self.inflation = 0.0
+
+    def update_priority(self, s):
+        s.priority = self.inflation + s.uses * s.reload_cost() / max(s.size, 1)
+
+    def record_evict(self, key):
+        super().record_evict(key)
+        self.inflation = max(self.inflation, self.model_stats(key).priority)
+
+    def sort_key(self, key, size, refcount):
+        s = self.model_stats(key)
+        return (s.priority, s.last_use)
+
+EVICTION_POLICIES = {p.name: p for p in [EvictionPolicy, LRUPolicy, LFUPolicy, GDSFPolicy]}
+
+def get_policy(name):
+    return EVICTION_POLICIES[name]()
+
+class SimulatedModel:
+    def __init__(self, name, size, load_time):
+        self.name = name
+        self.size = size
+        self.load_time = load_time
+
+def simulate(policy, trace, capacity):
+    """Replays a trace of model requests on a device with capacity bytes and returns the reload statistics.
+
+    trace is a list of lists of (name, size, load time) tuples, the models each step needs loaded at the same time,
+    like the models given to load_models_gpu. Models are evicted in the order of the policy until the ones needed
+    fit, loading a model costs its load time."""
+    models = {}
+    loaded = []
+    hits = 0
+    misses = 0
+    evictions = 0
+    reload_time = 0.0
+    for step in trace:
+        needed = []
+        for name, size, load_time in step:
+            if name not in models:
+                models[name] = SimulatedModel(name, size, load_time)
+            needed.append(models[name])
+
+        for m in needed:
+            if m in loaded:
+                hits += 1
+                policy.record_use(m)
+                continue
+
+            misses += 1
+            used = sum(map(lambda a: a.size, loaded))
+            candidates = sorted(filter(lambda a: a not in needed, loaded), key=lambda a: policy.sort_key(a, a.size, 0))
+            for c in candidates:
+                if used + m.size <= capacity:
+                    break
+                loaded.remove(c)
+                policy.record_evict(c)
+                used -= c.size
+                evictions += 1
+            loaded.append(m)
+            reload_time += m.load_time
+            policy.record_load(m, m.size, m.load_time)
+
+    return {"policy": policy.name, "hits": hits, "misses": misses, "evictions": evictions, "reload_time": reload_time}
@@ -5,6 +5,9 @@ from comfy.cli_args import args
 import comfy.utils
 import torch
 import sys
+import time
+import comfy.model_eviction
+import comfy.weight_dedup
 
 class VRAMState(Enum):
     DISABLED = 0    #No vram present: no need to move models to vram
@@ -261,12 +264,21 @@ logging.info("VAE dtype: {}".format(VAE_DTYPE))
 
 current_loaded_models = []
 
-def module_size(module):
+def loaded_model_paths():
+    """Paths of the files the currently loaded models were loaded from, set by comfy.model_cache.cached_load."""
+    paths = set()
+    for m in current_loaded_models:
+        paths.update(getattr(m.model.model, "source_paths", ()))
+    return paths
+
+def module_size(module, exclude_shared=False):
     module_mem = 0
     sd = module.state_dict()
     for k in sd:
         t = sd[k]
         module_mem += t.nelement() * t.element_size()
+    if exclude_shared: #the memory used on the offload device: weights shared with another model are counted by that one
+        module_mem -= comfy.weight_dedup.shared_size(module)
     return module_mem
 
 class LoadedModel:
@@ -275,6 +287,7 @@ class LoadedModel:
         self.device = model.load_device
         self.weights_loaded = False
         self.real_model = None
+        self.partially_unloaded = False
 
     def model_memory(self):
         return self.model.model_size()
@@ -309,11 +322,26 @@ class LoadedModel:
         self.weights_loaded = True
         return self.real_model
 
+    def model_partially_unload(self, memory_to_free):
+        """Offloads only enough of the model to free memory_to_free bytes, returns False if it couldn't."""
+        if not lowvram_available or memory_to_free >= self.model_memory():
+            return False
+        memory_freed = self.model.partially_unload(self.model.offload_device, memory_to_free)
+        if memory_freed > 0:
+            self.partially_unloaded = True
+        return memory_freed >= memory_to_free
+
+    def model_partially_load(self, memory_to_load):
+        """Loads back the offloaded modules of a partially unloaded model that fit in memory_to_load bytes."""
+        if self.model.partially_load(self.device, memory_to_load) > 0:
+            self.partially_unloaded = len(self.model.partially_unloaded_modules) > 0
+
     def model_unload(self, unpatch_weights=True):
         self.model.unpatch_model(self.model.offload_device, unpatch_weights=unpatch_weights)
         self.model.model_patches_to(self.model.offload_device)
         self.weights_loaded = self.weights_loaded and not unpatch_weights
         self.real_model = None
+        self.partially_unloaded = False
 
     def __eq__(self, other):
         return self.model is other.model
@@ -331,9 +359,22 @@ def unload_model_clones(model, unload_weights_only=True, force_unload=True):
         return True
 
     same_weights = 0
+    switch_weights = []
     for i in to_unload:
+        if current_loaded_models[i].model.model_lowvram:
+            #the cast state of the modules of a lowvram or partially unloaded model belongs to the patcher that
+            #loaded it, a clone taking over its weights would never clear it
+            continue
         if model.clone_has_same_weights(current_loaded_models[i].model):
             same_weights += 1
+        elif not force_unload and model.can_switch_patches(current_loaded_models[i].model):
+            #only the keys whose patches differ get updated in place instead of unpatching and patching every weight
+            same_weights += 1
+            switch_weights.append(i)
+
+    if len(switch_weights) != len(to_unload):
+        #the patches are only switched when every loaded clone can be switched, otherwise the weights get unpatched
+        same_weights -= len(switch_weights)
 
     if same_weights == len(to_unload):
         unload_weight = False
@@ -344,34 +385,67 @@ def unload_model_clones(model, unload_weights_only=True, force_unload=True):
         if unload_weights_only and unload_weight == False:
             return None
 
+    if not unload_weight and len(switch_weights) == len(to_unload):
+        logging.debug("switching patches of clone {}".format(switch_weights[0]))
+        model.switch_patches(current_loaded_models[switch_weights[0]].model)
+
     for i in to_unload:
         logging.debug("unload clone {} {}".format(i, unload_weight))
         current_loaded_models.pop(i).model_unload(unpatch_weights=unload_weight)
 
     return unload_weight
 
+eviction_policy = comfy.model_eviction.get_policy(args.model_eviction_policy)
+
+def eviction_key(model):
+    #the clones of a model share their torch module
+    return getattr(model, "model", model)
+
+#functions (device) -> bytes freed of the caches that keep tensors on a device, free_memory drops those before
+#unloading any model since they are cheaper to recompute than the models are to load again
+device_caches = []
+
+def register_device_cache(free_function):
+    device_caches.append(free_function)
+
+def same_device(a, b):
+    #torch.device("cuda") and torch.device("cuda:0") are the same device
+    a = torch.device(a)
+    b = torch.device(b)
+    return a.type == b.type and (a.index or 0) == (b.index or 0)
+
 def free_memory(memory_required, device, keep_loaded=[]):
     unloaded_model = []
     can_unload = []
 
+    if len(device_caches) > 0 and get_free_memory(device) < memory_required:
+        for free_cache in device_caches:
+            free_cache(device)
+
     for i in range(len(current_loaded_models) -1, -1, -1):
         shift_model = current_loaded_models[i]
         if shift_model.device == device:
             if shift_model not in keep_loaded:
-                can_unload.append((sys.getrefcount(shift_model.model), shift_model.model_memory(), i))
+                can_unload.append((eviction_policy.sort_key(eviction_key(shift_model.model), shift_model.model_memory(), sys.getrefcount(shift_model.model)), i))
 
+    partially_unloaded = False
     for x in sorted(can_unload):
         i = x[-1]
         if not DISABLE_SMART_MEMORY:
-            if get_free_memory(device) > memory_required:
+            free_mem = get_free_memory(device)
+            if free_mem > memory_required:
                 break
+            if current_loaded_models[i].model_partially_unload(memory_required - free_mem):
+                partially_unloaded = True
+                continue
+        eviction_policy.record_evict(eviction_key(current_loaded_models[i].model))
         current_loaded_models[i].model_unload()
         unloaded_model.append(i)
 
     for i in sorted(unloaded_model, reverse=True):
         current_loaded_models.pop(i)
 
-    if len(unloaded_model) > 0:
+    if len(unloaded_model) > 0 or partially_unloaded:
         soft_empty_cache()
     else:
         if vram_state != VRAMState.HIGH_VRAM:
@@ -394,7 +468,9 @@ def load_models_gpu(models, memory_required=0):
 
         if loaded_model in current_loaded_models:
             index = current_loaded_models.index(loaded_model)
-            current_loaded_models.insert(0, current_loaded_models.pop(index))
+            loaded_model = current_loaded_models.pop(index)
+            current_loaded_models.insert(0, loaded_model)
+            eviction_policy.record_use(eviction_key(x))
             models_already_loaded.append(loaded_model)
         else:
             if hasattr(x, "model"):
@@ -406,6 +482,7 @@ def load_models_gpu(models, memory_required=0):
         for d in devs:
             if d != torch.device("cpu"):
                 free_memory(extra_mem, d, models_already_loaded)
+        load_offloaded_modules(models_already_loaded, extra_mem)
         return
 
     logging.info(f"Loading {len(models_to_load)} new model{'s' if len(models_to_load) > 1 else ''}")
@@ -444,10 +521,25 @@ def load_models_gpu(models, memory_required=0):
         if vram_set_state == VRAMState.NO_VRAM:
             lowvram_model_memory = 64 * 1024 * 1024
 
+        load_weights = not loaded_model.weights_loaded
+        t = time.perf_counter()
         cur_loaded_model = loaded_model.model_load(lowvram_model_memory)
+        if load_weights:
+            eviction_policy.record_load(eviction_key(model), loaded_model.model_memory(), time.perf_counter() - t)
+        else:
+            eviction_policy.record_use(eviction_key(model))
         current_loaded_models.insert(0, loaded_model)
+    load_offloaded_modules(models_already_loaded, extra_mem)
     return
 
+def load_offloaded_modules(loaded_models, extra_mem):
+    #partially unloaded models run with their offloaded modules cast on use, they are only loaded back in the memory
+    #that is free without unloading anything
+    for loaded_model in loaded_models:
+        if loaded_model.partially_unloaded and not is_device_cpu(loaded_model.device):
+            free_mem = get_free_memory(loaded_model.device) - extra_mem
+            if free_mem > 0:
+                loaded_model.model_partially_load(free_mem)
 
 def load_model_gpu(model):
     return load_models_gpu([model])
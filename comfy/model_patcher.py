@@ -2,10 +2,17 @@ import torch
 import copy
 import inspect
 import logging
+import threading
+import time
 import uuid
+from collections import OrderedDict
 
 import comfy.utils
 import comfy.model_management
+import comfy.weight_streaming
+import comfy.pinned_memory
+import comfy.weight_dedup
+from comfy.cli_args import args
 
 def apply_weight_decompose(dora_scale, weight):
     weight_norm = (
@@ -18,6 +25,148 @@ def apply_weight_decompose(dora_scale, weight):
 
     return weight * (dora_scale / weight_norm)
 
+def is_linear_patch(v):
+    """True if the change a patch makes to the weight is proportional to its strength and doesn't depend on the weight."""
+    if isinstance(v, list):
+        return False
+    if len(v) == 1:
+        return True
+    patch_type, v = v
+    if patch_type == "diff":
+        return True
+    elif patch_type == "lora":
+        return v[4] is None
+    elif patch_type == "lokr":
+        return v[8] is None
+    elif patch_type == "loha":
+        return v[7] is None
+    return False
+
+class PatchCache:
+    """Bounded LRU cache of the full size weight changes reconstructed from low rank patches (lora up @ down,
+    lokr and loha products) so patching the same lora again skips the matmuls.
+
+    Entries are keyed by the identity of the patch tensors, the dtype and the device and keep a reference to the
+    tensors so the ids can't be reused. Nothing is stored on a device that is low on memory."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def contains(self, tensors, dtype, device):
+        return (tuple(map(id, tensors)), dtype, device) in self.entries
+
+    def get(self, tensors, dtype, device, compute):
+        if self.max_size <= 0:
+            return compute()
+
+        key = (tuple(map(id, tensors)), dtype, device)
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        out = compute()
+        self.put(tensors, dtype, device, out)
+        return out
+
+    def put(self, tensors, dtype, device, out):
+        if self.max_size <= 0:
+            return
+        key = (tuple(map(id, tensors)), dtype, device)
+        size = out.nelement() * out.element_size()
+        if size > self.max_size:
+            return
+        if device.type != "cpu" and comfy.model_management.get_free_memory(device) < comfy.model_management.minimum_inference_memory() + size:
+            return
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (out, tensors, size)
+                self.total_size += size
+            while self.total_size > self.max_size:
+                _, e = self.entries.popitem(last=False)
+                self.total_size -= e[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+
+    def free_device(self, device):
+        """Drops the entries stored on device, called by free_memory before it unloads models."""
+        freed = 0
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if comfy.model_management.same_device(key[2], device):
+                    freed += self.entries.pop(key)[2]
+            self.total_size -= freed
+        return freed
+
+    def get_stats(self):
+        return {"entries": len(self.entries), "size": self.total_size, "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+patch_cache = PatchCache(int(args.patch_cache_size * 1024 * 1024 * 1024))
+comfy.model_management.register_device_cache(patch_cache.free_device)
+
+patch_stats = {"patched_weights": 0, "patch_time": 0.0}
+patch_stats_lock = threading.Lock()
+
+def record_patch_time(count, elapsed):
+    with patch_stats_lock:
+        patch_stats["patched_weights"] += count
+        patch_stats["patch_time"] += elapsed
+
+def get_patch_stats():
+    with patch_stats_lock:
+        out = patch_stats.copy()
+    out["cache"] = patch_cache.get_stats()
+    return out
+
+def batched_lora_signature(patches, weight):
+    """Key of the keys whose patches can be applied together with batched matmuls: only plain lora patches
+    (no mid weights or dora) with strength_model 1, None if the patches of this key can't be batched."""
+    sig = [tuple(weight.shape), weight.dtype, weight.device]
+    for p in patches:
+        v = p[1]
+        if p[2] != 1.0 or isinstance(v, list) or len(v) != 2 or v[0] != "lora":
+            return None
+        v = v[1]
+        if v[3] is not None or v[4] is not None or v[0].ndim != v[1].ndim:
+            return None
+        #up @ down must have the shape of the weight, loras of another model version are left to calculate_weight
+        if v[0].shape[0] != weight.shape[0] or v[1].flatten(start_dim=1).shape[1] * v[0].shape[0] != weight.nelement():
+            return None
+        sig.append((tuple(v[0].shape), tuple(v[1].shape), v[0].dtype, v[1].dtype))
+    return tuple(sig)
+
+def same_patch(a, b):
+    """True if two patch values are made of the same tensors, lora loaders create new tuples every time they run."""
+    if a is b:
+        return True
+    if isinstance(a, tuple) and isinstance(b, tuple):
+        return len(a) == len(b) and all(map(same_patch, a, b))
+    if isinstance(a, torch.Tensor) or isinstance(b, torch.Tensor):
+        return False
+    return type(a) == type(b) and not isinstance(a, list) and a == b
+
+def same_patches(a, b):
+    """True if two lists of (strength, patch, strength_model) tuples of a key patch it the same way."""
+    return len(a) == len(b) and all(map(lambda x, y: x[0] == y[0] and x[2] == y[2] and same_patch(x[1], y[1]), a, b))
+
+class LowVramPatch:
+    def __init__(self, key, model_patcher):
+        self.key = key
+        self.model_patcher = model_patcher
+    def __call__(self, weight):
+        return self.model_patcher.calculate_weight(self.model_patcher.patches[self.key], weight, self.key)
+
 def set_model_options_patch_replace(model_options, patch, name, block_name, number, transformer_index=None):
     to = model_options["transformer_options"].copy()
 
@@ -40,6 +189,9 @@ def set_model_options_patch_replace(model_options, patch, name, block_name, numb
     return model_options
 
 class ModelPatcher:
+    MAX_DELTA_UPDATES = 8
+    BATCH_PATCH_MEMORY = 256 * 1024 * 1024
+
     def __init__(self, model, load_device, offload_device, size=0, current_device=None, weight_inplace_update=False):
         self.size = size
         self.model = model
@@ -58,7 +210,9 @@ class ModelPatcher:
 
         self.weight_inplace_update = weight_inplace_update
         self.model_lowvram = False
+        self.partially_unloaded_modules = []
         self.patches_uuid = uuid.uuid4()
+        self.delta_updates = {}
 
     def model_size(self):
         if self.size > 0:
@@ -79,6 +233,7 @@ class ModelPatcher:
         n.model_options = copy.deepcopy(self.model_options)
         n.model_keys = self.model_keys
         n.backup = self.backup
+        n.delta_updates = self.delta_updates
         n.object_patches_backup = self.object_patches_backup
         return n
 
@@ -100,6 +255,10 @@ class ModelPatcher:
             else:
                 return True
 
+        #patched separately (like a lora loaded again) but with the same patches
+        deltas, repatch = self.patch_difference(clone)
+        return len(deltas) == 0 and len(repatch) == 0
+
     def memory_required(self, input_shape):
         return self.model.memory_required(input_shape=input_shape)
 
@@ -234,12 +393,13 @@ class ModelPatcher:
         if key not in self.patches:
             return
 
+        start = time.perf_counter()
         weight = comfy.utils.get_attr(self.model, key)
 
         inplace_update = self.weight_inplace_update
 
         if key not in self.backup:
-            self.backup[key] = weight.to(device=self.offload_device, copy=inplace_update)
+            self.backup[key] = comfy.pinned_memory.backup_weight(weight, self.offload_device, copy=inplace_update)
 
         if device_to is not None:
             temp_weight = comfy.model_management.cast_to_device(weight, device_to, torch.float32, copy=True)
@@ -250,6 +410,93 @@ class ModelPatcher:
             comfy.utils.copy_to_param(self.model, key, out_weight)
         else:
             comfy.utils.set_attr_param(self.model, key, out_weight)
+        record_patch_time(1, time.perf_counter() - start)
+
+    def strength_delta(self, key, applied):
+        """Returns the patches that turn a weight patched with the applied patches into one patched with self.patches[key],
+        or None when they don't only differ by the strength of linear patches."""
+        patches = self.patches.get(key, [])
+        if len(patches) != len(applied):
+            return None
+        delta = []
+        for new, old in zip(patches, applied):
+            if not same_patch(new[1], old[1]) or new[2] != 1.0 or old[2] != 1.0 or not is_linear_patch(new[1]):
+                return None
+            if new[0] != old[0]:
+                delta.append((new[0] - old[0], new[1], 1.0))
+        return delta
+
+    def patch_difference(self, clone):
+        """Compares our patches with the ones of a clone key by key. Returns the strength deltas of the keys where
+        only the strength of linear patches changed and the list of the other keys whose patches differ."""
+        deltas = {}
+        repatch = []
+        for key in self.patches.keys() | clone.patches.keys():
+            applied = clone.patches.get(key, [])
+            if same_patches(self.patches.get(key, []), applied):
+                continue
+            delta = self.strength_delta(key, applied)
+            if delta is None:
+                repatch.append(key)
+            elif len(delta) > 0:
+                deltas[key] = delta
+        return deltas, repatch
+
+    def can_switch_patches(self, clone):
+        """True if the weights patched by a loaded clone can be turned into ours by only updating the keys whose patches differ."""
+        if not self.is_clone(clone) or clone.model_lowvram:
+            return False
+        deltas, repatch = self.patch_difference(clone)
+        for key in repatch:
+            if key not in self.model_keys:
+                return False
+            if key in clone.patches and key not in self.backup:
+                return False
+        return True
+
+    def switch_patches(self, clone):
+        """Updates the weights patched by a loaded clone in place so they match our patches.
+
+        Only the keys whose patches differ are touched. When only the strength of linear patches changed the difference
+        between the old and new contribution is added to the weight, every MAX_DELTA_UPDATES updates of a key its weight
+        is recomputed from the backup so rounding errors in low precision weights don't accumulate. The other keys are
+        restored from the backup and patched again, or just restored when we don't patch them."""
+        deltas, repatch = self.patch_difference(clone)
+        for key, delta in deltas.items():
+            start = time.perf_counter()
+            weight = comfy.utils.get_attr(self.model, key)
+            count = self.delta_updates.get(key, 0) + 1
+            if count > self.MAX_DELTA_UPDATES and key in self.backup:
+                temp_weight = comfy.model_management.cast_to_device(self.backup[key], weight.device, torch.float32, copy=True)
+                out_weight = self.calculate_weight(self.patches[key], temp_weight, key).to(weight.dtype)
+                count = 0
+            else:
+                temp_weight = weight.to(torch.float32, copy=True)
+                out_weight = self.calculate_weight(delta, temp_weight, key).to(weight.dtype)
+            self.delta_updates[key] = count
+            if self.weight_inplace_update:
+                comfy.utils.copy_to_param(self.model, key, out_weight)
+            else:
+                comfy.utils.set_attr_param(self.model, key, out_weight)
+            record_patch_time(1, time.perf_counter() - start)
+
+        for key in repatch:
+            if key in self.backup:
+                weight = comfy.utils.get_attr(self.model, key)
+                if key in self.patches:
+                    original = self.backup[key]
+                else:
+                    original = self.backup.pop(key)
+                if self.weight_inplace_update:
+                    comfy.utils.copy_to_param(self.model, key, original)
+                else:
+                    comfy.utils.set_attr_param(self.model, key, original.to(weight.device))
+            self.delta_updates.pop(key, None)
+            self.patch_weight_to_device(key)
+
+        if len(repatch) > 0:
+            logging.debug("switched patches: {} strength updates, {} keys patched again".format(len(deltas), len(repatch)))
+        self.current_device = clone.current_device
 
     def patch_model(self, device_to=None, patch_weights=True):
         for k in self.object_patches:
@@ -259,31 +506,99 @@ class ModelPatcher:
 
         if patch_weights:
             model_sd = self.model_state_dict()
+            keys = []
             for key in self.patches:
                 if key not in model_sd:
                     logging.warning("could not patch. key doesn't exist in model: {}".format(key))
                     continue
+                keys.append(key)
 
-                self.patch_weight_to_device(key, device_to)
+            done = self.patch_weights_batched(keys, device_to)
+            for key in keys:
+                if key not in done:
+                    self.patch_weight_to_device(key, device_to)
 
             if device_to is not None:
-                self.model.to(device_to)
+                comfy.pinned_memory.move_module(self.model, device_to)
                 self.current_device = device_to
 
         return self.model
 
+    def patch_weights_batched(self, keys, device_to=None):
+        """Patches the weights that have the same shape and the same kind of lora patches together: the up and down
+        matrices of each group are stacked and multiplied with one bmm instead of one small mm per key.
+
+        Groups are split in chunks of at most BATCH_PATCH_MEMORY bytes of fp32 weights. Keys that can't be batched
+        or whose products are already in the patch cache are left to patch_weight_to_device. Returns the keys patched."""
+        groups = {}
+        for key in keys:
+            weight = comfy.utils.get_attr(self.model, key)
+            sig = batched_lora_signature(self.patches[key], weight)
+            if sig is None:
+                continue
+            device = weight.device if device_to is None else torch.device(device_to)
+            if all(map(lambda p: patch_cache.contains((p[1][1][0], p[1][1][1], None), torch.float32, device), self.patches[key])):
+                continue
+            groups.setdefault(sig, []).append(key)
+
+        done = set()
+        for sig, group in groups.items():
+            if len(group) < 2:
+                continue
+            weight_bytes = max(1, comfy.utils.get_attr(self.model, group[0]).nelement() * 4)
+            chunk_size = max(1, self.BATCH_PATCH_MEMORY // weight_bytes)
+            for i in range(0, len(group), chunk_size):
+                try:
+                    self.patch_weight_group(group[i:i + chunk_size], device_to)
+                except Exception as e:
+                    logging.warning("batched lora patching failed, patching the keys one by one: {}".format(e))
+                    continue
+                done.update(group[i:i + chunk_size])
+        return done
+
+    def patch_weight_group(self, keys, device_to=None):
+        start = time.perf_counter()
+        weights = [comfy.utils.get_attr(self.model, key) for key in keys]
+        device = weights[0].device if device_to is None else device_to
+        inplace_update = self.weight_inplace_update
+
+        for key, weight in zip(keys, weights):
+            if key not in self.backup:
+                self.backup[key] = comfy.pinned_memory.backup_weight(weight, self.offload_device, copy=inplace_update)
+
+        temp_weights = torch.stack([comfy.model_management.cast_to_device(w, device, torch.float32) for w in weights])
+        temp_weights = temp_weights.reshape(len(keys), weights[0].shape[0], -1)
+        for j in range(len(self.patches[keys[0]])):
+            patches = [self.patches[key][j] for key in keys]
+            ups = torch.stack([comfy.model_management.cast_to_device(p[1][1][0], device, torch.float32).flatten(start_dim=1) for p in patches])
+            downs = torch.stack([comfy.model_management.cast_to_device(p[1][1][1], device, torch.float32).flatten(start_dim=1) for p in patches])
+            alphas = []
+            for p in patches:
+                alpha = p[0]
+                v = p[1][1]
+                if v[2] is not None:
+                    alpha *= v[2] / v[1].shape[0]
+                alphas.append(alpha)
+            diffs = torch.bmm(ups, downs)
+            if patch_cache.max_size > 0:
+                for p, diff in zip(patches, diffs):
+                    patch_cache.put((p[1][1][0], p[1][1][1], None), torch.float32, diffs.device, diff.clone())
+            temp_weights += torch.tensor(alphas, dtype=torch.float32, device=diffs.device).reshape(-1, 1, 1) * diffs
+
+        for key, weight, out_weight in zip(keys, weights, temp_weights):
+            out_weight = out_weight.reshape(weight.shape).to(weight.dtype, copy=True)
+            if inplace_update:
+                comfy.utils.copy_to_param(self.model, key, out_weight)
+            else:
+                comfy.utils.set_attr_param(self.model, key, out_weight)
+        record_patch_time(len(keys), time.perf_counter() - start)
+
     def patch_model_lowvram(self, device_to=None, lowvram_model_memory=0):
         self.patch_model(device_to, patch_weights=False)
 
         logging.info("loading in lowvram mode {}".format(lowvram_model_memory/(1024 * 1024)))
-        class LowVramPatch:
-            def __init__(self, key, model_patcher):
-                self.key = key
-                self.model_patcher = model_patcher
-            def __call__(self, weight):
-                return self.model_patcher.calculate_weight(self.model_patcher.patches[self.key], weight, self.key)
-
         mem_counter = 0
+        streamed = []
         for n, m in self.model.named_modules():
             lowvram_weight = False
             if hasattr(m, "comfy_cast_weights"):
@@ -302,17 +617,93 @@ class ModelPatcher:
 
                 m.prev_comfy_cast_weights = m.comfy_cast_weights
                 m.comfy_cast_weights = True
+                streamed.append(m)
             else:
                 if hasattr(m, "weight"):
                     self.patch_weight_to_device(weight_key, device_to)
                     self.patch_weight_to_device(bias_key, device_to)
-                    m.to(device_to)
+                    comfy.pinned_memory.move_module(m, device_to)
                     mem_counter += comfy.model_management.module_size(m)
                     logging.debug("lowvram: loaded module regularly {}".format(m))
 
+        if args.stream_weights and len(streamed) > 0:
+            streamer = comfy.weight_streaming.WeightStreamer(streamed, device_to)
+            for m in streamed:
+                m.weight_streamer = streamer
+
         self.model_lowvram = True
         return self.model
 
+    def partially_unload(self, device_to, memory_to_free=0):
+        """Moves the modules of a loaded model to device_to, starting from the last ones, until memory_to_free bytes
+        are freed. The moved modules get their original weights back and are cast to the load device (and patched)
+        when they run like in lowvram mode. Returns the number of bytes freed.
+
+        Every layer of a diffusion model runs at every step so there is no per layer usage to pick the least used
+        ones by, the last modules go first and partially_load brings the first ones back first."""
+        memory_freed = 0
+        for n, m in reversed(list(self.model.named_modules())):
+            if memory_freed >= memory_to_free:
+                break
+            if not hasattr(m, "comfy_cast_weights") or hasattr(m, "prev_comfy_cast_weights"):
+                continue
+            weight = getattr(m, "weight", None)
+            if weight is None or weight.device == torch.device(device_to):
+                continue
+
+            weight_key = "{}.weight".format(n)
+            bias_key = "{}.bias".format(n)
+            for key in (weight_key, bias_key):
+                if key in self.backup:
+                    if self.weight_inplace_update:
+                        comfy.utils.copy_to_param(self.model, key, self.backup.pop(key))
+                    else:
+                        comfy.utils.set_attr_param(self.model, key, self.backup.pop(key))
+                    self.delta_updates.pop(key, None)
+            if weight_key in self.patches:
+                m.weight_function = LowVramPatch(weight_key, self)
+            if bias_key in self.patches:
+                m.bias_function = LowVramPatch(bias_key, self)
+
+            module_mem = comfy.model_management.module_size(m)
+            comfy.pinned_memory.move_module(m, device_to)
+            m.prev_comfy_cast_weights = m.comfy_cast_weights
+            m.comfy_cast_weights = True
+            self.partially_unloaded_modules.append(n)
+            memory_freed += module_mem
+            logging.debug("partially unloaded module {}".format(n))
+
+        if memory_freed > 0:
+            self.model_lowvram = True
+            comfy.weight_dedup.reshare(self.model, exclude=self.backup.keys() | self.patches.keys())
+        return memory_freed
+
+    def partially_load(self, device_to, memory_to_load=0):
+        """Moves the modules partially_unload offloaded back to device_to and patches them while they fit in
+        memory_to_load bytes. Returns the number of bytes loaded."""
+        memory_loaded = 0
+        while len(self.partially_unloaded_modules) > 0:
+            n = self.partially_unloaded_modules[-1]
+            m = self.model.get_submodule(n)
+            module_mem = comfy.model_management.module_size(m)
+            if memory_loaded + module_mem > memory_to_load:
+                break
+
+            m.weight_function = None
+            m.bias_function = None
+            self.patch_weight_to_device("{}.weight".format(n), device_to)
+            self.patch_weight_to_device("{}.bias".format(n), device_to)
+            comfy.pinned_memory.move_module(m, device_to)
+            m.comfy_cast_weights = m.prev_comfy_cast_weights
+            del m.prev_comfy_cast_weights
+            self.partially_unloaded_modules.pop()
+            memory_loaded += module_mem
+            logging.debug("partially loaded module {}".format(n))
+
+        if memory_loaded > 0:
+            self.model_lowvram = any(map(lambda m: hasattr(m, "prev_comfy_cast_weights"), self.model.modules()))
+        return memory_loaded
+
     def calculate_weight(self, patches, weight, key):
         for p in patches:
             alpha = p[0]
@@ -339,18 +730,23 @@ class ModelPatcher:
                     else:
                         weight += alpha * comfy.model_management.cast_to_device(w1, weight.device, weight.dtype)
             elif patch_type == "lora": #lora/locon
-                mat1 = comfy.model_management.cast_to_device(v[0], weight.device, torch.float32)
-                mat2 = comfy.model_management.cast_to_device(v[1], weight.device, torch.float32)
                 dora_scale = v[4]
                 if v[2] is not None:
-                    alpha *= v[2] / mat2.shape[0]
-                if v[3] is not None:
-                    #locon mid weights, hopefully the math is fine because I didn't properly test it
-                    mat3 = comfy.model_management.cast_to_device(v[3], weight.device, torch.float32)
-                    final_shape = [mat2.shape[1], mat2.shape[0], mat3.shape[2], mat3.shape[3]]
-                    mat2 = torch.mm(mat2.transpose(0, 1).flatten(start_dim=1), mat3.transpose(0, 1).flatten(start_dim=1)).reshape(final_shape).transpose(0, 1)
+                    alpha *= v[2] / v[1].shape[0]
+
+                def lora_diff(v=v, device=weight.device):
+                    mat1 = comfy.model_management.cast_to_device(v[0], device, torch.float32)
+                    mat2 = comfy.model_management.cast_to_device(v[1], device, torch.float32)
+                    if v[3] is not None:
+                        #locon mid weights, hopefully the math is fine because I didn't properly test it
+                        mat3 = comfy.model_management.cast_to_device(v[3], device, torch.float32)
+                        final_shape = [mat2.shape[1], mat2.shape[0], mat3.shape[2], mat3.shape[3]]
+                        mat2 = torch.mm(mat2.transpose(0, 1).flatten(start_dim=1), mat3.transpose(0, 1).flatten(start_dim=1)).reshape(final_shape).transpose(0, 1)
+                    return torch.mm(mat1.flatten(start_dim=1), mat2.flatten(start_dim=1))
+
                 try:
-                    weight += (alpha * torch.mm(mat1.flatten(start_dim=1), mat2.flatten(start_dim=1))).reshape(weight.shape).type(weight.dtype)
+                    diff = patch_cache.get((v[0], v[1], v[3]), torch.float32, weight.device, lora_diff)
+                    weight += (alpha * diff).reshape(weight.shape).type(weight.dtype)
                     if dora_scale is not None:
                         weight = apply_weight_decompose(comfy.model_management.cast_to_device(dora_scale, weight.device, torch.float32), weight)
                 except Exception as e:
@@ -365,34 +761,39 @@ class ModelPatcher:
                 t2 = v[7]
                 dora_scale = v[8]
                 dim = None
-
                 if w1 is None:
                     dim = w1_b.shape[0]
-                    w1 = torch.mm(comfy.model_management.cast_to_device(w1_a, weight.device, torch.float32),
-                                  comfy.model_management.cast_to_device(w1_b, weight.device, torch.float32))
-                else:
-                    w1 = comfy.model_management.cast_to_device(w1, weight.device, torch.float32)
-
                 if w2 is None:
                     dim = w2_b.shape[0]
-                    if t2 is None:
-                        w2 = torch.mm(comfy.model_management.cast_to_device(w2_a, weight.device, torch.float32),
-                                      comfy.model_management.cast_to_device(w2_b, weight.device, torch.float32))
-                    else:
-                        w2 = torch.einsum('i j k l, j r, i p -> p r k l',
-                                          comfy.model_management.cast_to_device(t2, weight.device, torch.float32),
-                                          comfy.model_management.cast_to_device(w2_b, weight.device, torch.float32),
-                                          comfy.model_management.cast_to_device(w2_a, weight.device, torch.float32))
-                else:
-                    w2 = comfy.model_management.cast_to_device(w2, weight.device, torch.float32)
-
-                if len(w2.shape) == 4:
-                    w1 = w1.unsqueeze(2).unsqueeze(2)
                 if v[2] is not None and dim is not None:
                     alpha *= v[2] / dim
 
+                def lokr_diff(w1=w1, w2=w2, w1_a=w1_a, w1_b=w1_b, w2_a=w2_a, w2_b=w2_b, t2=t2, device=weight.device):
+                    if w1 is None:
+                        w1 = torch.mm(comfy.model_management.cast_to_device(w1_a, device, torch.float32),
+                                      comfy.model_management.cast_to_device(w1_b, device, torch.float32))
+                    else:
+                        w1 = comfy.model_management.cast_to_device(w1, device, torch.float32)
+
+                    if w2 is None:
+                        if t2 is None:
+                            w2 = torch.mm(comfy.model_management.cast_to_device(w2_a, device, torch.float32),
+                                          comfy.model_management.cast_to_device(w2_b, device, torch.float32))
+                        else:
+                            w2 = torch.einsum('i j k l, j r, i p -> p r k l',
+                                              comfy.model_management.cast_to_device(t2, device, torch.float32),
+                                              comfy.model_management.cast_to_device(w2_b, device, torch.float32),
+                                              comfy.model_management.cast_to_device(w2_a, device, torch.float32))
+                    else:
+                        w2 = comfy.model_management.cast_to_device(w2, device, torch.float32)
+
+                    if len(w2.shape) == 4:
+                        w1 = w1.unsqueeze(2).unsqueeze(2)
+                    return torch.kron(w1, w2)
+
                 try:
-                    weight += alpha * torch.kron(w1, w2).reshape(weight.shape).type(weight.dtype)
+                    diff = patch_cache.get((w1, w2, w1_a, w1_b, w2_a, w2_b, t2), torch.float32, weight.device, lokr_diff)
+                    weight += alpha * diff.reshape(weight.shape).type(weight.dtype)
                     if dora_scale is not None:
                         weight = apply_weight_decompose(comfy.model_management.cast_to_device(dora_scale, weight.device, torch.float32), weight)
                 except Exception as e:
@@ -405,26 +806,31 @@ class ModelPatcher:
                 w2a = v[3]
                 w2b = v[4]
                 dora_scale = v[7]
-                if v[5] is not None: #cp decomposition
-                    t1 = v[5]
-                    t2 = v[6]
-                    m1 = torch.einsum('i j k l, j r, i p -> p r k l',
-                                      comfy.model_management.cast_to_device(t1, weight.device, torch.float32),
-                                      comfy.model_management.cast_to_device(w1b, weight.device, torch.float32),
-                                      comfy.model_management.cast_to_device(w1a, weight.device, torch.float32))
-
-                    m2 = torch.einsum('i j k l, j r, i p -> p r k l',
-                                      comfy.model_management.cast_to_device(t2, weight.device, torch.float32),
-                                      comfy.model_management.cast_to_device(w2b, weight.device, torch.float32),
-                                      comfy.model_management.cast_to_device(w2a, weight.device, torch.float32))
-                else:
-                    m1 = torch.mm(comfy.model_management.cast_to_device(w1a, weight.device, torch.float32),
-                                  comfy.model_management.cast_to_device(w1b, weight.device, torch.float32))
-                    m2 = torch.mm(comfy.model_management.cast_to_device(w2a, weight.device, torch.float32),
-                                  comfy.model_management.cast_to_device(w2b, weight.device, torch.float32))
+
+                def loha_diff(v=v, device=weight.device):
+                    w1a, w1b, w2a, w2b = v[0], v[1], v[3], v[4]
+                    if v[5] is not None: #cp decomposition
+                        t1 = v[5]
+                        t2 = v[6]
+                        m1 = torch.einsum('i j k l, j r, i p -> p r k l',
+                                          comfy.model_management.cast_to_device(t1, device, torch.float32),
+                                          comfy.model_management.cast_to_device(w1b, device, torch.float32),
+                                          comfy.model_management.cast_to_device(w1a, device, torch.float32))
+
+                        m2 = torch.einsum('i j k l, j r, i p -> p r k l',
+                                          comfy.model_management.cast_to_device(t2, device, torch.float32),
+                                          comfy.model_management.cast_to_device(w2b, device, torch.float32),
+                                          comfy.model_management.cast_to_device(w2a, device, torch.float32))
+                    else:
+                        m1 = torch.mm(comfy.model_management.cast_to_device(w1a, device, torch.float32),
+                                      comfy.model_management.cast_to_device(w1b, device, torch.float32))
+                        m2 = torch.mm(comfy.model_management.cast_to_device(w2a, device, torch.float32),
+                                      comfy.model_management.cast_to_device(w2b, device, torch.float32))
+                    return m1 * m2
 
                 try:
-                    weight += (alpha * m1 * m2).reshape(weight.shape).type(weight.dtype)
+                    diff = patch_cache.get((w1a, w1b, w2a, w2b, v[5], v[6]), torch.float32, weight.device, loha_diff)
+                    weight += (alpha * diff).reshape(weight.shape).type(weight.dtype)
                     if dora_scale is not None:
                         weight = apply_weight_decompose(comfy.model_management.cast_to_device(dora_scale, weight.device, torch.float32), weight)
                 except Exception as e:
@@ -458,10 +864,14 @@ class ModelPatcher:
                     if hasattr(m, "prev_comfy_cast_weights"):
                         m.comfy_cast_weights = m.prev_comfy_cast_weights
                         del m.prev_comfy_cast_weights
+                    if getattr(m, "weight_streamer", None) is not None:
+                        m.weight_streamer.reset()
+                        m.weight_streamer = None
                     m.weight_function = None
                     m.bias_function = None
 
                 self.model_lowvram = False
+                self.partially_unloaded_modules = []
 
             keys = list(self.backup.keys())
 
@@ -473,10 +883,12 @@ class ModelPatcher:
                     comfy.utils.set_attr_param(self.model, k, self.backup[k])
 
             self.backup.clear()
+            self.delta_updates.clear()
 
             if device_to is not None:
-                self.model.to(device_to)
+                comfy.pinned_memory.move_module(self.model, device_to)
                 self.current_device = device_to
+                comfy.weight_dedup.reshare(self.model, exclude=self.patches.keys())
 
         keys = list(self.object_patches_backup.keys())
         for k in keys:
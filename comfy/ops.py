@@ -20,6 +20,9 @@ import torch
 import comfy.model_management
 
 def cast_bias_weight(s, input):
+    weight_streamer = getattr(s, "weight_streamer", None)
+    if weight_streamer is not None:
+        return weight_streamer.cast_bias_weight(s, input)
     bias = None
     non_blocking = comfy.model_management.device_supports_non_blocking(input.device)
     if s.bias is not None:
@@ -35,6 +38,7 @@ class CastWeightBiasOp:
     comfy_cast_weights = False
     weight_function = None
     bias_function = None
+    weight_streamer = None
 
 class disable_weight_init:
     class Linear(torch.nn.Linear, CastWeightBiasOp):
@@ -0,0 +1,169 @@
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+import torch
+
+from comfy.cli_args import args
+import comfy.model_management
+
+class PageableBackend:
+    """Plain cpu memory, used when there is no device to pin memory for so the pool logic is the same everywhere."""
+    name = "pageable"
+    non_blocking = False
+
+    def alloc(self, size):
+        return torch.empty((size,), dtype=torch.uint8)
+
+    def synchronize(self):
+        pass
+
+class PinnedBackend(PageableBackend):
+    """Page locked memory, copies between it and the device can run asynchronously."""
+    name = "pinned"
+    non_blocking = True
+
+    def alloc(self, size):
+        return torch.empty((size,), dtype=torch.uint8, pin_memory=True)
+
+    def synchronize(self):
+        torch.cuda.synchronize()
+
+def get_backend():
+    if torch.cuda.is_available() and comfy.model_management.is_device_cuda(comfy.model_management.get_torch_device()):
+        return PinnedBackend()
+    return PageableBackend()
+
+class HostMemoryPool:
+    """Reusable host buffers the weights of offloaded models are moved to.
+
+    Buffers are owned by the module they hold the weights of (module.host_buffers) while it is offloaded and go back
+    to the pool when it is loaded again. The pool never allocates more than max_size bytes: the least recently freed
+    buffers are dropped to make room and when that isn't enough the weight is offloaded to regular memory."""
+    ALIGNMENT = 4096
+
+    def __init__(self, max_size, backend=None):
+        self.max_size = max_size
+        if backend is None:
+            backend = get_backend()
+        self.backend = backend
+        self.free = OrderedDict()
+        self.free_size = 0
+        self.in_use = set()
+        self.in_use_size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.allocations = 0
+        self.fallbacks = 0
+
+    def buffer_size(self, nbytes):
+        return (nbytes + self.ALIGNMENT - 1) // self.ALIGNMENT * self.ALIGNMENT
+
+    def drop_free(self, key):
+        buffers = self.free[key]
+        buffers.pop(0)
+        if len(buffers) == 0:
+            self.free.pop(key)
+        self.free_size -= key
+
+    def get(self, nbytes):
+        size = self.buffer_size(nbytes)
+        with self.lock:
+            buffers = self.free.get(size, None)
+            if buffers:
+                buf = buffers.pop()
+                if len(buffers) == 0:
+                    self.free.pop(size)
+                self.free_size -= size
+                self.hits += 1
+            else:
+                while self.in_use_size + self.free_size + size > self.max_size and len(self.free) > 0:
+                    self.drop_free(next(iter(self.free)))
+                if self.in_use_size + self.free_size + size > self.max_size:
+                    self.fallbacks += 1
+                    return None
+                buf = self.backend.alloc(size)
+                self.allocations += 1
+                weakref.finalize(buf, self.forget, id(buf), size)
+            self.in_use.add(id(buf))
+            self.in_use_size += size
+        return buf
+
+    def forget(self, buf_id, size):
+        #an offloaded module holding the buffer was deleted
+        with self.lock:
+            if buf_id in self.in_use:
+                self.in_use.discard(buf_id)
+                self.in_use_size -= size
+
+    def release(self, buf):
+        size = buf.nelement()
+        with self.lock:
+            if id(buf) not in self.in_use:
+                return
+            self.in_use.discard(id(buf))
+            self.in_use_size -= size
+            self.free.setdefault(size, []).append(buf)
+            self.free.move_to_end(size)
+            self.free_size += size
+
+    def clear(self):
+        with self.lock:
+            self.free.clear()
+            self.free_size = 0
+
+    def get_stats(self):
+        return {"backend": self.backend.name, "max_size": self.max_size, "in_use": self.in_use_size, "free": self.free_size,
+                "hits": self.hits, "allocations": self.allocations, "fallbacks": self.fallbacks}
+
+    def offload_module(self, module, device):
+        """Moves the parameters and buffers of a module that aren't on the offload device into pool buffers."""
+        for m in module.modules():
+            host_buffers = m.__dict__.setdefault("host_buffers", {})
+            for tensors in (m._parameters, m._buffers):
+                for name, t in tensors.items():
+                    if t is None or t.device == device:
+                        continue
+                    buf = self.get(t.nelement() * t.element_size())
+                    if buf is None:
+                        host = t.to(device)
+                    else:
+                        host = buf[:t.nelement() * t.element_size()].view(t.dtype).view(t.shape)
+                        host.copy_(t, non_blocking=self.backend.non_blocking)
+                        host_buffers[name] = buf
+                    if isinstance(t, torch.nn.Parameter):
+                        t.data = host
+                    else:
+                        tensors[name] = host
+        self.backend.synchronize()
+
+    def load_module(self, module, device):
+        """Moves a module to the device and gives the pool buffers it held back to the pool."""
+        module.to(device, non_blocking=self.backend.non_blocking)
+        for m in module.modules():
+            host_buffers = m.__dict__.pop("host_buffers", {})
+            for buf in host_buffers.values():
+                self.release(buf)
+
+pool = None
+if args.pinned_memory_size > 0:
+    pool = HostMemoryPool(int(args.pinned_memory_size * 1024 * 1024 * 1024))
+    logging.info("Host memory pool for offloaded weights: {} {} MB".format(pool.backend.name, pool.max_size / (1024 * 1024)))
+
+def move_module(module, device):
+    """module.to(device) that keeps offloaded weights in the host memory pool when it is enabled."""
+    if pool is None:
+        return module.to(device)
+    if comfy.model_management.is_device_cpu(device):
+        pool.offload_module(module, torch.device(device))
+    else:
+        pool.load_module(module, device)
+    return module
+
+def backup_weight(weight, device, copy=False):
+    """weight.to(device) for the backups of patched weights. Offloaded weights can be views of pool buffers that
+    go back to the pool when their module is loaded, the backups of those are always copies."""
+    if pool is not None and weight.device.type == "cpu":
+        copy = True
+    return weight.to(device=device, copy=copy)
@@ -66,6 +66,12 @@ def prepare_sampling(model, noise_shape, conds):
 
     return real_model, conds, models
 
+def cleanup_model_patches(model_options):
+    """cleanup the state model patches kept during sampling"""
+    patches = model_options.get("transformer_options", {}).get("patches", {})
+    for name in patches:
+        cleanup_additional_models(patches[name])
+
 def cleanup_models(conds, models):
     cleanup_additional_models(models)
 
@@ -6,25 +6,36 @@ from comfy import model_management
 import math
 import logging
 import comfy.sampler_helpers
-
-def get_area_and_mult(conds, x_in, timestep_in):
-    area = (x_in.shape[2], x_in.shape[3], 0, 0)
+import comfy.memory_estimator
+
+#uniform: the cond covers the whole latent with the same weight everywhere
+cond_obj = collections.namedtuple('cond_obj', ['input_x', 'mult', 'conditioning', 'area', 'control', 'patches', 'uniform'], defaults=(False,))
+compiled_cond = collections.namedtuple('compiled_cond', ['shape', 'device', 'dtype', 'area', 'mult', 'conditioning', 'patches', 'uniform'])
+
+def feather_ramp(size, start, end, total, rr=8):
+    #the weights of the rows (or columns) of an area that fade out over rr pixels at the edges that aren't the latent edges
+    ramp = torch.ones((size,))
+    if start != 0:
+        for t in range(rr):
+            ramp[t:1+t] *= ((1.0/rr) * (t + 1))
+    if end < total:
+        for t in range(rr):
+            ramp[size - 1 - t:size - t] *= ((1.0/rr) * (t + 1))
+    return ramp
+
+def compile_cond(conds, shape, device, dtype):
+    """The parts of get_area_and_mult that only depend on the shape of the input: the area, the (feathered) mask
+    multiplier, the processed model conds and the gligen patch."""
+    area = (shape[2], shape[3], 0, 0)
     strength = 1.0
 
-    if 'timestep_start' in conds:
-        timestep_start = conds['timestep_start']
-        if timestep_in[0] > timestep_start:
-            return None
-    if 'timestep_end' in conds:
-        timestep_end = conds['timestep_end']
-        if timestep_in[0] < timestep_end:
-            return None
     if 'area' in conds:
         area = conds['area']
     if 'strength' in conds:
         strength = conds['strength']
 
-    input_x = x_in[:,:,area[2]:area[0] + area[2],area[3]:area[1] + area[3]]
+    input_shape = list(shape[:2]) + [min(area[0], shape[2] - area[2]), min(area[1], shape[3] - area[3])]
+    uniform = 'mask' not in conds and area[2] == 0 and area[3] == 0 and input_shape[2:] == list(shape[2:]) and strength != 0
     if 'mask' in conds:
         # Scale the mask to the size of the input
         # The mask should have been resized as we began the sampling process
@@ -32,35 +43,21 @@ def get_area_and_mult(conds, x_in, timestep_in):
         if "mask_strength" in conds:
             mask_strength = conds["mask_strength"]
         mask = conds['mask']
-        assert(mask.shape[1] == x_in.shape[2])
-        assert(mask.shape[2] == x_in.shape[3])
+        assert(mask.shape[1] == shape[2])
+        assert(mask.shape[2] == shape[3])
         mask = mask[:,area[2]:area[0] + area[2],area[3]:area[1] + area[3]] * mask_strength
-        mask = mask.unsqueeze(1).repeat(input_x.shape[0] // mask.shape[0], input_x.shape[1], 1, 1)
+        mask = mask.unsqueeze(1).repeat(input_shape[0] // mask.shape[0], input_shape[1], 1, 1).to(device)
+        mult = mask * strength
     else:
-        mask = torch.ones_like(input_x)
-    mult = mask * strength
-
-    if 'mask' not in conds:
-        rr = 8
-        if area[2] != 0:
-            for t in range(rr):
-                mult[:,:,t:1+t,:] *= ((1.0/rr) * (t + 1))
-        if (area[0] + area[2]) < x_in.shape[2]:
-            for t in range(rr):
-                mult[:,:,area[0] - 1 - t:area[0] - t,:] *= ((1.0/rr) * (t + 1))
-        if area[3] != 0:
-            for t in range(rr):
-                mult[:,:,:,t:1+t] *= ((1.0/rr) * (t + 1))
-        if (area[1] + area[3]) < x_in.shape[3]:
-            for t in range(rr):
-                mult[:,:,:,area[1] - 1 - t:area[1] - t] *= ((1.0/rr) * (t + 1))
+        mult = torch.full(input_shape, strength, dtype=dtype, device=device)
+        ramp_h = feather_ramp(input_shape[2], area[2], area[0] + area[2], shape[2])
+        ramp_w = feather_ramp(input_shape[3], area[3], area[1] + area[3], shape[3])
+        mult = mult * ramp_h.to(device, dtype).reshape(1, 1, -1, 1) * ramp_w.to(device, dtype).reshape(1, 1, 1, -1)
 
     conditioning = {}
     model_conds = conds["model_conds"]
     for c in model_conds:
-        conditioning[c] = model_conds[c].process_cond(batch_size=x_in.shape[0], device=x_in.device, area=area)
-
-    control = conds.get('control', None)
+        conditioning[c] = model_conds[c].process_cond(batch_size=shape[0], device=device, area=area)
 
     patches = None
     if 'gligen' in conds:
@@ -69,14 +66,34 @@ def get_area_and_mult(conds, x_in, timestep_in):
         gligen_type = gligen[0]
         gligen_model = gligen[1]
         if gligen_type == "position":
-            gligen_patch = gligen_model.model.set_position(input_x.shape, gligen[2], input_x.device)
+            gligen_patch = gligen_model.model.set_position(input_shape, gligen[2], device)
         else:
-            gligen_patch = gligen_model.model.set_empty(input_x.shape, input_x.device)
+            gligen_patch = gligen_model.model.set_empty(input_shape, device)
 
         patches['middle_patch'] = [gligen_patch]
 
-    cond_obj = collections.namedtuple('cond_obj', ['input_x', 'mult', 'conditioning', 'area', 'control', 'patches'])
-    return cond_obj(input_x, mult, conditioning, area, control, patches)
+    #the device of the tensors: the one asked for can have no index (mps vs mps:0) and never match the input
+    return compiled_cond(tuple(shape), mult.device, dtype, area, mult, conditioning, patches, uniform)
+
+def get_area_and_mult(conds, x_in, timestep_in):
+    if 'timestep_start' in conds:
+        timestep_start = conds['timestep_start']
+        if timestep_in[0] > timestep_start:
+            return None
+    if 'timestep_end' in conds:
+        timestep_end = conds['timestep_end']
+        if timestep_in[0] < timestep_end:
+            return None
+
+    #compiled by process_conds for the shape of the noise, only recomputed when the input doesn't match it
+    compiled = conds.get('compiled', None)
+    if compiled is None or compiled.shape != tuple(x_in.shape) or compiled.device != x_in.device or compiled.dtype != x_in.dtype:
+        compiled = compile_cond(conds, x_in.shape, x_in.device, x_in.dtype)
+
+    area = compiled.area
+    input_x = x_in[:,:,area[2]:area[0] + area[2],area[3]:area[1] + area[3]]
+    control = conds.get('control', None)
+    return cond_obj(input_x, compiled.mult, compiled.conditioning, area, control, compiled.patches, compiled.uniform)
 
 def cond_equal_size(c1, c2):
     if c1 is c2:
@@ -128,15 +145,100 @@ def cond_cat(c_list):
 
     return out
 
+cond_batch_stats = {"steps": 0, "conds": 0, "model_calls": 0}
+
+def get_cond_batch_stats():
+    return dict(cond_batch_stats)
+
+def plan_cond_batches(to_run):
+    """Groups the indexes of to_run that can be concatenated, in the order calc_cond_batch runs them."""
+    groups = []
+    remaining = list(range(len(to_run)))
+    while len(remaining) > 0:
+        first = to_run[remaining[0]][0]
+        group = []
+        rest = []
+        for x in remaining:
+            if can_concat_cond(to_run[x][0], first):
+                group.append(x)
+            else:
+                rest.append(x)
+        group.reverse()
+        groups.append(group)
+        remaining = rest
+    return groups
+
+class CondBatchPlanner:
+    """Remembers how the conds of a sampling run are batched so it isn't worked out again at every step.
+
+    process_conds gives every cond of a run the same planner. The groups of concatenable conds are computed once per
+    set of active conds (conds with a timestep range are not active at every step), the memory needed by a batch
+    once per input shape until the memory estimator gets a new measurement and the concatenated (and padded)
+    conditioning once per batch."""
+    MAX_CONDITIONING = 32
+
+    def __init__(self):
+        self.plans = {}
+        self.memory = {}
+        self.memory_updates = None
+        self.accumulators = {}
+        self.step_accumulators = set()
+
+    def start_step(self):
+        self.step_accumulators.clear()
+
+    def accumulator(self, index, x_in):
+        """Buffers the outputs and weights of the conds of index are summed in, allocated once and cleared at each step."""
+        key = (index, tuple(x_in.shape), x_in.dtype, x_in.device)
+        acc = self.accumulators.get(key, None)
+        if acc is None:
+            acc = (torch.empty_like(x_in), torch.empty_like(x_in))
+            self.accumulators[key] = acc
+        if key not in self.step_accumulators:
+            acc[0].zero_()
+            acc[1].fill_(1e-37)
+            self.step_accumulators.add(key)
+        return acc
+
+    def get_plan(self, key, to_run):
+        plan = self.plans.get(key, None)
+        if plan is None:
+            plan = (plan_cond_batches(to_run), {})
+            self.plans[key] = plan
+        return plan
+
+    def memory_required(self, model, input_shape, control=None):
+        if self.memory_updates != comfy.memory_estimator.estimator.updates:
+            self.memory.clear()
+            self.memory_updates = comfy.memory_estimator.estimator.updates
+        key = (tuple(input_shape), comfy.memory_estimator.control_key(control))
+        memory = self.memory.get(key, None)
+        if memory is None:
+            memory = model.memory_required(input_shape)
+            if control is not None:
+                memory = comfy.memory_estimator.estimator.estimate(model.memory_estimate_key() + key[1], input_shape, memory)
+            self.memory[key] = memory
+        return memory
+
+    def conditioning(self, plan, batch, c_list):
+        cache = plan[1]
+        key = tuple(batch)
+        c = cache.get(key, None)
+        if c is None:
+            c = cond_cat(c_list)
+            if len(cache) >= self.MAX_CONDITIONING:
+                cache.clear()
+            cache[key] = c
+        return c.copy()
+
 def calc_cond_batch(model, conds, x_in, timestep, model_options):
-    out_conds = []
-    out_counts = []
+    out_conds = [None] * len(conds)
+    entries = [0] * len(conds)
     to_run = []
+    planner = None
+    plan_key = [tuple(x_in.shape), x_in.device]
 
     for i in range(len(conds)):
-        out_conds.append(torch.zeros_like(x_in))
-        out_counts.append(torch.ones_like(x_in) * 1e-37)
-
         cond = conds[i]
         if cond is not None:
             for x in cond:
@@ -145,52 +247,62 @@ def calc_cond_batch(model, conds, x_in, timestep, model_options):
                     continue
 
                 to_run += [(p, i)]
-
-    while len(to_run) > 0:
-        first = to_run[0]
-        first_shape = first[0][0].shape
-        to_batch_temp = []
-        for x in range(len(to_run)):
-            if can_concat_cond(to_run[x][0], first[0]):
-                to_batch_temp += [x]
-
-        to_batch_temp.reverse()
-        to_batch = to_batch_temp[:1]
-
-        free_memory = model_management.get_free_memory(x_in.device)
-        for i in range(1, len(to_batch_temp) + 1):
-            batch_amount = to_batch_temp[:len(to_batch_temp)//i]
-            input_shape = [len(batch_amount) * first_shape[0]] + list(first_shape)[1:]
-            if model.memory_required(input_shape) < free_memory:
-                to_batch = batch_amount
-                break
-
+                entries[i] += 1
+                plan_key.append((id(x), i))
+                planner = x.get('batch_planner', planner)
+
+    if planner is None:
+        planner = CondBatchPlanner()
+    plan = planner.get_plan(tuple(plan_key), to_run)
+    planner.start_step()
+
+    batches = []
+    free_memory = model_management.get_free_memory(x_in.device)
+    for group in plan[0]:
+        first_shape = to_run[group[0]][0].input_x.shape
+        control = to_run[group[0]][0].control
+        while len(group) > 0:
+            to_batch = group[:1]
+            for i in range(1, len(group) + 1):
+                batch_amount = group[:len(group)//i]
+                input_shape = [len(batch_amount) * first_shape[0]] + list(first_shape)[1:]
+                if planner.memory_required(model, input_shape, control) < free_memory:
+                    to_batch = batch_amount
+                    break
+            batches.append(to_batch)
+            group = group[len(to_batch):]
+
+    cond_batch_stats["steps"] += 1
+    cond_batch_stats["conds"] += len(to_run)
+    cond_batch_stats["model_calls"] += len(batches)
+    logging.debug("cond batching: {} conds in {} model calls".format(len(to_run), len(batches)))
+
+    for to_batch in batches:
         input_x = []
         mult = []
         c = []
         cond_or_uncond = []
         area = []
+        uniform = []
         control = None
         patches = None
         for x in to_batch:
-            o = to_run.pop(x)
+            o = to_run[x]
             p = o[0]
             input_x.append(p.input_x)
             mult.append(p.mult)
             c.append(p.conditioning)
             area.append(p.area)
+            uniform.append(p.uniform)
             cond_or_uncond.append(o[1])
             control = p.control
             patches = p.patches
 
         batch_chunks = len(cond_or_uncond)
         input_x = torch.cat(input_x)
-        c = cond_cat(c)
+        c = planner.conditioning(plan, to_batch, c)
         timestep_ = torch.cat([timestep] * batch_chunks)
 
-        if control is not None:
-            c['control'] = control.get_control(input_x, timestep_, c, len(cond_or_uncond))
-
         transformer_options = {}
         if 'transformer_options' in model_options:
             transformer_options = model_options['transformer_options'].copy()
@@ -210,20 +322,35 @@ def calc_cond_batch(model, conds, x_in, timestep, model_options):
         transformer_options["cond_or_uncond"] = cond_or_uncond[:]
         transformer_options["sigmas"] = timestep
 
-        c['transformer_options'] = transformer_options
+        #the control model runs first and its outputs are kept during the forward of the model, both are measured together
+        with comfy.memory_estimator.estimator.measure(model.memory_estimate_key() + comfy.memory_estimator.control_key(control), input_x.shape, input_x.device):
+            if control is not None:
+                c['control'] = control.get_control(input_x, timestep_, c, len(cond_or_uncond))
 
-        if 'model_function_wrapper' in model_options:
-            output = model_options['model_function_wrapper'](model.apply_model, {"input": input_x, "timestep": timestep_, "c": c, "cond_or_uncond": cond_or_uncond}).chunk(batch_chunks)
-        else:
-            output = model.apply_model(input_x, timestep_, **c).chunk(batch_chunks)
+            c['transformer_options'] = transformer_options
+
+            if 'model_function_wrapper' in model_options:
+                output = model_options['model_function_wrapper'](model.apply_model, {"input": input_x, "timestep": timestep_, "c": c, "cond_or_uncond": cond_or_uncond}).chunk(batch_chunks)
+            else:
+                output = model.apply_model(input_x, timestep_, **c).chunk(batch_chunks)
 
         for o in range(batch_chunks):
             cond_index = cond_or_uncond[o]
-            out_conds[cond_index][:,:,area[o][2]:area[o][0] + area[o][2],area[o][3]:area[o][1] + area[o][3]] += output[o] * mult[o]
-            out_counts[cond_index][:,:,area[o][2]:area[o][0] + area[o][2],area[o][3]:area[o][1] + area[o][3]] += mult[o]
+            if entries[cond_index] == 1 and uniform[o]:
+                #the only cond of this index and it covers the whole latent: the weighted average is its output
+                out_conds[cond_index] = output[o]
+                continue
+            out_cond, out_count = planner.accumulator(cond_index, x_in)
+            out_cond[:,:,area[o][2]:area[o][0] + area[o][2],area[o][3]:area[o][1] + area[o][3]] += output[o] * mult[o]
+            out_count[:,:,area[o][2]:area[o][0] + area[o][2],area[o][3]:area[o][1] + area[o][3]] += mult[o]
 
     for i in range(len(out_conds)):
-        out_conds[i] /= out_counts[i]
+        if out_conds[i] is None:
+            if entries[i] == 0:
+                out_conds[i] = torch.zeros_like(x_in)
+            else:
+                out_cond, out_count = planner.accumulator(i, x_in)
+                out_conds[i] = out_cond / out_count
 
     return out_conds
 
@@ -237,7 +364,7 @@ def cfg_function(model, cond_pred, uncond_pred, cond_scale, x, timestep, model_o
                 "cond_denoised": cond_pred, "uncond_denoised": uncond_pred, "model": model, "model_options": model_options}
         cfg_result = x - model_options["sampler_cfg_function"](args)
     else:
-        cfg_result = uncond_pred + (cond_pred - uncond_pred) * cond_scale
+        cfg_result = torch.sub(cond_pred, uncond_pred).mul_(cond_scale).add_(uncond_pred)
 
     for fn in model_options.get("sampler_post_cfg_function", []):
         args = {"denoised": cfg_result, "cond": cond, "uncond": uncond, "model": model, "uncond_denoised": uncond_pred, "cond_denoised": cond_pred,
@@ -248,8 +375,12 @@ def cfg_function(model, cond_pred, uncond_pred, cond_scale, x, timestep, model_o
 
 #The main sampling function shared by all the samplers
 #Returns denoised
+def cfg1_optimization(cond_scale, model_options):
+    #with a cfg of 1 the uncond doesn't change the result so it isn't computed
+    return math.isclose(cond_scale, 1.0) and model_options.get("disable_cfg1_optimization", False) == False
+
 def sampling_function(model, x, timestep, uncond, cond, cond_scale, model_options={}, seed=None):
-    if math.isclose(cond_scale, 1.0) and model_options.get("disable_cfg1_optimization", False) == False:
+    if cfg1_optimization(cond_scale, model_options):
         uncond_ = None
     else:
         uncond_ = uncond
@@ -558,6 +689,15 @@ def ksampler(sampler_name, extra_options={}, inpaint_options={}):
     return KSAMPLER(sampler_function, extra_options, inpaint_options)
 
 
+def compile_conds(conds, shape, device, dtype, planner=None):
+    #the area, mask and model conds don't change between the steps of a sampling run
+    for t in range(len(conds)):
+        x = conds[t].copy()
+        x['compiled'] = compile_cond(x, shape, device, dtype)
+        if planner is not None:
+            x['batch_planner'] = planner
+        conds[t] = x
+
 def process_conds(model, noise, conds, device, latent_image=None, denoise_mask=None, seed=None):
     for k in conds:
         conds[k] = conds[k][:]
@@ -587,6 +727,10 @@ def process_conds(model, noise, conds, device, latent_image=None, denoise_mask=N
                 apply_empty_x_to_equal_area(list(filter(lambda c: c.get('control_apply_to_uncond', False) == True, positive)), conds[k], 'control', lambda cond_cnets, x: cond_cnets[x])
                 apply_empty_x_to_equal_area(positive, conds[k], 'gligen', lambda cond_cnets, x: cond_cnets[x])
 
+    planner = CondBatchPlanner()
+    for k in conds:
+        compile_conds(conds[k], noise.shape, device, noise.dtype, planner)
+
     return conds
 
 class CFGGuider:
@@ -631,17 +775,21 @@ class CFGGuider:
         for k in self.original_conds:
             self.conds[k] = list(map(lambda a: a.copy(), self.original_conds[k]))
 
-        self.inner_model, self.conds, self.loaded_models = comfy.sampler_helpers.prepare_sampling(self.model_patcher, noise.shape, self.conds)
-        device = self.model_patcher.load_device
+        #the patches keep state (like cached features) that must be dropped even when sampling is interrupted
+        try:
+            self.inner_model, self.conds, self.loaded_models = comfy.sampler_helpers.prepare_sampling(self.model_patcher, noise.shape, self.conds)
+            device = self.model_patcher.load_device
 
-        if denoise_mask is not None:
-            denoise_mask = comfy.sampler_helpers.prepare_mask(denoise_mask, noise.shape, device)
+            if denoise_mask is not None:
+                denoise_mask = comfy.sampler_helpers.prepare_mask(denoise_mask, noise.shape, device)
 
-        noise = noise.to(device)
-        latent_image = latent_image.to(device)
-        sigmas = sigmas.to(device)
+            noise = noise.to(device)
+            latent_image = latent_image.to(device)
+            sigmas = sigmas.to(device)
 
-        output = self.inner_sample(noise, latent_image, device, sampler, sigmas, denoise_mask, callback, disable_pbar, seed)
+            output = self.inner_sample(noise, latent_image, device, sampler, sigmas, denoise_mask, callback, disable_pbar, seed)
+        finally:
+            comfy.sampler_helpers.cleanup_model_patches(self.model_options)
 
         comfy.sampler_helpers.cleanup_models(self.conds, self.loaded_models)
         del self.inner_model
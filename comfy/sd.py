@@ -23,6 +23,9 @@ from . import sdxl_clip
 
 import comfy.model_patcher
 import comfy.lora
+import comfy.clip_cache
+import comfy.memory_estimator
+import comfy.model_cache
 import comfy.t2i_adapter.adapter
 import comfy.supported_models_base
 import comfy.taesd.taesd
@@ -105,6 +108,7 @@ class CLIP:
         self.tokenizer = tokenizer(embedding_directory=embedding_directory)
         self.patcher = comfy.model_patcher.ModelPatcher(self.cond_stage_model, load_device=load_device, offload_device=offload_device)
         self.layer_idx = None
+        self.weights_hash = None #identity of the weights for the disk cache of encoded tokens, set by the loaders
 
     def clone(self):
         n = CLIP(no_init=True)
@@ -112,6 +116,7 @@ class CLIP:
         n.cond_stage_model = self.cond_stage_model
         n.tokenizer = self.tokenizer
         n.layer_idx = self.layer_idx
+        n.weights_hash = self.weights_hash
         return n
 
     def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
@@ -126,14 +131,21 @@ class CLIP:
     def encode_from_tokens(self, tokens, return_pooled=False):
         self.cond_stage_model.reset_clip_options()
 
+        clip_options = {}
         if self.layer_idx is not None:
-            self.cond_stage_model.set_clip_options({"layer": self.layer_idx})
+            clip_options["layer"] = self.layer_idx
 
         if return_pooled == "unprojected":
-            self.cond_stage_model.set_clip_options({"projected_pooled": False})
+            clip_options["projected_pooled"] = False
 
-        self.load_model()
-        cond, pooled = self.cond_stage_model.encode_token_weights(tokens)
+        if len(clip_options) > 0:
+            self.cond_stage_model.set_clip_options(clip_options)
+
+        def encode():
+            self.load_model()
+            return self.cond_stage_model.encode_token_weights(tokens)
+
+        cond, pooled = comfy.clip_cache.encode_cached(self, tokens, clip_options, encode)
         if return_pooled:
             return cond, pooled
         return cond
@@ -289,18 +301,24 @@ class VAE:
         samples /= 3.0
         return samples
 
+    def memory_estimate_key(self, mode):
+        return comfy.memory_estimator.model_key(self.first_stage_model, self.vae_dtype, mode)
+
     def decode(self, samples_in):
         try:
-            memory_used = self.memory_used_decode(samples_in.shape, self.vae_dtype)
+            memory_key = self.memory_estimate_key("decode")
+            memory_used = comfy.memory_estimator.estimator.estimate(memory_key, [1] + list(samples_in.shape[1:]), self.memory_used_decode(samples_in.shape, self.vae_dtype))
             model_management.load_models_gpu([self.patcher], memory_required=memory_used)
             free_memory = model_management.get_free_memory(self.device)
             batch_number = int(free_memory / memory_used)
-            batch_number = max(1, batch_number)
+            batch_number = comfy.memory_estimator.estimator.max_batch(memory_key, samples_in.shape, free_memory, max(1, batch_number))
 
             pixel_samples = torch.empty((samples_in.shape[0], 3, round(samples_in.shape[2] * self.upscale_ratio), round(samples_in.shape[3] * self.upscale_ratio)), device=self.output_device)
             for x in range(0, samples_in.shape[0], batch_number):
                 samples = samples_in[x:x+batch_number].to(self.vae_dtype).to(self.device)
-                pixel_samples[x:x+batch_number] = self.process_output(self.first_stage_model.decode(samples).to(self.output_device).float())
+                with comfy.memory_estimator.estimator.measure(memory_key, samples.shape, self.device):
+                    out = self.first_stage_model.decode(samples)
+                pixel_samples[x:x+batch_number] = self.process_output(out.to(self.output_device).float())
         except model_management.OOM_EXCEPTION as e:
             logging.warning("Warning: Ran out of memory when regular VAE decoding, retrying with tiled VAE decoding.")
             pixel_samples = self.decode_tiled_(samples_in)
@@ -317,15 +335,18 @@ class VAE:
         pixel_samples = self.vae_encode_crop_pixels(pixel_samples)
         pixel_samples = pixel_samples.movedim(-1,1)
         try:
-            memory_used = self.memory_used_encode(pixel_samples.shape, self.vae_dtype)
+            memory_key = self.memory_estimate_key("encode")
+            memory_used = comfy.memory_estimator.estimator.estimate(memory_key, [1] + list(pixel_samples.shape[1:]), self.memory_used_encode(pixel_samples.shape, self.vae_dtype))
             model_management.load_models_gpu([self.patcher], memory_required=memory_used)
             free_memory = model_management.get_free_memory(self.device)
             batch_number = int(free_memory / memory_used)
-            batch_number = max(1, batch_number)
+            batch_number = comfy.memory_estimator.estimator.max_batch(memory_key, pixel_samples.shape, free_memory, max(1, batch_number))
             samples = torch.empty((pixel_samples.shape[0], self.latent_channels, round(pixel_samples.shape[2] // self.downscale_ratio), round(pixel_samples.shape[3] // self.downscale_ratio)), device=self.output_device)
             for x in range(0, pixel_samples.shape[0], batch_number):
                 pixels_in = self.process_input(pixel_samples[x:x+batch_number]).to(self.vae_dtype).to(self.device)
-                samples[x:x+batch_number] = self.first_stage_model.encode(pixels_in).to(self.output_device).float()
+                with comfy.memory_estimator.estimator.measure(memory_key, pixels_in.shape, self.device):
+                    out = self.first_stage_model.encode(pixels_in)
+                samples[x:x+batch_number] = out.to(self.output_device).float()
 
         except model_management.OOM_EXCEPTION as e:
             logging.warning("Warning: Ran out of memory when regular VAE encoding, retrying with tiled VAE encoding.")
@@ -366,6 +387,9 @@ class CLIPType(Enum):
     STABLE_CASCADE = 2
 
 def load_clip(ckpt_paths, embedding_directory=None, clip_type=CLIPType.STABLE_DIFFUSION):
+    return comfy.model_cache.cached_load("clip", ckpt_paths, (embedding_directory, clip_type), lambda: load_clip_uncached(ckpt_paths, embedding_directory=embedding_directory, clip_type=clip_type))
+
+def load_clip_uncached(ckpt_paths, embedding_directory=None, clip_type=CLIPType.STABLE_DIFFUSION):
     clip_data = []
     for p in ckpt_paths:
         clip_data.append(comfy.utils.load_torch_file(p, safe_load=True))
@@ -401,6 +425,7 @@ def load_clip(ckpt_paths, embedding_directory=None, clip_type=CLIPType.STABLE_DI
         clip_target.tokenizer = sdxl_clip.SDXLTokenizer
 
     clip = CLIP(clip_target, embedding_directory=embedding_directory)
+    clip.weights_hash = comfy.clip_cache.hash_file_identity("clip:{}".format(clip_target.clip.__name__), ckpt_paths)
     for c in clip_data:
         m, u = clip.load_sd(c)
         if len(m) > 0:
@@ -498,10 +523,16 @@ def load_checkpoint(config_path=None, ckpt_path=None, output_vae=True, output_cl
             clip = CLIP(clip_target, embedding_directory=embedding_directory)
             w.cond_stage_model = clip.cond_stage_model.clip_l
         load_clip_weights(w, state_dict)
+        if clip is not None and ckpt_path is not None:
+            clip.weights_hash = comfy.clip_cache.hash_file_identity("checkpoint_config:{}".format(clip_config["target"]), [ckpt_path])
 
     return (comfy.model_patcher.ModelPatcher(model, load_device=model_management.get_torch_device(), offload_device=offload_device), clip, vae)
 
 def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True):
+    options = (output_vae, output_clip, output_clipvision, embedding_directory, output_model)
+    return comfy.model_cache.cached_load("checkpoint", [ckpt_path], options, lambda: load_checkpoint_guess_config_uncached(ckpt_path, *options))
+
+def load_checkpoint_guess_config_uncached(ckpt_path, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True):
     sd = comfy.utils.load_torch_file(ckpt_path)
     sd_keys = sd.keys()
     clip = None
@@ -543,6 +574,7 @@ def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, o
             clip_sd = model_config.process_clip_state_dict(sd)
             if len(clip_sd) > 0:
                 clip = CLIP(clip_target, embedding_directory=embedding_directory)
+                clip.weights_hash = comfy.clip_cache.hash_file_identity("checkpoint", [ckpt_path])
                 m, u = clip.load_sd(clip_sd, full_model=True)
                 if len(m) > 0:
                     logging.warning("clip missing: {}".format(m))
@@ -603,6 +635,9 @@ def load_unet_state_dict(sd): #load unet in diffusers format
     return comfy.model_patcher.ModelPatcher(model, load_device=load_device, offload_device=offload_device)
 
 def load_unet(unet_path):
+    return comfy.model_cache.cached_load("unet", [unet_path], (), lambda: load_unet_uncached(unet_path))
+
+def load_unet_uncached(unet_path):
     sd = comfy.utils.load_torch_file(unet_path)
     model = load_unet_state_dict(sd)
     if model is None:
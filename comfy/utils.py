@@ -1,17 +1,77 @@
 import torch
 import math
 import struct
+import json
+import os
 import comfy.checkpoint_pickle
 import safetensors.torch
 import numpy as np
 from PIL import Image
 import logging
+from comfy.cli_args import args
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+if hasattr(torch, "float8_e4m3fn"):
+    SAFETENSORS_DTYPES["F8_E4M3"] = torch.float8_e4m3fn
+    SAFETENSORS_DTYPES["F8_E5M2"] = torch.float8_e5m2
+
+def load_safetensors_mmap(ckpt):
+    """Returns the state dict of a safetensors file as tensors backed by a private memory map of the file.
+
+    Nothing is read until a tensor is used, weights that are never copied into a model are never read and
+    the pages of the ones that are stay in the page cache instead of a second copy in RAM.
+    Returns None if the file can't be mapped."""
+    if not hasattr(torch.UntypedStorage, "from_file"):
+        return None
+
+    with open(ckpt, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    file_size = os.path.getsize(ckpt)
+    data_start = 8 + header_size
+
+    tensors = []
+    for k, v in header.items():
+        if k == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES.get(v["dtype"], None)
+        if dtype is None:
+            return None
+        start, end = v["data_offsets"]
+        tensors.append((k, dtype, v["shape"], data_start + start, end - start))
+
+    storage = torch.UntypedStorage.from_file(ckpt, False, file_size)
+    sd = {}
+    for k, dtype, shape, offset, nbytes in tensors:
+        data = torch.empty((0,), dtype=torch.uint8).set_(storage, offset, (nbytes,))
+        if offset % torch.empty((), dtype=dtype).element_size() != 0:
+            data = data.clone() #unaligned tensor in old files
+        sd[k] = data.view(dtype).reshape(shape)
+    return sd
 
 def load_torch_file(ckpt, safe_load=False, device=None):
     if device is None:
         device = torch.device("cpu")
     if ckpt.lower().endswith(".safetensors"):
-        sd = safetensors.torch.load_file(ckpt, device=device.type)
+        sd = None
+        if device.type == "cpu" and not args.disable_mmap:
+            try:
+                sd = load_safetensors_mmap(ckpt)
+            except Exception as e:
+                logging.warning("Could not memory map {}, loading it in memory: {}".format(ckpt, e))
+        if sd is None:
+            sd = safetensors.torch.load_file(ckpt, device=device.type)
     else:
         if safe_load:
             if not 'weights_only' in torch.load.__code__.co_varnames:
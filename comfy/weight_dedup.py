@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import threading
+import time
+import weakref
+
+import torch
+
+from comfy.cli_args import args
+
+SAMPLE_SIZE = 1024
+
+def tensor_bytes(t):
+    return t.detach().contiguous().reshape(-1).view(torch.uint8).cpu().numpy()
+
+def sampled_hash(t):
+    """Hash of the dtype, shape and SAMPLE_SIZE evenly spaced elements of a tensor, cheap to compute for every weight."""
+    flat = t.detach().reshape(-1)
+    if flat.nelement() > SAMPLE_SIZE:
+        flat = flat[torch.linspace(0, flat.nelement() - 1, SAMPLE_SIZE, dtype=torch.long, device=flat.device)]
+    return (str(t.dtype), tuple(t.shape), hashlib.sha256(tensor_bytes(flat)).hexdigest())
+
+class WeightRegistry:
+    """Makes identical weights of the models loaded in RAM share their memory.
+
+    The parameters of every deduplicated model are registered by their sampled hash. When a parameter of a newly
+    loaded model has the same sampled hash as a registered one, both are hashed fully and if they match the new
+    parameter gets the data of the registered one. Each model keeps its own parameter objects so patching or moving
+    one model to the GPU never touches the weights of the other: only the memory on the offload device is shared.
+
+    Weights are referenced by their model and name since patching replaces the parameter objects. Moving a model to
+    the GPU and back gives its weights new storage, reshare_module makes them share it with the other models again."""
+    def __init__(self):
+        self.params = {}
+        self.lenders = weakref.WeakKeyDictionary()
+        self.partners = weakref.WeakKeyDictionary()
+        self.full_hashes = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+        self.deduplicated = 0
+        self.deduplicated_size = 0
+        self.reshared = 0
+        self.full_hashed = 0
+
+    def full_hash(self, p):
+        state = (p._version, p.data_ptr())
+        h = self.full_hashes.get(p, None)
+        if h is None or h[0] != state:
+            h = (state, hashlib.sha256(tensor_bytes(p)).hexdigest())
+            self.full_hashes[p] = h
+            self.full_hashed += 1
+        return h[1]
+
+    def get_param(self, ref, name):
+        module = ref()
+        if module is None:
+            return None
+        try:
+            return module.get_parameter(name)
+        except AttributeError:
+            return None
+
+    def compatible(self, other, p):
+        return other is not None and other is not p and other.device == p.device and other.dtype == p.dtype and other.shape == p.shape
+
+    def find(self, key, p):
+        refs = self.params.get(key, [])
+        refs[:] = [r for r in refs if r[0]() is not None]
+        for r in refs:
+            other = self.get_param(*r)
+            if not self.compatible(other, p):
+                continue
+            if other.data_ptr() == p.data_ptr():
+                return None
+            if sampled_hash(other) == key and self.full_hash(other) == self.full_hash(p):
+                return r, other
+        return None
+
+    def link(self, module, name, lender):
+        """Every weight sharing the memory of lender is a partner of the others so they can be shared again whichever
+        models were moved."""
+        ref = (weakref.ref(module), name)
+        group = [lender] + self.partners.get(lender[0](), {}).get(lender[1], [])
+        for r in group:
+            partner_module = r[0]()
+            if partner_module is not None:
+                self.partners.setdefault(partner_module, {}).setdefault(r[1], []).append(ref)
+        self.partners.setdefault(module, {})[name] = group
+        self.lenders.setdefault(module, {})[name] = lender
+
+    def dedup_module(self, module):
+        size = 0
+        with self.lock:
+            lent = self.lenders.get(module, {})
+            for name, p in module.named_parameters():
+                if p.device.type != "cpu" or p.nelement() == 0 or name in lent:
+                    continue
+                key = sampled_hash(p)
+                found = self.find(key, p)
+                if found is None:
+                    refs = self.params.setdefault(key, [])
+                    if not any(r[0]() is module and r[1] == name for r in refs):
+                        refs.append((weakref.ref(module), name))
+                else:
+                    p.data = found[1].data
+                    self.link(module, name, found[0])
+                    lent = self.lenders[module]
+                    self.deduplicated += 1
+                    size += p.nelement() * p.element_size()
+            self.deduplicated_size += size
+        return size
+
+    def reshare_module(self, module, exclude=()):
+        """Makes the deduplicated weights of module that are back on the offload device share their memory with
+        their partners again, returns the bytes shared. Weights are only shared again when they are still fully
+        identical, the names in exclude (the patched weights) are skipped."""
+        size = 0
+        with self.lock:
+            for name, group in self.partners.get(module, {}).items():
+                if name in exclude:
+                    continue
+                try:
+                    p = module.get_parameter(name)
+                except AttributeError:
+                    continue
+                if p.device.type != "cpu":
+                    continue
+                others = [o for o in (self.get_param(*r) for r in group) if self.compatible(o, p)]
+                if any(o.data_ptr() == p.data_ptr() for o in others):
+                    continue
+                #only the weights of module are changed, the ones of the other models are left as they are
+                key = sampled_hash(p)
+                for other in others:
+                    if sampled_hash(other) == key and self.full_hash(other) == self.full_hash(p):
+                        p.data = other.data
+                        size += p.nelement() * p.element_size()
+                        self.reshared += 1
+                        break
+        return size
+
+    def shared_size(self, module):
+        """Bytes of the weights of module that use the memory of the weights of another model."""
+        size = 0
+        for name, lender in self.lenders.get(module, {}).items():
+            other = self.get_param(*lender)
+            try:
+                p = module.get_parameter(name)
+            except AttributeError:
+                continue
+            if other is not None and other.data_ptr() == p.data_ptr():
+                size += p.nelement() * p.element_size()
+        return size
+
+    def get_stats(self):
+        return {"deduplicated": self.deduplicated, "deduplicated_size": self.deduplicated_size, "reshared": self.reshared, "full_hashed": self.full_hashed}
+
+registry = WeightRegistry()
+
+def loaded_modules(obj):
+    if obj is None:
+        return []
+    elif isinstance(obj, (list, tuple)):
+        return sum(map(loaded_modules, obj), [])
+    patcher = getattr(obj, "patcher", obj)
+    if isinstance(getattr(patcher, "model", None), torch.nn.Module):
+        return [patcher.model]
+    return []
+
+def dedup_loaded(obj):
+    """Deduplicates the weights of the models returned by a loader with the ones of the models already loaded."""
+    if not args.dedup_weights:
+        return
+    start = time.perf_counter()
+    size = 0
+    for m in loaded_modules(obj):
+        size += registry.dedup_module(m)
+    if size > 0:
+        logging.info("Shared {:.2f} MB of weights with already loaded models in {:.2f} seconds".format(size / (1024 * 1024), time.perf_counter() - start))
+
+def shared_size(module):
+    if not args.dedup_weights:
+        return 0
+    return registry.shared_size(module)
+
+def reshare(module, exclude=()):
+    """Called when a model is back on its offload device, moving it gave its weights new storage."""
+    if not args.dedup_weights:
+        return
+    size = registry.reshare_module(module, exclude)
+    if size > 0:
+        logging.debug("Shared {:.2f} MB of offloaded weights with other models again".format(size / (1024 * 1024)))
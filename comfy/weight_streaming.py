@@ -0,0 +1,185 @@
+import concurrent.futures
+import logging
+import math
+import threading
+from collections import OrderedDict
+
+import torch
+
+import comfy.model_management
+
+class StagingBufferPool:
+    """Reusable buffers the streamed weights get copied into so streaming doesn't allocate for every forward.
+
+    Free buffers are kept per (device, dtype, element count), the least recently released ones are dropped when
+    the free buffers go over max_size bytes."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.free = OrderedDict()
+        self.free_size = 0
+        self.lock = threading.Lock()
+        self.allocations = 0
+        self.reuses = 0
+
+    def get(self, shape, dtype, device):
+        key = (device, dtype, math.prod(shape))
+        with self.lock:
+            buffers = self.free.get(key, None)
+            if buffers:
+                buf = buffers.pop()
+                if len(buffers) == 0:
+                    self.free.pop(key)
+                self.free_size -= buf.nelement() * buf.element_size()
+                self.reuses += 1
+                return buf.view(shape)
+            self.allocations += 1
+        return torch.empty(key[2], dtype=dtype, device=device).view(shape)
+
+    def release(self, buf):
+        key = (buf.device, buf.dtype, buf.nelement())
+        with self.lock:
+            self.free.setdefault(key, []).append(buf.reshape(-1))
+            self.free.move_to_end(key)
+            self.free_size += buf.nelement() * buf.element_size()
+            while self.free_size > self.max_size and len(self.free) > 0:
+                k, buffers = next(iter(self.free.items()))
+                b = buffers.pop(0)
+                if len(buffers) == 0:
+                    self.free.pop(k)
+                self.free_size -= b.nelement() * b.element_size()
+
+    def get_stats(self):
+        return {"allocations": self.allocations, "reuses": self.reuses, "free_size": self.free_size}
+
+class ThreadCopier:
+    """Runs the weight copies on a background thread, used on devices without streams like the cpu."""
+    def __init__(self, device):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="weight_streaming")
+
+    def submit(self, fn):
+        return self.executor.submit(fn)
+
+    def wait(self, handle):
+        return handle.result()
+
+class CudaStreamCopier:
+    """Enqueues the weight copies on a side stream, the compute stream waits for them with an event."""
+    def __init__(self, device):
+        self.device = device
+        self.stream = torch.cuda.Stream(device)
+
+    def submit(self, fn):
+        compute_stream = torch.cuda.current_stream(self.device)
+        #the buffers being reused were released after the compute that read them was enqueued
+        self.stream.wait_stream(compute_stream)
+        with torch.cuda.stream(self.stream):
+            out = fn()
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        return (out, event)
+
+    def wait(self, handle):
+        out, event = handle
+        compute_stream = torch.cuda.current_stream(self.device)
+        compute_stream.wait_event(event)
+        for t in out[0:2]:
+            if t is not None:
+                t.record_stream(compute_stream)
+        return out
+
+def get_copier(device):
+    if comfy.model_management.is_device_cuda(device):
+        return CudaStreamCopier(device)
+    return ThreadCopier(device)
+
+class WeightStreamer:
+    """Casts the weights of the modules of a lowvram model while prefetching the weights of the module that
+    runs next, so the copy (and the lora patching done by weight_function) of layer N+1 overlaps with the
+    compute of layer N.
+
+    The execution order is learned while the model runs: it starts with the order of the modules in the model
+    and every call records which module followed the previous one. A wrong guess only costs a wasted copy."""
+    def __init__(self, modules, device, pool_size=None, copier=None):
+        self.device = device
+        modules = list(modules)
+        self.next_module = {}
+        for i in range(len(modules) - 1):
+            self.next_module[id(modules[i])] = modules[i + 1]
+        if pool_size is None:
+            pool_size = 4 * max(map(comfy.model_management.module_size, modules), default=0)
+        self.pool = StagingBufferPool(pool_size)
+        if copier is None:
+            copier = get_copier(device)
+        self.copier = copier
+        self.pending = None
+        self.in_use = []
+        self.last = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, s, dtype, device):
+        with torch.no_grad():
+            return self.load_weights(s, dtype, device)
+
+    def load_weights(self, s, dtype, device):
+        buffers = []
+        weight = None
+        bias = None
+        if s.weight is not None:
+            weight = self.pool.get(s.weight.shape, dtype, device)
+            weight.copy_(s.weight, non_blocking=True)
+            buffers.append(weight)
+            if s.weight_function is not None:
+                weight = s.weight_function(weight)
+        if s.bias is not None:
+            bias = self.pool.get(s.bias.shape, dtype, device)
+            bias.copy_(s.bias, non_blocking=True)
+            buffers.append(bias)
+            if s.bias_function is not None:
+                bias = s.bias_function(bias)
+        return (weight, bias, buffers)
+
+    def discard(self, handle):
+        for b in self.copier.wait(handle)[2]:
+            self.pool.release(b)
+
+    def cast_bias_weight(self, s, input):
+        dtype = input.dtype
+        device = input.device
+
+        out = None
+        if self.pending is not None:
+            module, pending_dtype, pending_device, handle = self.pending
+            self.pending = None
+            if module is s and pending_dtype == dtype and pending_device == device:
+                out = self.copier.wait(handle)
+                self.hits += 1
+            else:
+                self.discard(handle)
+        if out is None:
+            self.misses += 1
+            out = self.copier.wait(self.copier.submit(lambda: self.load(s, dtype, device)))
+
+        #the previous module's forward has been enqueued, its buffers can be reused
+        for b in self.in_use:
+            self.pool.release(b)
+        self.in_use = out[2]
+
+        if self.last is not None and self.last is not s:
+            self.next_module[id(self.last)] = s
+        self.last = s
+
+        next_module = self.next_module.get(id(s), None)
+        if next_module is not None:
+            self.pending = (next_module, dtype, device, self.copier.submit(lambda: self.load(next_module, dtype, device)))
+        return out[0], out[1]
+
+    def reset(self):
+        if self.pending is not None:
+            self.discard(self.pending[3])
+            self.pending = None
+        for b in self.in_use:
+            self.pool.release(b)
+        self.in_use = []
+        self.last = None
+        logging.debug("weight streaming: prefetch hits {} misses {} buffers {}".format(self.hits, self.misses, self.pool.get_stats()))
@@ -0,0 +1,83 @@
+import copy
+
+import nodes
+
+from comfy_execution.caching import canonical_repr
+from comfy_execution.graph import get_input_links, is_link
+
+def get_batchable_inputs(class_def):
+    return getattr(class_def, "BATCHABLE_INPUTS", ())
+
+def batch_key(item):
+    """Returns a key that is the same for queued prompts that only differ in the values of BATCHABLE_INPUTS.
+
+    Returns None if the prompt can't be batched because one of its nodes works on whole lists."""
+    prompt = item[2]
+    parts = []
+    for unique_id in sorted(prompt):
+        node = prompt[unique_id]
+        class_def = nodes.NODE_CLASS_MAPPINGS.get(node['class_type'], None)
+        if class_def is None or getattr(class_def, "INPUT_IS_LIST", False) or hasattr(class_def, "OUTPUT_IS_LIST"):
+            return None
+        batchable = get_batchable_inputs(class_def)
+        inputs = {}
+        for x in node['inputs']:
+            if x not in batchable or is_link(node['inputs'][x]):
+                inputs[x] = node['inputs'][x]
+        parts.append([unique_id, node['class_type'], inputs])
+    return canonical_repr([parts, sorted(item[4])])
+
+def fuse_prompts(items):
+    """Merges prompts with the same batch_key into a single prompt.
+
+    Batchable inputs that differ get the list of values stored in the node's 'batch_inputs' so the node runs once
+    per prompt. The nodes downstream of them are marked as 'batched', they get the list of the hidden PROMPT and
+    EXTRA_PNGINFO values and can merge their list inputs into one call with a BATCH_FUNCTION."""
+    head = items[0]
+    prompt = copy.deepcopy(head[2])
+    extra_data = head[3].copy()
+    extra_data["batch_prompts"] = [x[2] for x in items]
+    extra_data["batch_extra_pnginfo"] = [x[3].get('extra_pnginfo', None) for x in items]
+
+    dependents = {}
+    to_visit = []
+    for unique_id, node in prompt.items():
+        for _, input_unique_id, _ in get_input_links(node):
+            dependents.setdefault(input_unique_id, []).append(unique_id)
+
+        class_def = nodes.NODE_CLASS_MAPPINGS[node['class_type']]
+        for x in get_batchable_inputs(class_def):
+            if x in node['inputs'] and not is_link(node['inputs'][x]):
+                values = [i[2][unique_id]['inputs'][x] for i in items]
+                if any(v != values[0] for v in values):
+                    node.setdefault('batch_inputs', {})[x] = values
+        if 'batch_inputs' in node:
+            to_visit.append(unique_id)
+
+    while len(to_visit) > 0:
+        unique_id = to_visit.pop()
+        if prompt[unique_id].get('batched', False):
+            continue
+        prompt[unique_id]['batched'] = True
+        to_visit.extend(dependents.get(unique_id, []))
+
+    return prompt, extra_data
+
+def is_fused(extra_data):
+    """The outputs of a fused prompt hold the ones of every prompt, their "executed" messages are only sent once
+    they are split per prompt."""
+    return "batch_prompts" in extra_data
+
+def split_outputs_ui(prompt, outputs_ui, count):
+    """Splits the ui outputs of a fused prompt back into the outputs of each of the count prompts."""
+    out = [{} for i in range(count)]
+    for unique_id, output_ui in outputs_ui.items():
+        for k, v in output_ui.items():
+            if prompt[unique_id].get('batched', False) and isinstance(v, list) and len(v) % count == 0:
+                chunk = len(v) // count
+                for i in range(count):
+                    out[i].setdefault(unique_id, {})[k] = v[i * chunk:(i + 1) * chunk]
+            else:
+                for i in range(count):
+                    out[i].setdefault(unique_id, {})[k] = v
+    return out
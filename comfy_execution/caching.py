@@ -0,0 +1,239 @@
+import hashlib
+import logging
+import types
+import uuid
+from collections import OrderedDict, deque
+
+import torch
+
+import comfy.model_patcher
+import comfy.model_management
+
+from comfy_execution.graph import is_link
+
+def canonical_repr(obj):
+    """Deterministic string for a literal node input or IS_CHANGED result.
+
+    Values that can't be compared reliably (NaN, arbitrary objects) get a unique token so that they
+    never produce a cache hit, which matches how they used to always invalidate the old output."""
+    if obj is None or isinstance(obj, (bool, int, str)):
+        return repr(obj)
+    elif isinstance(obj, float):
+        if obj != obj:
+            return "nan:{}".format(uuid.uuid4().hex)
+        return repr(obj)
+    elif isinstance(obj, (list, tuple)):
+        return "[{}]".format(",".join(map(canonical_repr, obj)))
+    elif isinstance(obj, dict):
+        return "{{{}}}".format(",".join("{}:{}".format(canonical_repr(k), canonical_repr(obj[k])) for k in sorted(obj, key=repr)))
+    else:
+        return "unhashable:{}".format(uuid.uuid4().hex)
+
+def node_signature(prompt, unique_id, class_def, is_changed, signatures, extra_data={}):
+    """Structural hash of a node: its class, literal inputs, IS_CHANGED result and the hashes of its inputs.
+
+    Two nodes with the same signature produce the same outputs no matter what their ids are. Nodes that get the
+    hidden PROMPT or EXTRA_PNGINFO (like the ones saving the workflow in their files) also depend on those."""
+    node = prompt[unique_id]
+    inputs = node['inputs']
+    parts = [canonical_repr(node['class_type']), canonical_repr(is_changed)]
+
+    hidden = class_def.INPUT_TYPES().get("hidden", {}).values()
+    batched = node.get('batched', False)
+    if "UNIQUE_ID" in hidden:
+        parts.append("id:{}".format(canonical_repr(unique_id)))
+    if "PROMPT" in hidden:
+        parts.append("prompt:{}".format(canonical_repr(extra_data["batch_prompts"] if batched else prompt)))
+    if "EXTRA_PNGINFO" in hidden:
+        parts.append("extra_pnginfo:{}".format(canonical_repr(extra_data["batch_extra_pnginfo"] if batched else extra_data.get('extra_pnginfo', None))))
+
+    if 'batch_inputs' in node:
+        parts.append("batch:{}".format(canonical_repr(node['batch_inputs'])))
+    if batched:
+        parts.append("batched")
+
+    for x in sorted(inputs):
+        input_data = inputs[x]
+        if is_link(input_data):
+            input_signature = signatures.get(input_data[0], None)
+            if input_signature is None:
+                input_signature = "missing:{}".format(uuid.uuid4().hex)
+            parts.append("{}=link:{}:{}".format(canonical_repr(x), input_signature, canonical_repr(input_data[1])))
+        else:
+            parts.append("{}={}".format(canonical_repr(x), canonical_repr(input_data)))
+
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+NOT_SEARCHED = (type, types.ModuleType, types.FunctionType, types.MethodType)
+
+def collect_storage(obj):
+    """Returns {storage key: (bytes, device)} for the tensors and models referenced by a node output.
+
+    Keys identify the underlying memory so that outputs sharing a model or tensor are only counted once. Other
+    objects (controlnets, upscale and style models...) are searched through their attributes."""
+    found = {}
+    visited = set()
+    stack = [obj]
+    while len(stack) > 0:
+        o = stack.pop()
+        if id(o) in visited:
+            continue
+        visited.add(id(o))
+
+        if isinstance(o, torch.Tensor):
+            storage = o.untyped_storage()
+            found[("tensor", str(o.device), storage.data_ptr())] = (storage.nbytes(), str(o.device))
+        elif isinstance(o, comfy.model_patcher.ModelPatcher):
+            found[("model", id(o.model))] = (o.model_size(), str(o.offload_device))
+        elif isinstance(o, torch.nn.Module):
+            found[("model", id(o))] = (comfy.model_management.module_size(o), "cpu")
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+        elif isinstance(o, dict):
+            stack.extend(o.values())
+        elif hasattr(o, "__dict__") and not isinstance(o, NOT_SEARCHED):
+            stack.extend(vars(o).values())
+    return found
+
+class CacheEntry:
+    def __init__(self, outputs, ui, storage, cost):
+        self.outputs = outputs
+        self.ui = ui
+        self.storage = storage
+        self.cost = cost
+        self.size = sum(map(lambda a: a[0], storage.values()))
+
+class OutputCache:
+    """Content addressed cache of node outputs keyed by node_signature.
+
+    Entries used by the prompt being executed are never evicted. Entries used by one of the last max_prompts
+    prompts are kept as long as there is no memory pressure, the others are dropped least recently used first
+    once the memory they reference goes over max_size bytes.
+
+    Memory pressure is when comfy.model_management.get_free_memory reports less than min_free bytes on the
+    cpu or the torch device, entries are then evicted following the eviction policy: "lru" or "cost" which
+    drops the outputs with the lowest execution time per byte first."""
+    EVICTION_POLICIES = ["lru", "cost"]
+
+    def __init__(self, max_size=0, max_prompts=1, eviction_policy="lru", min_free=None):
+        self.max_size = max_size
+        self.max_prompts = max(1, max_prompts)
+        self.eviction_policy = eviction_policy
+        if min_free is None:
+            min_free = comfy.model_management.minimum_inference_memory()
+        self.min_free = min_free
+        self.entries = OrderedDict()
+        self.prompt_signatures = deque(maxlen=self.max_prompts)
+        self.storage_refs = {}
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, signature):
+        entry = self.entries.get(signature, None)
+        if entry is not None:
+            self.entries.move_to_end(signature)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def set(self, signature, outputs, ui=None, cost=0.0):
+        if signature in self.entries:
+            self.remove(signature)
+        entry = CacheEntry(outputs, ui, collect_storage(outputs), cost)
+        for k, (size, device) in entry.storage.items():
+            ref = self.storage_refs.get(k, None)
+            if ref is None:
+                self.storage_refs[k] = [size, device, 1]
+                self.total_size += size
+            else:
+                ref[2] += 1
+        self.entries[signature] = entry
+        logging.debug("cached output {} {} bytes".format(signature, entry.size))
+
+    def remove(self, signature):
+        """Removes an entry and returns the bytes it freed on each device."""
+        entry = self.entries.pop(signature)
+        freed = {}
+        for k in entry.storage:
+            ref = self.storage_refs[k]
+            ref[2] -= 1
+            if ref[2] <= 0:
+                self.total_size -= ref[0]
+                freed[ref[1]] = freed.get(ref[1], 0) + ref[0]
+                self.storage_refs.pop(k)
+        return freed
+
+    def set_prompt(self, signatures):
+        self.prompt_signatures.append(set(signatures))
+
+    def is_pinned(self, signature, prompts=1):
+        for i in range(1, min(prompts, len(self.prompt_signatures)) + 1):
+            if signature in self.prompt_signatures[-i]:
+                return True
+        return False
+
+    def evict_entry(self, signature):
+        logging.debug("evicting cached output {} {} bytes".format(signature, self.entries[signature].size))
+        self.evictions += 1
+        return self.remove(signature)
+
+    def memory_pressure(self):
+        needed = {}
+        devices = [torch.device("cpu"), comfy.model_management.get_torch_device()]
+        for device in devices:
+            free = comfy.model_management.get_free_memory(device)
+            if free < self.min_free:
+                needed[str(device)] = self.min_free - free
+        return needed
+
+    def eviction_order(self):
+        signatures = list(self.entries.keys())
+        if self.eviction_policy == "cost":
+            signatures = sorted(signatures, key=lambda a: self.entries[a].cost / max(self.entries[a].size, 1))
+        return signatures
+
+    def evict(self):
+        #entries of older prompts without any memory found in them would never count against max_size
+        for signature in list(self.entries.keys()):
+            if self.is_pinned(signature, self.max_prompts):
+                continue
+            if self.total_size > self.max_size or self.entries[signature].size == 0:
+                self.evict_entry(signature)
+
+        needed = self.memory_pressure()
+        if len(needed) == 0:
+            return
+
+        for signature in self.eviction_order():
+            if max(needed.values()) <= 0:
+                break
+            if self.is_pinned(signature):
+                continue
+            freed = self.evict_entry(signature)
+            for device in freed:
+                if device in needed:
+                    needed[device] -= freed[device]
+
+    def get_stats(self):
+        return {
+            "entries": len(self.entries),
+            "size": self.total_size,
+            "max_size": self.max_size,
+            "max_prompts": self.max_prompts,
+            "eviction_policy": self.eviction_policy,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.prompt_signatures.clear()
+        self.storage_refs = {}
+        self.total_size = 0
+
+    def __len__(self):
+        return len(self.entries)
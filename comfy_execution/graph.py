@@ -0,0 +1,106 @@
+import heapq
+
+def is_link(obj):
+    return isinstance(obj, list) and len(obj) == 2
+
+def get_input_links(node):
+    """Returns (input_name, from_node_id, from_socket) for every linked input of a prompt node."""
+    links = []
+    inputs = node['inputs']
+    for x in inputs:
+        input_data = inputs[x]
+        if is_link(input_data):
+            links.append((x, input_data[0], input_data[1]))
+    return links
+
+class DependencyCycleError(Exception):
+    pass
+
+def topological_sort(prompt, node_ids=None, stop_at=(), get_links=get_input_links):
+    """Orders node_ids and all of their ancestors so that every node comes after its inputs.
+
+    Nodes in stop_at are left out and the walk doesn't go past them. This uses an explicit stack so very deep
+    graphs can't hit the recursion limit and runs in linear time in the number of nodes and links."""
+    if node_ids is None:
+        node_ids = prompt.keys()
+
+    order = []
+    visited = set()
+    for root in node_ids:
+        if root in visited or root in stop_at:
+            continue
+        stack = [(root, False)]
+        while len(stack) > 0:
+            unique_id, expanded = stack.pop()
+            if expanded:
+                order.append(unique_id)
+                continue
+            if unique_id in visited:
+                continue
+            visited.add(unique_id)
+            stack.append((unique_id, True))
+            for _, input_unique_id, _ in reversed(get_links(prompt[unique_id])):
+                if input_unique_id in prompt and input_unique_id not in visited and input_unique_id not in stop_at:
+                    stack.append((input_unique_id, False))
+    return order
+
+def dependency_depth(prompt, node_ids, stop_at=()):
+    """Returns the length of the longest chain of nodes each of node_ids needs executed (itself included, stopping
+    at the nodes in stop_at).
+
+    It's computed in a single pass in topological order so it stays linear in the number of nodes and links."""
+    depth = {}
+    for unique_id in topological_sort(prompt, node_ids, stop_at=stop_at):
+        d = 0
+        for _, input_unique_id, _ in get_input_links(prompt[unique_id]):
+            d = max(d, depth.get(input_unique_id, 0))
+        depth[unique_id] = d + 1
+    return {x: depth[x] for x in node_ids if x in depth}
+
+class ExecutionList:
+    """The nodes that still have to run for a prompt and the dependencies between them.
+
+    It's built once per prompt. Every node keeps a count of its inputs that haven't been executed yet and becomes
+    ready once that count reaches zero. Ready nodes are handed out in the order a depth first execution of the
+    outputs would run them, the outputs with the shortest chains of unexecuted nodes first. Nodes that never become
+    ready are part of a dependency cycle."""
+    def __init__(self, prompt, output_node_ids, cached):
+        self.prompt = prompt
+        self.pending_inputs = {}
+        self.dependents = {}
+        self.priority = {}
+        self.ready = []
+
+        to_execute = [x for x in output_node_ids if x not in cached]
+        depth = dependency_depth(prompt, to_execute, stop_at=cached)
+        to_execute = sorted(to_execute, key=lambda a: depth.get(a, 0))
+        order = topological_sort(prompt, to_execute, stop_at=cached)
+        for i, unique_id in enumerate(order):
+            self.priority[unique_id] = i
+            inputs = set()
+            for _, input_unique_id, _ in get_input_links(prompt[unique_id]):
+                if input_unique_id in prompt and input_unique_id not in cached:
+                    inputs.add(input_unique_id)
+            self.pending_inputs[unique_id] = len(inputs)
+            for x in inputs:
+                self.dependents.setdefault(x, []).append(unique_id)
+            if len(inputs) == 0:
+                heapq.heappush(self.ready, (i, unique_id))
+
+    def is_empty(self):
+        return len(self.pending_inputs) == 0
+
+    def first_pending(self):
+        return next(iter(self.pending_inputs))
+
+    def pop_ready(self):
+        if len(self.ready) == 0:
+            return None
+        return heapq.heappop(self.ready)[1]
+
+    def complete_node(self, unique_id):
+        self.pending_inputs.pop(unique_id)
+        for x in self.dependents.pop(unique_id, []):
+            self.pending_inputs[x] -= 1
+            if self.pending_inputs[x] == 0:
+                heapq.heappush(self.ready, (self.priority[x], x))
@@ -0,0 +1,110 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+import comfy.model_management
+import folder_paths
+import nodes
+
+def get_prefetch_paths(prompt):
+    """Returns the paths of the model files the loader nodes of a prompt will read, using their PREFETCH_INPUTS."""
+    paths = []
+    for unique_id in prompt:
+        node = prompt[unique_id]
+        class_def = nodes.NODE_CLASS_MAPPINGS.get(node['class_type'], None)
+        prefetch_inputs = getattr(class_def, "PREFETCH_INPUTS", None)
+        if prefetch_inputs is None:
+            continue
+        for x, folder_name in prefetch_inputs.items():
+            name = node['inputs'].get(x, None)
+            if not isinstance(name, str):
+                continue
+            try:
+                path = folder_paths.get_full_path(folder_name, name)
+            except Exception:
+                path = None
+            if path is not None and path not in paths:
+                paths.append(path)
+    return paths
+
+class Prefetcher:
+    """Reads the model files of upcoming prompts on a background thread so they are in the OS page cache
+    by the time the loader nodes memory map or read them.
+
+    The loader inputs are resolved to paths on that thread too so the callers never touch the disk. The free
+    RAM reported by the system includes the page cache, so the files already read for the prompts still queued
+    are counted as used: a file is only read when the free RAM minus those stays above min_free bytes after it."""
+    CHUNK_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, min_free=None):
+        if min_free is None:
+            min_free = comfy.model_management.minimum_inference_memory() * 2
+        self.min_free = min_free
+        self.queue = queue.Queue()
+        self.prefetched = OrderedDict()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.prefetched_bytes = 0
+
+    def prefetch_prompts(self, prompts):
+        """Prefetches the files of prompts, the next prompts in the queue. Files prefetched for prompts that
+        aren't in the list anymore stop being counted as used."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.worker, daemon=True)
+                self.thread.start()
+        self.queue.put(prompts)
+
+    def worker(self):
+        buf = bytearray(self.CHUNK_SIZE)
+        while True:
+            prompts = self.queue.get()
+            #only the latest state of the queue matters
+            while not self.queue.empty():
+                prompts = self.queue.get()
+            try:
+                self.prefetch_files(prompts, buf)
+            except Exception as e:
+                logging.warning("could not prefetch models: {}".format(e))
+
+    def get_files(self, prompts):
+        files = OrderedDict()
+        for prompt in prompts:
+            for path in get_prefetch_paths(prompt):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files[(path, st.st_mtime_ns)] = st.st_size
+        return files
+
+    def prefetch_files(self, prompts, buf):
+        files = self.get_files(prompts)
+        for key in list(self.prefetched.keys()):
+            if key not in files:
+                self.prefetched.pop(key)
+
+        for key, size in files.items():
+            if key in self.prefetched:
+                continue
+            path = key[0]
+            free = comfy.model_management.get_free_memory(torch.device("cpu")) - sum(self.prefetched.values())
+            if free - size < self.min_free:
+                logging.debug("not prefetching {}: not enough free memory".format(path))
+                continue
+            t = time.perf_counter()
+            try:
+                with open(path, "rb", buffering=0) as f:
+                    while f.readinto(buf) > 0:
+                        pass
+            except Exception as e:
+                logging.warning("could not prefetch {}: {}".format(path, e))
+                continue
+            self.prefetched[key] = size
+            self.prefetched_bytes += size
+            logging.debug("prefetched {} in {:.2f} seconds".format(path, time.perf_counter() - t))
@@ -1,3 +1,4 @@
+import bisect
 import comfy.samplers
 import comfy.sample
 from comfy.k_diffusion import sampling as k_diffusion_sampling
@@ -5,6 +6,7 @@ import latent_preview
 import torch
 import comfy.utils
 import node_helpers
+import logging
 
 
 class BasicScheduler:
@@ -468,6 +470,140 @@ class DualCFGGuider:
         guider.set_cfg(cfg_conds, cfg_cond2_negative)
         return (guider,)
 
+class Guider_UncondSchedule(comfy.samplers.CFGGuider):
+    """CFG guider that saves the negative (uncond) model pass while the sigma is between sigma_end and sigma_start.
+
+    In "drop" mode those steps run without cfg (like cfg 1.0). In "cache" mode the negative prediction is only
+    computed every interval steps and in between it is extrapolated from the last two computed ones (or reused
+    when there is only one). Steps are the ones of the sigmas of the sampling run, samplers like Heun or DPM2 call
+    the model more than once per step."""
+    def set_schedule(self, mode, sigma_start, sigma_end, interval=1):
+        self.mode = mode
+        self.sigma_start = sigma_start
+        self.sigma_end = sigma_end
+        self.interval = max(1, interval)
+        self.reset_schedule()
+
+    def reset_schedule(self, sigmas=None):
+        self.uncond_cache = []
+        self.sigmas = None
+        if sigmas is not None:
+            self.sigmas = sorted(sigmas.tolist())
+        self.last_sigma = None
+        self.step = -1
+        self.model_calls = 0
+        self.model_calls_saved = 0
+
+    def sampler_step(self, sigma):
+        """The step of the sampling run sigma is in: the calls at the sigma of a step and between it and the next
+        one belong to that step. Without the sigmas of the run (the guider called directly) every new sigma is a step."""
+        if self.sigmas is not None:
+            return max(0, len(self.sigmas) - bisect.bisect_left(self.sigmas, sigma) - 1)
+        if sigma != self.last_sigma:
+            self.last_sigma = sigma
+            self.step += 1
+        return self.step
+
+    def cached_uncond(self, sigma):
+        if len(self.uncond_cache) == 1 or self.uncond_cache[0][0] == self.uncond_cache[1][0]:
+            return self.uncond_cache[-1][1]
+        (s0, u0), (s1, u1) = self.uncond_cache
+        return u1 + (u1 - u0) * ((sigma - s1) / (s1 - s0))
+
+    def predict_noise(self, x, timestep, model_options={}, seed=None):
+        positive = self.conds.get("positive", None)
+        negative = self.conds.get("negative", None)
+        sigma = timestep[0].item()
+        step = self.sampler_step(sigma)
+        self.model_calls += 1
+        uses_uncond = negative is not None and not comfy.samplers.cfg1_optimization(self.cfg, model_options)
+
+        if not (self.sigma_end <= sigma <= self.sigma_start) or not uses_uncond:
+            if self.mode == "cache":
+                self.uncond_cache = []
+            if uses_uncond:
+                self.model_calls += 1
+            return super().predict_noise(x, timestep, model_options=model_options, seed=seed)
+
+        if self.mode == "drop":
+            self.model_calls_saved += 1
+            out = comfy.samplers.calc_cond_batch(self.inner_model, [positive, None], x, timestep, model_options)
+            return comfy.samplers.cfg_function(self.inner_model, out[0], out[1], 1.0, x, timestep, model_options=model_options, cond=positive, uncond=None)
+
+        if len(self.uncond_cache) > 0 and step % self.interval != 0:
+            self.model_calls_saved += 1
+            out = comfy.samplers.calc_cond_batch(self.inner_model, [positive, None], x, timestep, model_options)
+            uncond_pred = self.cached_uncond(sigma)
+            return comfy.samplers.cfg_function(self.inner_model, out[0], uncond_pred, self.cfg, x, timestep, model_options=model_options, cond=positive, uncond=negative)
+
+        #computed like any other step, the uncond prediction is taken from the post cfg arguments
+        def cache_uncond(args):
+            self.uncond_cache = self.uncond_cache[-1:] + [(sigma, args["uncond_denoised"])]
+            return args["denoised"]
+        self.model_calls += 1
+        model_options = model_options.copy()
+        model_options["sampler_post_cfg_function"] = model_options.get("sampler_post_cfg_function", []) + [cache_uncond]
+        return comfy.samplers.sampling_function(self.inner_model, x, timestep, negative, positive, self.cfg, model_options=model_options, seed=seed)
+
+    def inner_sample(self, noise, latent_image, device, sampler, sigmas, *args, **kwargs):
+        self.reset_schedule(sigmas)
+        try:
+            return super().inner_sample(noise, latent_image, device, sampler, sigmas, *args, **kwargs)
+        finally:
+            self.uncond_cache = []
+            logging.info("uncond schedule: {} of {} model passes saved".format(self.model_calls_saved, self.model_calls + self.model_calls_saved))
+
+class CFGTruncationGuider:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required":
+                    {"model": ("MODEL",),
+                    "positive": ("CONDITIONING", ),
+                    "negative": ("CONDITIONING", ),
+                    "cfg": ("FLOAT", {"default": 8.0, "min": 0.0, "max": 100.0, "step":0.1, "round": 0.01}),
+                    "sigma_start": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 1000.0, "step":0.01, "round": False}),
+                    "sigma_end": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1000.0, "step":0.01, "round": False}),
+                     }
+                }
+
+    RETURN_TYPES = ("GUIDER",)
+
+    FUNCTION = "get_guider"
+    CATEGORY = "sampling/custom_sampling/guiders"
+
+    def get_guider(self, model, positive, negative, cfg, sigma_start, sigma_end):
+        guider = Guider_UncondSchedule(model)
+        guider.set_conds(positive, negative)
+        guider.set_cfg(cfg)
+        guider.set_schedule("drop", sigma_start, sigma_end)
+        return (guider,)
+
+class UncondCacheGuider:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required":
+                    {"model": ("MODEL",),
+                    "positive": ("CONDITIONING", ),
+                    "negative": ("CONDITIONING", ),
+                    "cfg": ("FLOAT", {"default": 8.0, "min": 0.0, "max": 100.0, "step":0.1, "round": 0.01}),
+                    "interval": ("INT", {"default": 2, "min": 1, "max": 100}),
+                    "sigma_start": ("FLOAT", {"default": 1000.0, "min": 0.0, "max": 1000.0, "step":0.01, "round": False}),
+                    "sigma_end": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1000.0, "step":0.01, "round": False}),
+                     }
+                }
+
+    RETURN_TYPES = ("GUIDER",)
+
+    FUNCTION = "get_guider"
+    CATEGORY = "sampling/custom_sampling/guiders"
+
+    def get_guider(self, model, positive, negative, cfg, interval, sigma_start, sigma_end):
+        guider = Guider_UncondSchedule(model)
+        guider.set_conds(positive, negative)
+        guider.set_cfg(cfg)
+        guider.set_schedule("cache", sigma_start, sigma_end, interval)
+        return (guider,)
+
 class DisableNoise:
     @classmethod
     def INPUT_TYPES(s):
@@ -604,6 +740,8 @@ NODE_CLASS_MAPPINGS = {
 
     "CFGGuider": CFGGuider,
     "DualCFGGuider": DualCFGGuider,
+    "CFGTruncationGuider": CFGTruncationGuider,
+    "UncondCacheGuider": UncondCacheGuider,
     "BasicGuider": BasicGuider,
     "RandomNoise": RandomNoise,
     "DisableNoise": DisableNoise,
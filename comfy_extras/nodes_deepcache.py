@@ -0,0 +1,102 @@
+#Based on: https://github.com/horseee/DeepCache
+#Implemented as a model patch for the ComfyUI UNet.
+
+import logging
+
+class BlockCache:
+    """Features entering the output block at cache depth, kept from the last full step and reused by the next ones.
+
+    A step starts when the sigma changes, a higher sigma than the last one means a new sampling run. Inside the
+    [sigma_start, sigma_end] range one step every interval is a full step, the others only run the shallow blocks.
+    Entries are keyed by the index of the call in the step, the cond_or_uncond of the batch and its shape so the
+    model calls of a step don't use each other's features. The features are dropped when sampling ends and the
+    clones of the model get their own empty cache."""
+    def __init__(self, depth, interval, sigma_start, sigma_end):
+        self.depth = depth
+        self.interval = interval
+        self.sigma_start = sigma_start
+        self.sigma_end = sigma_end
+        self.reset()
+
+    def __deepcopy__(self, memo):
+        return BlockCache(self.depth, self.interval, self.sigma_start, self.sigma_end)
+
+    def reset(self):
+        self.sigma = None
+        self.in_range = False
+        self.full = True
+        self.cache_steps = 0
+        self.calls = 0
+        self.key = None
+        self.features = {}
+        self.full_steps = 0
+        self.cached_steps = 0
+
+    def cleanup(self):
+        if self.cached_steps > 0:
+            logging.debug("block cache: {} full steps, {} cached steps".format(self.full_steps, self.cached_steps))
+        self.reset()
+
+    def start_step(self, sigma):
+        if self.sigma is not None and sigma > self.sigma:
+            self.cleanup()
+        self.sigma = sigma
+        self.calls = 0
+        self.in_range = self.sigma_end <= sigma <= self.sigma_start
+        if self.in_range:
+            self.full = self.cache_steps % self.interval == 0
+            self.cache_steps += 1
+        else:
+            self.full = True
+            self.features = {}
+        if self.full:
+            self.full_steps += 1
+        else:
+            self.cached_steps += 1
+
+    def load(self, x, transformer_options):
+        self.key = None
+        if "sigmas" not in transformer_options:
+            return None
+        sigma = transformer_options["sigmas"][0].item()
+        if sigma != self.sigma:
+            self.start_step(sigma)
+        if not self.in_range:
+            return None
+
+        self.key = (self.calls, tuple(transformer_options.get("cond_or_uncond", [])), tuple(x.shape))
+        self.calls += 1
+        if self.full:
+            return None
+        return self.features.get(self.key, None)
+
+    def store(self, h, transformer_options):
+        if self.key is not None:
+            self.features[self.key] = h
+
+class DeepCache:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": { "model": ("MODEL",),
+                              "cache_interval": ("INT", {"default": 3, "min": 1, "max": 1000, "step": 1}),
+                              "cache_depth": ("INT", {"default": 3, "min": 0, "max": 8, "step": 1}),
+                              "start_percent": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1.0, "step": 0.001}),
+                              "end_percent": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 1.0, "step": 0.001}),
+                              }}
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+
+    CATEGORY = "model_patches"
+
+    def patch(self, model, cache_interval, cache_depth, start_percent, end_percent):
+        model_sampling = model.model.model_sampling
+        sigma_start = model_sampling.percent_to_sigma(start_percent)
+        sigma_end = model_sampling.percent_to_sigma(end_percent)
+
+        m = model.clone()
+        m.set_model_patch(BlockCache(cache_depth, cache_interval, sigma_start, sigma_end), "unet_block_cache")
+        return (m, )
+
+NODE_CLASS_MAPPINGS = {
+    "DeepCache": DeepCache,
+}
@@ -105,6 +105,7 @@ class HypernetworkLoader:
     FUNCTION = "load_hypernetwork"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"hypernetwork_name": "hypernetworks"}
 
     def load_hypernetwork(self, model, hypernetwork_name, strength):
         hypernetwork_path = folder_paths.get_full_path("hypernetworks", hypernetwork_name)
@@ -101,6 +101,7 @@ class MaskToImage:
         }
 
     CATEGORY = "mask"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "mask_to_image"
@@ -120,6 +121,7 @@ class ImageToMask:
         }
 
     CATEGORY = "mask"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "image_to_mask"
@@ -140,6 +142,7 @@ class ImageColorToMask:
         }
 
     CATEGORY = "mask"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "image_to_mask"
@@ -162,6 +165,7 @@ class SolidMask:
         }
 
     CATEGORY = "mask"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("MASK",)
 
@@ -181,6 +185,7 @@ class InvertMask:
         }
 
     CATEGORY = "mask"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("MASK",)
 
@@ -204,6 +209,7 @@ class CropMask:
         }
 
     CATEGORY = "mask"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("MASK",)
 
@@ -228,6 +234,7 @@ class MaskComposite:
         }
 
     CATEGORY = "mask"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("MASK",)
 
@@ -275,6 +282,7 @@ class FeatherMask:
         }
 
     CATEGORY = "mask"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("MASK",)
 
@@ -318,6 +326,7 @@ class GrowMask:
         }
     
     CATEGORY = "mask"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("MASK",)
 
@@ -352,6 +361,7 @@ class ThresholdMask:
         }
 
     CATEGORY = "mask"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "image_to_mask"
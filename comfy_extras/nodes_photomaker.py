@@ -124,6 +124,7 @@ class PhotoMakerLoader:
     FUNCTION = "load_photomaker_model"
 
     CATEGORY = "_for_testing/photomaker"
+    PREFETCH_INPUTS = {"photomaker_model_name": "photomaker"}
 
     def load_photomaker_model(self, photomaker_model_name):
         photomaker_model_path = folder_paths.get_full_path("photomaker", photomaker_model_name)
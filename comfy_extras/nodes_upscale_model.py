@@ -14,6 +14,7 @@ class UpscaleModelLoader:
     FUNCTION = "load_model"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"model_name": "upscale_models"}
 
     def load_model(self, model_name):
         model_path = folder_paths.get_full_path("upscale_models", model_name)
@@ -15,6 +15,7 @@ class ImageOnlyCheckpointLoader:
     FUNCTION = "load_checkpoint"
 
     CATEGORY = "loaders/video_models"
+    PREFETCH_INPUTS = {"ckpt_name": "checkpoints"}
 
     def load_checkpoint(self, ckpt_name, output_vae=True, output_clip=True):
         ckpt_path = folder_paths.get_full_path("checkpoints", ckpt_name)
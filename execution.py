@@ -1,3 +1,4 @@
+import os
 import sys
 import copy
 import logging
@@ -5,16 +6,31 @@ import threading
 import heapq
 import traceback
 import inspect
+import time
 from typing import List, Literal, NamedTuple, Optional
 
+import concurrent.futures
+
 import torch
 import nodes
 
 import comfy.model_management
+import comfy.model_cache
+import comfy.model_patcher
+import comfy.pinned_memory
+import comfy_execution.batching
+import comfy_execution.prefetch
+from comfy_execution.caching import OutputCache, node_signature
+from comfy_execution.graph import DependencyCycleError, ExecutionList, get_input_links, topological_sort
 
 def get_input_data(inputs, class_def, unique_id, outputs={}, prompt={}, extra_data={}):
     valid_inputs = class_def.INPUT_TYPES()
     input_data_all = {}
+    batch_inputs = {}
+    batched = False
+    if unique_id in prompt:
+        batch_inputs = prompt[unique_id].get('batch_inputs', {})
+        batched = prompt[unique_id].get('batched', False)
     for x in inputs:
         input_data = inputs[x]
         if isinstance(input_data, list):
@@ -27,15 +43,24 @@ def get_input_data(inputs, class_def, unique_id, outputs={}, prompt={}, extra_da
             input_data_all[x] = obj
         else:
             if ("required" in valid_inputs and x in valid_inputs["required"]) or ("optional" in valid_inputs and x in valid_inputs["optional"]):
-                input_data_all[x] = [input_data]
+                if x in batch_inputs:
+                    input_data_all[x] = batch_inputs[x]
+                else:
+                    input_data_all[x] = [input_data]
 
     if "hidden" in valid_inputs:
         h = valid_inputs["hidden"]
         for x in h:
             if h[x] == "PROMPT":
-                input_data_all[x] = [prompt]
+                if batched:
+                    input_data_all[x] = extra_data["batch_prompts"]
+                else:
+                    input_data_all[x] = [prompt]
             if h[x] == "EXTRA_PNGINFO":
-                input_data_all[x] = [extra_data.get('extra_pnginfo', None)]
+                if batched:
+                    input_data_all[x] = extra_data["batch_extra_pnginfo"]
+                else:
+                    input_data_all[x] = [extra_data.get('extra_pnginfo', None)]
             if h[x] == "UNIQUE_ID":
                 input_data_all[x] = [unique_id]
     return input_data_all
@@ -74,11 +99,18 @@ def map_node_over_list(obj, input_data_all, func, allow_interrupt=False):
             results.append(getattr(obj, func)(**slice_dict(input_data_all, i)))
     return results
 
-def get_output_data(obj, input_data_all):
+def get_output_data(obj, input_data_all, batched=False):
     
     results = []
     uis = []
-    return_values = map_node_over_list(obj, input_data_all, obj.FUNCTION, allow_interrupt=True)
+    # In a batched prompt a node with a BATCH_FUNCTION gets all the list inputs at once
+    # and returns one list per output.
+    use_batch_function = batched and hasattr(obj, "BATCH_FUNCTION") and not getattr(obj, "INPUT_IS_LIST", False) and max(map(len, input_data_all.values()), default=0) > 1
+    if use_batch_function:
+        nodes.before_node_execution()
+        return_values = [getattr(obj, obj.BATCH_FUNCTION)(**input_data_all)]
+    else:
+        return_values = map_node_over_list(obj, input_data_all, obj.FUNCTION, allow_interrupt=True)
 
     for r in return_values:
         if isinstance(r, dict):
@@ -93,7 +125,9 @@ def get_output_data(obj, input_data_all):
     if len(results) > 0:
         # check which outputs need concatenating
         output_is_list = [False] * len(results[0])
-        if hasattr(obj, "OUTPUT_IS_LIST"):
+        if use_batch_function:
+            output_is_list = [True] * len(results[0])
+        elif hasattr(obj, "OUTPUT_IS_LIST"):
             output_is_list = obj.OUTPUT_IS_LIST
 
         # merge node execution results
@@ -116,30 +150,22 @@ def format_value(x):
     else:
         return str(x)
 
-def recursive_execute(server, prompt, outputs, current_item, extra_data, executed, prompt_id, outputs_ui, object_storage):
-    unique_id = current_item
+# Set on the cpu pool threads. Only the execution thread sends messages to the client, a node running on the
+# pool would show up as the current node while another one runs.
+pool_thread = threading.local()
+
+def in_pool_thread():
+    return getattr(pool_thread, "active", False)
+
+def execute_node(server, prompt, outputs, unique_id, extra_data, prompt_id, outputs_ui, object_storage, execution_times):
     inputs = prompt[unique_id]['inputs']
     class_type = prompt[unique_id]['class_type']
     class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
-    if unique_id in outputs:
-        return (True, None, None)
-
-    for x in inputs:
-        input_data = inputs[x]
-
-        if isinstance(input_data, list):
-            input_unique_id = input_data[0]
-            output_index = input_data[1]
-            if input_unique_id not in outputs:
-                result = recursive_execute(server, prompt, outputs, input_unique_id, extra_data, executed, prompt_id, outputs_ui, object_storage)
-                if result[0] is not True:
-                    # Another node failed further upstream
-                    return result
 
     input_data_all = None
     try:
         input_data_all = get_input_data(inputs, class_def, unique_id, outputs, prompt, extra_data)
-        if server.client_id is not None:
+        if server.client_id is not None and not in_pool_thread():
             server.last_node_id = unique_id
             server.send_sync("executing", { "node": unique_id, "prompt_id": prompt_id }, server.client_id)
 
@@ -148,11 +174,13 @@ def recursive_execute(server, prompt, outputs, current_item, extra_data, execute
             obj = class_def()
             object_storage[(unique_id, class_type)] = obj
 
-        output_data, output_ui = get_output_data(obj, input_data_all)
+        execution_start_time = time.perf_counter()
+        output_data, output_ui = get_output_data(obj, input_data_all, batched=prompt[unique_id].get('batched', False))
+        execution_times[unique_id] = time.perf_counter() - execution_start_time
         outputs[unique_id] = output_data
         if len(output_ui) > 0:
             outputs_ui[unique_id] = output_ui
-            if server.client_id is not None:
+            if server.client_id is not None and not in_pool_thread() and not comfy_execution.batching.is_fused(extra_data):
                 server.send_sync("executed", { "node": unique_id, "output": output_ui, "prompt_id": prompt_id }, server.client_id)
     except comfy.model_management.InterruptProcessingException as iex:
         logging.info("Processing interrupted")
@@ -173,7 +201,7 @@ def recursive_execute(server, prompt, outputs, current_item, extra_data, execute
                 input_data_formatted[name] = [format_value(x) for x in inputs]
 
         output_data_formatted = {}
-        for node_id, node_outputs in outputs.items():
+        for node_id, node_outputs in list(outputs.items()):
             output_data_formatted[node_id] = [[format_value(x) for x in l] for l in node_outputs]
 
         logging.error(f"!!! Exception during processing!!! {ex}")
@@ -189,89 +217,40 @@ def recursive_execute(server, prompt, outputs, current_item, extra_data, execute
         }
         return (False, error_details, ex)
 
-    executed.add(unique_id)
-
     return (True, None, None)
 
-def recursive_will_execute(prompt, outputs, current_item, memo={}):
-    unique_id = current_item
+def execute_node_threaded(*args):
+    # inference mode is thread local so it has to be entered again on the worker threads
+    pool_thread.active = True
+    with torch.inference_mode():
+        return execute_node(*args)
 
-    if unique_id in memo:
-        return memo[unique_id]
-
-    inputs = prompt[unique_id]['inputs']
-    will_execute = []
-    if unique_id in outputs:
-        return []
-
-    for x in inputs:
-        input_data = inputs[x]
-        if isinstance(input_data, list):
-            input_unique_id = input_data[0]
-            output_index = input_data[1]
-            if input_unique_id not in outputs:
-                will_execute += recursive_will_execute(prompt, outputs, input_unique_id, memo)
-
-    memo[unique_id] = will_execute + [unique_id]
-    return memo[unique_id]
-
-def recursive_output_delete_if_changed(prompt, old_prompt, outputs, current_item):
-    unique_id = current_item
+def get_is_changed(prompt, unique_id, outputs):
     inputs = prompt[unique_id]['inputs']
     class_type = prompt[unique_id]['class_type']
     class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
+    if not hasattr(class_def, 'IS_CHANGED'):
+        return ''
 
-    is_changed_old = ''
-    is_changed = ''
-    to_delete = False
-    if hasattr(class_def, 'IS_CHANGED'):
-        if unique_id in old_prompt and 'is_changed' in old_prompt[unique_id]:
-            is_changed_old = old_prompt[unique_id]['is_changed']
-        if 'is_changed' not in prompt[unique_id]:
-            input_data_all = get_input_data(inputs, class_def, unique_id, outputs)
-            if input_data_all is not None:
-                try:
-                    #is_changed = class_def.IS_CHANGED(**input_data_all)
-                    is_changed = map_node_over_list(class_def, input_data_all, "IS_CHANGED")
-                    prompt[unique_id]['is_changed'] = is_changed
-                except:
-                    to_delete = True
-        else:
-            is_changed = prompt[unique_id]['is_changed']
-
-    if unique_id not in outputs:
-        return True
-
-    if not to_delete:
-        if is_changed != is_changed_old:
-            to_delete = True
-        elif unique_id not in old_prompt:
-            to_delete = True
-        elif inputs == old_prompt[unique_id]['inputs']:
-            for x in inputs:
-                input_data = inputs[x]
-
-                if isinstance(input_data, list):
-                    input_unique_id = input_data[0]
-                    output_index = input_data[1]
-                    if input_unique_id in outputs:
-                        to_delete = recursive_output_delete_if_changed(prompt, old_prompt, outputs, input_unique_id)
-                    else:
-                        to_delete = True
-                    if to_delete:
-                        break
-        else:
-            to_delete = True
-
-    if to_delete:
-        d = outputs.pop(unique_id)
-        del d
-    return to_delete
+    input_data_all = get_input_data(inputs, class_def, unique_id, outputs)
+    try:
+        #is_changed = class_def.IS_CHANGED(**input_data_all)
+        return map_node_over_list(class_def, input_data_all, "IS_CHANGED")
+    except Exception:
+        #a node that can't tell if it changed is always executed again
+        return float("NaN")
 
 class PromptExecutor:
-    def __init__(self, server):
+    def __init__(self, server, cache_size=0, cache_prompts=1, cache_eviction="lru", cpu_threads=0):
         self.server = server
+        self.cache = OutputCache(max_size=cache_size, max_prompts=cache_prompts, eviction_policy=cache_eviction)
+        self.cpu_pool = None
+        if cpu_threads > 0 and not comfy.model_management.is_device_cpu(comfy.model_management.intermediate_device()):
+            logging.info("Not running CPU_SAFE nodes on a thread pool because node outputs are kept on {}".format(comfy.model_management.intermediate_device()))
+        elif cpu_threads > 0:
+            self.cpu_pool = concurrent.futures.ThreadPoolExecutor(max_workers=cpu_threads, thread_name_prefix="cpu_node")
         self.reset()
+        server.prompt_executor = self
 
     def reset(self):
         self.outputs = {}
@@ -279,14 +258,18 @@ class PromptExecutor:
         self.outputs_ui = {}
         self.status_messages = []
         self.success = True
-        self.old_prompt = {}
+        self.cache.clear()
+        comfy.model_cache.cache.clear()
+        comfy.model_patcher.patch_cache.clear()
+        if comfy.pinned_memory.pool is not None:
+            comfy.pinned_memory.pool.clear()
 
     def add_message(self, event, data, broadcast: bool):
         self.status_messages.append((event, data))
         if self.server.client_id is not None or broadcast:
             self.server.send_sync(event, data, self.server.client_id)
 
-    def handle_execution_error(self, prompt_id, prompt, current_outputs, executed, error, ex):
+    def handle_execution_error(self, prompt_id, prompt, executed, error, ex):
         node_id = error["node_id"]
         class_type = prompt[node_id]["class_type"]
 
@@ -314,18 +297,89 @@ class PromptExecutor:
                 "current_outputs": error["current_outputs"],
             }
             self.add_message("execution_error", mes, broadcast=False)
-        
-        # Next, remove the subsequent outputs since they will not be executed
-        to_delete = []
-        for o in self.outputs:
-            if (o not in current_outputs) and (o not in executed):
-                to_delete += [o]
-                if o in self.old_prompt:
-                    d = self.old_prompt.pop(o)
-                    del d
-        for o in to_delete:
-            d = self.outputs.pop(o)
-            del d
+
+    def load_cached_outputs(self, prompt, extra_data):
+        # Signatures are computed in topological order so IS_CHANGED can see the cached outputs of its inputs
+        signatures = {}
+        for unique_id in topological_sort(prompt):
+            class_def = nodes.NODE_CLASS_MAPPINGS[prompt[unique_id]['class_type']]
+            is_changed = get_is_changed(prompt, unique_id, self.outputs)
+            signature = node_signature(prompt, unique_id, class_def, is_changed, signatures, extra_data)
+            signatures[unique_id] = signature
+
+            cached = self.cache.get(signature)
+            if cached is not None:
+                self.outputs[unique_id] = cached.outputs
+                if cached.ui is not None and len(cached.ui) > 0:
+                    self.outputs_ui[unique_id] = cached.ui
+        return signatures
+
+    def send_executed(self, unique_id, prompt_id, extra_data):
+        # the ui outputs of the nodes that ran on the cpu pool are sent from the execution thread
+        if self.server.client_id is not None and unique_id in self.outputs_ui and not comfy_execution.batching.is_fused(extra_data):
+            self.server.send_sync("executed", { "node": unique_id, "output": self.outputs_ui[unique_id], "prompt_id": prompt_id }, self.server.client_id)
+
+    def execute_nodes(self, execution_list, prompt, prompt_id, extra_data, executed, execution_times):
+        # Nodes that set CPU_SAFE = True run on the cpu pool while the other ready nodes keep running
+        # on this thread. The other nodes are executed one at a time in depth first order.
+        running = {}
+        inline = []
+        result = (True, None, None)
+        while result[0] is True:
+            unique_id = execution_list.pop_ready()
+            while unique_id is not None:
+                class_def = nodes.NODE_CLASS_MAPPINGS[prompt[unique_id]['class_type']]
+                if self.cpu_pool is not None and getattr(class_def, "CPU_SAFE", False):
+                    future = self.cpu_pool.submit(execute_node_threaded, self.server, prompt, self.outputs, unique_id, extra_data, prompt_id, self.outputs_ui, self.object_storage, execution_times)
+                    running[future] = unique_id
+                else:
+                    heapq.heappush(inline, (execution_list.priority[unique_id], unique_id))
+                unique_id = execution_list.pop_ready()
+
+            if len(inline) > 0:
+                unique_id = heapq.heappop(inline)[1]
+                # This call shouldn't raise anything if there's an error deep in
+                # the actual SD code, instead it will report the node where the
+                # error was raised
+                result = execute_node(self.server, prompt, self.outputs, unique_id, extra_data, prompt_id, self.outputs_ui, self.object_storage, execution_times)
+                if result[0] is True:
+                    executed.add(unique_id)
+                    execution_list.complete_node(unique_id)
+                continue
+
+            if len(running) == 0:
+                break
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                unique_id = running.pop(future)
+                r = future.result()
+                if r[0] is True:
+                    executed.add(unique_id)
+                    execution_list.complete_node(unique_id)
+                    self.send_executed(unique_id, prompt_id, extra_data)
+                elif result[0] is True:
+                    result = r
+
+        # let the nodes still running on the pool finish so their outputs don't get lost
+        for future, unique_id in running.items():
+            if future.result()[0] is True:
+                executed.add(unique_id)
+                self.send_executed(unique_id, prompt_id, extra_data)
+
+        if result[0] is True and not execution_list.is_empty():
+            unique_id = execution_list.first_pending()
+            ex = DependencyCycleError("Dependency cycle detected at node {}".format(unique_id))
+            error_details = {
+                "node_id": unique_id,
+                "exception_message": str(ex),
+                "exception_type": full_type_name(type(ex)),
+                "traceback": [],
+                "current_inputs": {},
+                "current_outputs": {},
+            }
+            result = (False, error_details, ex)
+        return result
 
     def execute(self, prompt, prompt_id, extra_data={}, execute_outputs=[]):
         nodes.interrupt_processing(False)
@@ -339,14 +393,8 @@ class PromptExecutor:
         self.add_message("execution_start", { "prompt_id": prompt_id}, broadcast=False)
 
         with torch.inference_mode():
-            #delete cached outputs if nodes don't exist for them
-            to_delete = []
-            for o in self.outputs:
-                if o not in prompt:
-                    to_delete += [o]
-            for o in to_delete:
-                d = self.outputs.pop(o)
-                del d
+            self.outputs = {}
+            self.outputs_ui = {}
             to_delete = []
             for o in self.object_storage:
                 if o[0] not in prompt:
@@ -359,42 +407,31 @@ class PromptExecutor:
                 d = self.object_storage.pop(o)
                 del d
 
-            for x in prompt:
-                recursive_output_delete_if_changed(prompt, self.old_prompt, self.outputs, x)
-
+            signatures = self.load_cached_outputs(prompt, extra_data)
+            self.cache.set_prompt(signatures.values())
+            self.cache.evict()
             current_outputs = set(self.outputs.keys())
-            for x in list(self.outputs_ui.keys()):
-                if x not in current_outputs:
-                    d = self.outputs_ui.pop(x)
-                    del d
 
             comfy.model_management.cleanup_models(keep_clone_weights_loaded=True)
             self.add_message("execution_cached",
                           { "nodes": list(current_outputs) , "prompt_id": prompt_id},
                           broadcast=False)
+            if self.server.client_id is not None and not comfy_execution.batching.is_fused(extra_data):
+                #the cached outputs might come from nodes with different ids in an earlier prompt
+                for node_id, output_ui in self.outputs_ui.items():
+                    self.server.send_sync("executed", { "node": node_id, "output": output_ui, "prompt_id": prompt_id }, self.server.client_id)
             executed = set()
-            output_node_id = None
-            to_execute = []
-
-            for node_id in list(execute_outputs):
-                to_execute += [(0, node_id)]
+            execution_times = {}
 
-            while len(to_execute) > 0:
-                #always execute the output that depends on the least amount of unexecuted nodes first
-                memo = {}
-                to_execute = sorted(list(map(lambda a: (len(recursive_will_execute(prompt, self.outputs, a[-1], memo)), a[-1]), to_execute)))
-                output_node_id = to_execute.pop(0)[-1]
+            execution_list = ExecutionList(prompt, execute_outputs, self.outputs)
 
-                # This call shouldn't raise anything if there's an error deep in
-                # the actual SD code, instead it will report the node where the
-                # error was raised
-                self.success, error, ex = recursive_execute(self.server, prompt, self.outputs, output_node_id, extra_data, executed, prompt_id, self.outputs_ui, self.object_storage)
-                if self.success is not True:
-                    self.handle_execution_error(prompt_id, prompt, current_outputs, executed, error, ex)
-                    break
+            self.success, error, ex = self.execute_nodes(execution_list, prompt, prompt_id, extra_data, executed, execution_times)
+            if self.success is not True:
+                self.handle_execution_error(prompt_id, prompt, executed, error, ex)
 
             for x in executed:
-                self.old_prompt[x] = copy.deepcopy(prompt[x])
+                self.cache.set(signatures[x], self.outputs[x], self.outputs_ui.get(x, None), cost=execution_times.get(x, 0.0))
+            self.cache.evict()
             self.server.last_node_id = None
             if comfy.model_management.DISABLE_SMART_MEMORY:
                 comfy.model_management.unload_all_models()
@@ -619,6 +656,13 @@ def full_type_name(klass):
         return klass.__qualname__
     return module + '.' + klass.__qualname__
 
+def get_required_input_links(node):
+    try:
+        required_inputs = nodes.NODE_CLASS_MAPPINGS[node['class_type']].INPUT_TYPES()['required']
+    except Exception:
+        return []
+    return [x for x in get_input_links(node) if x[0] in required_inputs]
+
 def validate_prompt(prompt):
     outputs = set()
     for x in prompt:
@@ -639,6 +683,16 @@ def validate_prompt(prompt):
     errors = []
     node_errors = {}
     validated = {}
+    # Validate every node the outputs need in topological order first so validate_inputs finds their inputs
+    # in `validated` instead of recursing through the whole graph.
+    for x in topological_sort(prompt, outputs, get_links=get_required_input_links):
+        if x not in outputs:
+            try:
+                validate_inputs(prompt, x, validated)
+            except Exception:
+                # reported with the details when the output that needs it gets validated below
+                pass
+
     for o in outputs:
         valid = False
         reasons = []
@@ -708,6 +762,10 @@ def validate_prompt(prompt):
 
     return (True, None, list(good_outputs), node_errors)
 
+def get_prompt_models(prompt):
+    """Returns the paths of the model files the loader nodes of a prompt use, from their PREFETCH_INPUTS."""
+    return set(map(os.path.abspath, comfy_execution.prefetch.get_prefetch_paths(prompt)))
+
 MAXIMUM_HISTORY_SIZE = 10000
 
 class PromptQueue:
@@ -720,26 +778,93 @@ class PromptQueue:
         self.currently_running = {}
         self.history = {}
         self.flags = {}
+        self.affinity_window = 1
+        self.batch_size = 1
+        self.prefetch_count = 0
+        self.prefetcher = None
+        self.prompt_models = {}
         server.prompt_queue = self
 
+    def upcoming_prompts(self):
+        # called with the mutex held, the files are read by the prefetcher after it is released
+        if self.prefetch_count <= 0:
+            return None
+        return [x[2] for x in heapq.nsmallest(self.prefetch_count, self.queue)]
+
+    def prefetch(self, prompts):
+        # read the model files of the next prompts while the current one runs
+        if prompts is None:
+            return
+        if self.prefetcher is None:
+            self.prefetcher = comfy_execution.prefetch.Prefetcher()
+        self.prefetcher.prefetch_prompts(prompts)
+
     def put(self, item):
+        models = None
+        if self.affinity_window > 1:
+            # resolved before taking the lock, it looks for the files in the model folders
+            models = get_prompt_models(item[2])
         with self.mutex:
+            if models is not None:
+                self.prompt_models[item[1]] = models
             heapq.heappush(self.queue, item)
+            upcoming = self.upcoming_prompts()
             self.server.queue_updated()
             self.not_empty.notify()
+        self.prefetch(upcoming)
 
-    def get(self, timeout=None):
+    def get(self, timeout=None, models=None):
         with self.not_empty:
             while len(self.queue) == 0:
                 self.not_empty.wait(timeout=timeout)
                 if timeout is not None and len(self.queue) == 0:
                     return None
-            item = heapq.heappop(self.queue)
+            item = None
+            if models is not None and len(models) > 0 and self.affinity_window > 1:
+                # prefer one of the next few prompts that uses models the worker already has loaded
+                for x in heapq.nsmallest(self.affinity_window, self.queue):
+                    if len(self.prompt_models.get(x[1], set()) & models) > 0:
+                        item = x
+                        self.queue.remove(x)
+                        heapq.heapify(self.queue)
+                        break
+            if item is None:
+                item = heapq.heappop(self.queue)
+            self.prompt_models.pop(item[1], None)
             i = self.task_counter
             self.currently_running[i] = copy.deepcopy(item)
             self.task_counter += 1
+            if self.batch_size > 1:
+                item = self.batch_queued_prompts(item, i)
+            upcoming = self.upcoming_prompts()
             self.server.queue_updated()
-            return (item, i)
+        self.prefetch(upcoming)
+        return (item, i)
+
+    def batch_queued_prompts(self, item, item_id):
+        # Queued prompts that only differ in their batchable inputs are taken out of the queue and
+        # fused with this one. The fused item has the (item, item_id) of every prompt as last element.
+        key = comfy_execution.batching.batch_key(item)
+        if key is None:
+            return item
+
+        tasks = [(item, item_id)]
+        for x in heapq.nsmallest(len(self.queue), self.queue):
+            if len(tasks) >= self.batch_size:
+                break
+            if comfy_execution.batching.batch_key(x) == key:
+                tasks.append((x, self.task_counter))
+                self.currently_running[self.task_counter] = copy.deepcopy(x)
+                self.task_counter += 1
+                self.queue.remove(x)
+                self.prompt_models.pop(x[1], None)
+
+        if len(tasks) == 1:
+            return item
+        heapq.heapify(self.queue)
+        prompt, extra_data = comfy_execution.batching.fuse_prompts([x[0] for x in tasks])
+        logging.info("Batching {} prompts together".format(len(tasks)))
+        return (item[0], item[1], prompt, extra_data, item[4], tasks)
 
     class ExecutionStatus(NamedTuple):
         status_str: Literal['success', 'error']
@@ -778,12 +903,14 @@ class PromptQueue:
     def wipe_queue(self):
         with self.mutex:
             self.queue = []
+            self.prompt_models = {}
             self.server.queue_updated()
 
     def delete_queue_item(self, function):
         with self.mutex:
             for x in range(len(self.queue)):
                 if function(self.queue[x]):
+                    self.prompt_models.pop(self.queue[x][1], None)
                     if len(self.queue) == 1:
                         self.wipe_queue()
                     else:
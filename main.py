@@ -52,6 +52,8 @@ import itertools
 import shutil
 import threading
 import gc
+import multiprocessing
+import queue
 
 from comfy.cli_args import args
 import logging
@@ -72,12 +74,16 @@ if __name__ == "__main__":
 
 import comfy.utils
 import yaml
+from aiohttp import web
 
 import execution
+import comfy_execution.batching
 import server
 from server import BinaryEventTypes
+import nodes
 from nodes import init_custom_nodes
 import comfy.model_management
+import comfy.memory_estimator
 
 def cuda_malloc_warning():
     device = comfy.model_management.get_torch_device()
@@ -90,8 +96,27 @@ def cuda_malloc_warning():
         if cuda_malloc_warning:
             logging.warning("\nWARNING: this card most likely does not support cuda-malloc, if you get \"CUDA error\" please run ComfyUI with: --disable-cuda-malloc\n")
 
+def prompt_done(q, server, item, item_id, outputs_ui, status):
+    tasks = [(item, item_id)]
+    task_outputs_ui = [outputs_ui]
+    if len(item) > 5:
+        # fused prompt: every prompt gets its own slice of the outputs, no "executed" messages were
+        # sent during execution since they held the outputs of every prompt.
+        tasks = item[5]
+        task_outputs_ui = comfy_execution.batching.split_outputs_ui(item[2], outputs_ui, len(tasks))
+
+    for i, (task_item, task_id) in enumerate(tasks):
+        q.task_done(task_id, task_outputs_ui[i], status=status)
+        client_id = task_item[3].get("client_id", None)
+        if client_id is None:
+            continue
+        if len(tasks) > 1:
+            for node_id, output_ui in task_outputs_ui[i].items():
+                server.send_sync("executed", { "node": node_id, "output": output_ui, "prompt_id": task_item[1] }, client_id)
+        server.send_sync("executing", { "node": None, "prompt_id": task_item[1] }, client_id)
+
 def prompt_worker(q, server):
-    e = execution.PromptExecutor(server)
+    e = execution.PromptExecutor(server, cache_size=int(args.cache_size * 1024 * 1024 * 1024), cache_prompts=args.cache_prompts, cache_eviction=args.cache_eviction, cpu_threads=args.cpu_node_threads)
     last_gc_collect = 0
     need_gc = False
     gc_collect_interval = 10.0
@@ -110,14 +135,12 @@ def prompt_worker(q, server):
 
             e.execute(item[2], prompt_id, item[3], item[4])
             need_gc = True
-            q.task_done(item_id,
+            prompt_done(q, server, item, item_id,
                         e.outputs_ui,
-                        status=execution.PromptQueue.ExecutionStatus(
+                        execution.PromptQueue.ExecutionStatus(
                             status_str='success' if e.success else 'error',
                             completed=e.success,
                             messages=e.status_messages))
-            if server.client_id is not None:
-                server.send_sync("executing", { "node": None, "prompt_id": prompt_id }, server.client_id)
 
             current_time = time.perf_counter()
             execution_time = current_time - execution_start_time
@@ -142,9 +165,173 @@ def prompt_worker(q, server):
                 comfy.model_management.cleanup_models()
                 gc.collect()
                 comfy.model_management.soft_empty_cache()
+                comfy.memory_estimator.estimator.save_if_updated()
+                last_gc_collect = current_time
+                need_gc = False
+
+class WorkerServer:
+    """Stands in for the PromptServer inside a worker process and forwards its messages to the main process.
+
+    Routes custom nodes register on it are never served, the main process serves its own."""
+    def __init__(self, results):
+        self.results = results
+        self.routes = web.RouteTableDef()
+        self.client_id = None
+        self.last_node_id = None
+        self.last_prompt_id = None
+        self.prompt_executor = None
+
+    def send_sync(self, event, data, sid=None):
+        self.results.put(("send_sync", event, data, sid))
+
+    def queue_updated(self):
+        pass
+
+def worker_command_listener(commands, pending):
+    # interrupts are handled as soon as they arrive, the other commands wait for the current prompt to finish
+    while True:
+        command = commands.get()
+        if command[0] == "interrupt":
+            nodes.interrupt_processing()
+        else:
+            pending.put(command)
+
+def prompt_worker_process(commands, results):
+    init_folder_paths()
+    # custom nodes can register routes and handlers on the server when they are imported
+    worker_server = WorkerServer(results)
+    server.PromptServer.instance = worker_server
+    init_custom_nodes()
+    hijack_progress(worker_server)
+
+    pending = queue.Queue()
+    threading.Thread(target=worker_command_listener, daemon=True, args=(commands, pending)).start()
+
+    e = execution.PromptExecutor(worker_server, cache_size=int(args.cache_size * 1024 * 1024 * 1024), cache_prompts=args.cache_prompts, cache_eviction=args.cache_eviction, cpu_threads=args.cpu_node_threads)
+    last_gc_collect = 0
+    need_gc = False
+    gc_collect_interval = 10.0
+
+    while True:
+        timeout = None
+        if need_gc:
+            timeout = max(gc_collect_interval - (time.perf_counter() - last_gc_collect), 0.0)
+
+        try:
+            command = pending.get(timeout=timeout)
+        except queue.Empty:
+            command = None
+
+        if command is not None and command[0] == "execute":
+            item = command[1]
+            prompt_id = item[1]
+            worker_server.last_prompt_id = prompt_id
+            e.execute(item[2], prompt_id, item[3], item[4])
+            need_gc = True
+            results.put(("done", e.outputs_ui, 'success' if e.success else 'error', e.success, e.status_messages, comfy.model_management.loaded_model_paths()))
+
+        if command is not None and command[0] == "flags":
+            flags = command[1]
+            free_memory = flags.get("free_memory", False)
+            if flags.get("unload_models", free_memory):
+                comfy.model_management.unload_all_models()
+                need_gc = True
+                last_gc_collect = 0
+
+            if free_memory:
+                e.reset()
+                need_gc = True
+                last_gc_collect = 0
+
+        if need_gc:
+            current_time = time.perf_counter()
+            if (current_time - last_gc_collect) > gc_collect_interval:
+                comfy.model_management.cleanup_models()
+                gc.collect()
+                comfy.model_management.soft_empty_cache()
+                comfy.memory_estimator.estimator.save_if_updated()
                 last_gc_collect = current_time
                 need_gc = False
 
+worker_env_lock = threading.Lock()
+
+class PromptWorker:
+    """A prompt executor running in its own process, optionally pinned to a single cuda device."""
+    def __init__(self, device=None):
+        self.device = device
+        self.models = set()
+        self.process = None
+
+    def start(self):
+        ctx = multiprocessing.get_context("spawn")
+        self.commands = ctx.Queue()
+        self.results = ctx.Queue()
+        self.models = set()
+        with worker_env_lock:
+            old_env = os.environ.get('CUDA_VISIBLE_DEVICES', None)
+            if self.device is not None:
+                os.environ['CUDA_VISIBLE_DEVICES'] = str(self.device)
+            try:
+                self.process = ctx.Process(target=prompt_worker_process, args=(self.commands, self.results), daemon=True)
+                self.process.start()
+            finally:
+                if old_env is None:
+                    os.environ.pop('CUDA_VISIBLE_DEVICES', None)
+                else:
+                    os.environ['CUDA_VISIBLE_DEVICES'] = old_env
+        logging.info("Started prompt worker process {} on device: {}".format(self.process.pid, self.device))
+
+    def interrupt(self):
+        if self.process is not None and self.process.is_alive():
+            self.commands.put(("interrupt",))
+
+def prompt_worker_dispatch(q, server, worker, workers):
+    worker.start()
+    while True:
+        queue_item = q.get(timeout=1000.0, models=worker.models)
+        if queue_item is not None:
+            item, item_id = queue_item
+            execution_start_time = time.perf_counter()
+            prompt_id = item[1]
+            server.last_prompt_id = prompt_id
+            server.client_id = item[3].get("client_id", None)
+
+            worker.commands.put(("execute", item))
+            result = None
+            while result is None:
+                try:
+                    message = worker.results.get(timeout=1.0)
+                except queue.Empty:
+                    if not worker.process.is_alive():
+                        logging.error("Prompt worker process {} died, restarting it.".format(worker.process.pid))
+                        result = ("done", {}, 'error', False, [], set())
+                        worker.start()
+                    continue
+
+                if message[0] == "send_sync":
+                    event, data, sid = message[1:]
+                    if event == "executing":
+                        server.last_node_id = data["node"]
+                    server.send_sync(event, data, sid)
+                else:
+                    result = message
+
+            outputs_ui, status_str, completed, messages, worker.models = result[1:]
+            prompt_done(q, server, item, item_id,
+                        outputs_ui,
+                        execution.PromptQueue.ExecutionStatus(
+                            status_str=status_str,
+                            completed=completed,
+                            messages=messages))
+
+            execution_time = time.perf_counter() - execution_start_time
+            logging.info("Prompt executed in {:.2f} seconds".format(execution_time))
+
+        flags = q.get_flags()
+        if len(flags) > 0:
+            for w in workers:
+                w.commands.put(("flags", flags))
+
 async def run(server, address='', port=8188, verbose=True, call_on_start=None):
     await asyncio.gather(server.start(address, port, verbose, call_on_start), server.publish_loop())
 
@@ -152,6 +339,8 @@ async def run(server, address='', port=8188, verbose=True, call_on_start=None):
 def hijack_progress(server):
     def hook(value, total, preview_image):
         comfy.model_management.throw_exception_if_processing_interrupted()
+        if execution.in_pool_thread():
+            return
         progress = {"value": value, "max": total, "prompt_id": server.last_prompt_id, "node": server.last_node_id}
 
         server.send_sync("progress", progress, server.client_id)
@@ -187,24 +376,11 @@ def load_extra_path_config(yaml_path):
                 folder_paths.add_model_folder_path(x, full_path)
 
 
-if __name__ == "__main__":
+def init_folder_paths():
     if args.temp_directory:
         temp_dir = os.path.join(os.path.abspath(args.temp_directory), "temp")
         logging.info(f"Setting temp directory to: {temp_dir}")
         folder_paths.set_temp_directory(temp_dir)
-    cleanup_temp()
-
-    if args.windows_standalone_build:
-        try:
-            import new_updater
-            new_updater.update_windows_updater()
-        except:
-            pass
-
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    server = server.PromptServer(loop)
-    q = execution.PromptQueue(server)
 
     extra_model_paths_config_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "extra_model_paths.yaml")
     if os.path.isfile(extra_model_paths_config_path):
@@ -214,15 +390,6 @@ if __name__ == "__main__":
         for config_path in itertools.chain(*args.extra_model_paths_config):
             load_extra_path_config(config_path)
 
-    init_custom_nodes()
-
-    cuda_malloc_warning()
-
-    server.add_routes()
-    hijack_progress(server)
-
-    threading.Thread(target=prompt_worker, daemon=True, args=(q, server,)).start()
-
     if args.output_directory:
         output_dir = os.path.abspath(args.output_directory)
         logging.info(f"Setting output directory to: {output_dir}")
@@ -238,6 +405,48 @@ if __name__ == "__main__":
         logging.info(f"Setting input directory to: {input_dir}")
         folder_paths.set_input_directory(input_dir)
 
+
+if __name__ == "__main__":
+    init_folder_paths()
+    cleanup_temp()
+
+    if args.windows_standalone_build:
+        try:
+            import new_updater
+            new_updater.update_windows_updater()
+        except:
+            pass
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = server.PromptServer(loop)
+    q = execution.PromptQueue(server)
+    q.batch_size = args.batch_prompts
+    q.prefetch_count = args.prefetch_prompts
+
+    init_custom_nodes()
+
+    cuda_malloc_warning()
+
+    server.add_routes()
+    hijack_progress(server)
+
+    if args.workers > 0:
+        devices = [None]
+        if args.worker_devices is not None:
+            devices = args.worker_devices.split(",")
+        workers = [PromptWorker(devices[i % len(devices)]) for i in range(args.workers)]
+        q.affinity_window = len(workers)
+
+        def interrupt_workers():
+            for w in workers:
+                w.interrupt()
+        server.add_on_interrupt_handler(interrupt_workers)
+        for w in workers:
+            threading.Thread(target=prompt_worker_dispatch, daemon=True, args=(q, server, w, workers)).start()
+    else:
+        threading.Thread(target=prompt_worker, daemon=True, args=(q, server,)).start()
+
     if args.quick_test_for_ci:
         exit(0)
 
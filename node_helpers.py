@@ -1,3 +1,7 @@
+import torch
+
+import comfy.conds
+
 
 def conditioning_set_values(conditioning, values={}):
     c = []
@@ -8,3 +12,48 @@ def conditioning_set_values(conditioning, values={}):
         c.append(n)
 
     return c
+
+def same_value(a, b):
+    if a is b:
+        return True
+    if isinstance(a, (tuple, list)) and isinstance(b, (tuple, list)):
+        return len(a) == len(b) and all(map(same_value, a, b))
+    if isinstance(a, (int, float, str, bool)) and isinstance(b, (int, float, str, bool)):
+        return a == b
+    return False
+
+def batch_conditioning(conditionings, batch_size=1):
+    """Concatenates the conditioning of several prompts along the batch dimension, each one repeated batch_size times.
+
+    Returns None if they can't be merged: the entries have to line up and only differ in their cond and pooled output."""
+    first = conditionings[0]
+    for c in conditionings:
+        if len(c) != len(first):
+            return None
+
+    out = []
+    for i in range(len(first)):
+        entries = [c[i] for c in conditionings]
+        if any(map(lambda a: a[0].shape[0] != 1, entries)):
+            return None
+
+        crossattn = [comfy.conds.CONDCrossAttn(e[0]) for e in entries]
+        if not all(map(crossattn[0].can_concat, crossattn[1:])):
+            return None
+        cond = crossattn[0].concat(crossattn[1:]).repeat_interleave(batch_size, dim=0)
+
+        n = entries[0][1].copy()
+        for e in entries[1:]:
+            if e[1].keys() != n.keys():
+                return None
+            for k in n:
+                if k != "pooled_output" and not same_value(e[1][k], n[k]):
+                    return None
+
+        pooled = [e[1].get("pooled_output", None) for e in entries]
+        if pooled[0] is not None:
+            if any(map(lambda a: a is None or a.shape[0] != 1, pooled)):
+                return None
+            n["pooled_output"] = torch.cat(pooled).repeat_interleave(batch_size, dim=0)
+        out.append([cond, n])
+    return out
@@ -23,6 +23,7 @@ import comfy.samplers
 import comfy.sample
 import comfy.sd
 import comfy.utils
+import comfy.model_cache
 import comfy.controlnet
 
 import comfy.clip_vision
@@ -52,6 +53,7 @@ class CLIPTextEncode:
     FUNCTION = "encode"
 
     CATEGORY = "conditioning"
+    BATCHABLE_INPUTS = ("text",)
 
     def encode(self, clip, text):
         tokens = clip.tokenize(text)
@@ -495,6 +497,7 @@ class CheckpointLoader:
     FUNCTION = "load_checkpoint"
 
     CATEGORY = "advanced/loaders"
+    PREFETCH_INPUTS = {"ckpt_name": "checkpoints"}
 
     def load_checkpoint(self, config_name, ckpt_name, output_vae=True, output_clip=True):
         config_path = folder_paths.get_full_path("configs", config_name)
@@ -510,6 +513,7 @@ class CheckpointLoaderSimple:
     FUNCTION = "load_checkpoint"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"ckpt_name": "checkpoints"}
 
     def load_checkpoint(self, ckpt_name, output_vae=True, output_clip=True):
         ckpt_path = folder_paths.get_full_path("checkpoints", ckpt_name)
@@ -552,6 +556,7 @@ class unCLIPCheckpointLoader:
     FUNCTION = "load_checkpoint"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"ckpt_name": "checkpoints"}
 
     def load_checkpoint(self, ckpt_name, output_vae=True, output_clip=True):
         ckpt_path = folder_paths.get_full_path("checkpoints", ckpt_name)
@@ -590,6 +595,7 @@ class LoraLoader:
     FUNCTION = "load_lora"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"lora_name": "loras"}
 
     def load_lora(self, model, clip, lora_name, strength_model, strength_clip):
         if strength_model == 0 and strength_clip == 0:
@@ -679,6 +685,7 @@ class VAELoader:
     FUNCTION = "load_vae"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"vae_name": "vae"}
 
     #TODO: scale factor?
     def load_vae(self, vae_name):
@@ -686,7 +693,8 @@ class VAELoader:
             sd = self.load_taesd(vae_name)
         else:
             vae_path = folder_paths.get_full_path("vae", vae_name)
-            sd = comfy.utils.load_torch_file(vae_path)
+            vae = comfy.model_cache.cached_load("vae", [vae_path], (), lambda: comfy.sd.VAE(sd=comfy.utils.load_torch_file(vae_path)))
+            return (vae,)
         vae = comfy.sd.VAE(sd=sd)
         return (vae,)
 
@@ -699,6 +707,7 @@ class ControlNetLoader:
     FUNCTION = "load_controlnet"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"control_net_name": "controlnet"}
 
     def load_controlnet(self, control_net_name):
         controlnet_path = folder_paths.get_full_path("controlnet", control_net_name)
@@ -715,6 +724,7 @@ class DiffControlNetLoader:
     FUNCTION = "load_controlnet"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"control_net_name": "controlnet"}
 
     def load_controlnet(self, model, control_net_name):
         controlnet_path = folder_paths.get_full_path("controlnet", control_net_name)
@@ -808,6 +818,7 @@ class UNETLoader:
     FUNCTION = "load_unet"
 
     CATEGORY = "advanced/loaders"
+    PREFETCH_INPUTS = {"unet_name": "unet"}
 
     def load_unet(self, unet_name):
         unet_path = folder_paths.get_full_path("unet", unet_name)
@@ -824,6 +835,7 @@ class CLIPLoader:
     FUNCTION = "load_clip"
 
     CATEGORY = "advanced/loaders"
+    PREFETCH_INPUTS = {"clip_name": "clip"}
 
     def load_clip(self, clip_name, type="stable_diffusion"):
         clip_type = comfy.sd.CLIPType.STABLE_DIFFUSION
@@ -843,6 +855,7 @@ class DualCLIPLoader:
     FUNCTION = "load_clip"
 
     CATEGORY = "advanced/loaders"
+    PREFETCH_INPUTS = {"clip_name1": "clip", "clip_name2": "clip"}
 
     def load_clip(self, clip_name1, clip_name2):
         clip_path1 = folder_paths.get_full_path("clip", clip_name1)
@@ -859,6 +872,7 @@ class CLIPVisionLoader:
     FUNCTION = "load_clip"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"clip_name": "clip_vision"}
 
     def load_clip(self, clip_name):
         clip_path = folder_paths.get_full_path("clip_vision", clip_name)
@@ -889,6 +903,7 @@ class StyleModelLoader:
     FUNCTION = "load_style_model"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"style_model_name": "style_models"}
 
     def load_style_model(self, style_model_name):
         style_model_path = folder_paths.get_full_path("style_models", style_model_name)
@@ -954,6 +969,7 @@ class GLIGENLoader:
     FUNCTION = "load_gligen"
 
     CATEGORY = "loaders"
+    PREFETCH_INPUTS = {"gligen_name": "gligen"}
 
     def load_gligen(self, gligen_name):
         gligen_path = folder_paths.get_full_path("gligen", gligen_name)
@@ -1297,13 +1313,21 @@ class SetLatentNoiseMask:
         s["noise_mask"] = mask.reshape((-1, 1, mask.shape[-2], mask.shape[-1]))
         return (s,)
 
-def common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent, denoise=1.0, disable_noise=False, start_step=None, last_step=None, force_full_denoise=False):
+def common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent, denoise=1.0, disable_noise=False, start_step=None, last_step=None, force_full_denoise=False, batch_seeds=None):
     latent_image = latent["samples"]
+    if batch_seeds is not None:
+        #the latent gets sampled once per seed in a single batch
+        seed = batch_seeds[0]
+        latent_image = torch.cat([latent_image] * len(batch_seeds))
+
     if disable_noise:
         noise = torch.zeros(latent_image.size(), dtype=latent_image.dtype, layout=latent_image.layout, device="cpu")
     else:
         batch_inds = latent["batch_index"] if "batch_index" in latent else None
-        noise = comfy.sample.prepare_noise(latent_image, seed, batch_inds)
+        if batch_seeds is not None:
+            noise = torch.cat([comfy.sample.prepare_noise(latent["samples"], s, batch_inds) for s in batch_seeds])
+        else:
+            noise = comfy.sample.prepare_noise(latent_image, seed, batch_inds)
 
     noise_mask = None
     if "noise_mask" in latent:
@@ -1318,6 +1342,45 @@ def common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive,
     out["samples"] = samples
     return (out, )
 
+def common_ksampler_batch(sample_function, inputs, seed_name):
+    """Samples the items of list inputs that only differ by seed and conditioning in a single batch.
+
+    The items that can't be merged are sampled one at a time. Returns one list of latents like OUTPUT_IS_LIST."""
+    count = max(map(len, inputs.values()))
+    items = [{k: v[i if len(v) > i else -1] for k, v in inputs.items()} for i in range(count)]
+
+    groups = {}
+    for i, item in enumerate(items):
+        key = []
+        for k in sorted(item):
+            if k not in (seed_name, "positive", "negative"):
+                v = item[k]
+                key.append((k, v if isinstance(v, (int, float, str, bool)) else id(v)))
+        groups.setdefault(tuple(key), []).append(i)
+
+    out = [None] * count
+    for indices in groups.values():
+        if len(indices) > 1:
+            batch = [items[i] for i in indices]
+            batch_size = batch[0]["latent_image"]["samples"].shape[0]
+            positive = node_helpers.batch_conditioning([x["positive"] for x in batch], batch_size)
+            negative = node_helpers.batch_conditioning([x["negative"] for x in batch], batch_size)
+            if positive is not None and negative is not None:
+                kwargs = batch[0].copy()
+                kwargs["positive"] = positive
+                kwargs["negative"] = negative
+                kwargs["batch_seeds"] = [x[seed_name] for x in batch]
+                samples = sample_function(**kwargs)[0]
+                for j, i in enumerate(indices):
+                    o = samples.copy()
+                    o["samples"] = samples["samples"][j * batch_size:(j + 1) * batch_size]
+                    out[i] = o
+                continue
+
+        for i in indices:
+            out[i] = sample_function(**items[i])[0]
+    return (out, )
+
 class KSampler:
     @classmethod
     def INPUT_TYPES(s):
@@ -1337,11 +1400,16 @@ class KSampler:
 
     RETURN_TYPES = ("LATENT",)
     FUNCTION = "sample"
+    BATCH_FUNCTION = "sample_batch"
 
     CATEGORY = "sampling"
+    BATCHABLE_INPUTS = ("seed",)
+
+    def sample(self, model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise=1.0, batch_seeds=None):
+        return common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise=denoise, batch_seeds=batch_seeds)
 
-    def sample(self, model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise=1.0):
-        return common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise=denoise)
+    def sample_batch(self, **kwargs):
+        return common_ksampler_batch(self.sample, kwargs, "seed")
 
 class KSamplerAdvanced:
     @classmethod
@@ -1365,17 +1433,22 @@ class KSamplerAdvanced:
 
     RETURN_TYPES = ("LATENT",)
     FUNCTION = "sample"
+    BATCH_FUNCTION = "sample_batch"
 
     CATEGORY = "sampling"
+    BATCHABLE_INPUTS = ("noise_seed",)
 
-    def sample(self, model, add_noise, noise_seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, start_at_step, end_at_step, return_with_leftover_noise, denoise=1.0):
+    def sample(self, model, add_noise, noise_seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, start_at_step, end_at_step, return_with_leftover_noise, denoise=1.0, batch_seeds=None):
         force_full_denoise = True
         if return_with_leftover_noise == "enable":
             force_full_denoise = False
         disable_noise = False
         if add_noise == "disable":
             disable_noise = True
-        return common_ksampler(model, noise_seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise=denoise, disable_noise=disable_noise, start_step=start_at_step, last_step=end_at_step, force_full_denoise=force_full_denoise)
+        return common_ksampler(model, noise_seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise=denoise, disable_noise=disable_noise, start_step=start_at_step, last_step=end_at_step, force_full_denoise=force_full_denoise, batch_seeds=batch_seeds)
+
+    def sample_batch(self, **kwargs):
+        return common_ksampler_batch(self.sample, kwargs, "noise_seed")
 
 class SaveImage:
     def __init__(self):
@@ -1451,6 +1524,7 @@ class LoadImage:
                 }
 
     CATEGORY = "image"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "load_image"
@@ -1510,6 +1584,7 @@ class LoadImageMask:
                 }
 
     CATEGORY = "mask"
+    CPU_SAFE = True
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "load_image"
@@ -1561,6 +1636,7 @@ class ImageScale:
     FUNCTION = "upscale"
 
     CATEGORY = "image/upscaling"
+    CPU_SAFE = True
 
     def upscale(self, image, upscale_method, width, height, crop):
         if width == 0 and height == 0:
@@ -1588,6 +1664,7 @@ class ImageScaleBy:
     FUNCTION = "upscale"
 
     CATEGORY = "image/upscaling"
+    CPU_SAFE = True
 
     def upscale(self, image, upscale_method, scale_by):
         samples = image.movedim(-1,1)
@@ -1607,6 +1684,7 @@ class ImageInvert:
     FUNCTION = "invert"
 
     CATEGORY = "image"
+    CPU_SAFE = True
 
     def invert(self, image):
         s = 1.0 - image
@@ -1622,6 +1700,7 @@ class ImageBatch:
     FUNCTION = "batch"
 
     CATEGORY = "image"
+    CPU_SAFE = True
 
     def batch(self, image1, image2):
         if image1.shape[1:] != image2.shape[1:]:
@@ -1644,6 +1723,7 @@ class EmptyImage:
     FUNCTION = "generate"
 
     CATEGORY = "image"
+    CPU_SAFE = True
 
     def generate(self, width, height, batch_size=1, color=0):
         r = torch.full([batch_size, height, width, 1], ((color >> 16) & 0xFF) / 0xFF)
@@ -1670,6 +1750,7 @@ class ImagePadForOutpaint:
     FUNCTION = "expand_image"
 
     CATEGORY = "image"
+    CPU_SAFE = True
 
     def expand_image(self, image, left, top, right, bottom, feathering):
         d1, d2, d3, d4 = image.size()
@@ -1944,6 +2025,7 @@ def init_custom_nodes():
         "nodes_model_merging_model_specific.py",
         "nodes_pag.py",
         "nodes_align_your_steps.py",
+        "nodes_deepcache.py",
     ]
 
     import_failed = []
@@ -23,6 +23,13 @@ import mimetypes
 from comfy.cli_args import args
 import comfy.utils
 import comfy.model_management
+import comfy.clip_cache
+import comfy.model_cache
+import comfy.memory_estimator
+import comfy.weight_dedup
+import comfy.model_patcher
+import comfy.pinned_memory
+import comfy.samplers
 
 from app.user_manager import UserManager
 
@@ -70,6 +77,7 @@ class PromptServer():
         self.user_manager = UserManager()
         self.supports = ["custom_nodes_from_web"]
         self.prompt_queue = None
+        self.prompt_executor = None
         self.loop = loop
         self.messages = asyncio.Queue()
         self.number = 0
@@ -89,6 +97,7 @@ class PromptServer():
         self.client_id = None
 
         self.on_prompt_handlers = []
+        self.on_interrupt_handlers = []
 
         @routes.get('/ws')
         async def websocket_handler(request):
@@ -380,6 +389,20 @@ class PromptServer():
                     }
                 ]
             }
+            if self.prompt_executor is not None:
+                system_stats["cache"] = self.prompt_executor.cache.get_stats()
+            if comfy.clip_cache.cache is not None:
+                system_stats["clip_cache"] = comfy.clip_cache.cache.get_stats()
+            system_stats["weight_patching"] = comfy.model_patcher.get_patch_stats()
+            system_stats["model_eviction"] = comfy.model_management.eviction_policy.get_stats()
+            system_stats["memory_estimator"] = comfy.memory_estimator.estimator.get_stats()
+            system_stats["cond_batching"] = comfy.samplers.get_cond_batch_stats()
+            if args.dedup_weights:
+                system_stats["weight_dedup"] = comfy.weight_dedup.registry.get_stats()
+            if comfy.pinned_memory.pool is not None:
+                system_stats["pinned_memory"] = comfy.pinned_memory.pool.get_stats()
+            if comfy.model_cache.cache.max_size > 0:
+                system_stats["model_cache"] = comfy.model_cache.cache.get_stats()
             return web.json_response(system_stats)
 
         @routes.get("/prompt")
@@ -501,6 +524,8 @@ class PromptServer():
         @routes.post("/interrupt")
         async def post_interrupt(request):
             nodes.interrupt_processing()
+            for handler in self.on_interrupt_handlers:
+                handler()
             return web.Response(status=200)
 
         @routes.post("/free")
@@ -635,6 +660,9 @@ class PromptServer():
     def add_on_prompt_handler(self, handler):
         self.on_prompt_handlers.append(handler)
 
+    def add_on_interrupt_handler(self, handler):
+        self.on_interrupt_handlers.append(handler)
+
     def trigger_on_prompt(self, json_data):
         for handler in self.on_prompt_handlers:
             try:
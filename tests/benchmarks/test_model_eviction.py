@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+import comfy.model_eviction
+
+"""
+Replays a trace of model loads to compare the eviction policies offline
+"""
+
+GB = 1024 * 1024 * 1024
+
+MODELS = {
+    "sdxl_a": (6.5 * GB, 20.0),
+    "sdxl_b": (6.5 * GB, 20.0),
+    "sd15": (2.0 * GB, 6.0),
+    "clip_l_g": (1.6 * GB, 3.0),
+    "clip_l": (0.25 * GB, 0.8),
+    "controlnet": (2.5 * GB, 5.0),
+    "vae": (0.3 * GB, 0.5),
+    "upscaler": (0.07 * GB, 0.2),
+}
+
+WORKFLOWS = [
+    (["clip_l_g"], ["sdxl_a"], ["vae"]),
+    (["clip_l_g"], ["sdxl_a", "controlnet"], ["vae"]),
+    (["clip_l_g"], ["sdxl_b"], ["vae"], ["upscaler"]),
+    (["clip_l"], ["sd15"], ["vae"]),
+]
+
+def make_trace(steps, seed=0):
+    rng = random.Random(seed)
+    trace = []
+    for i in range(steps):
+        workflow = rng.choices(WORKFLOWS, weights=[8, 3, 2, 1])[0]
+        for models in workflow:
+            trace.append([(name,) + MODELS[name] for name in models])
+    return trace
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("capacity", [10 * GB, 16 * GB])
+def test_eviction_policies(capacity):
+    trace = make_trace(500)
+    requests = sum(map(len, trace))
+    results = {}
+    for name in comfy.model_eviction.EVICTION_POLICIES:
+        out = comfy.model_eviction.simulate(comfy.model_eviction.get_policy(name), trace, capacity)
+        assert out["hits"] + out["misses"] == requests
+        assert out["misses"] >= len(MODELS)
+        results[name] = out
+        print("{} GB {}".format(capacity / GB, out))
+
+    unlimited = comfy.model_eviction.simulate(comfy.model_eviction.get_policy("lru"), trace, 100 * GB)
+    assert unlimited["misses"] == len(MODELS)
+    assert unlimited["evictions"] == 0
@@ -0,0 +1,79 @@
+import types
+
+import pytest
+import torch
+
+import comfy.conds
+import comfy.samplers
+from comfy_extras.nodes_custom_sampler import Guider_UncondSchedule
+
+"""
+Samples with a toy denoiser using the CFG truncation and uncond caching guiders and reports the model passes saved
+and the drift from regular CFG with the SSIM metric of the tests/compare harness
+"""
+
+class ToyModel:
+    def __init__(self, shape):
+        self.calls = 0
+        ys, xs = torch.meshgrid(torch.linspace(-1, 1, shape[2]), torch.linspace(-1, 1, shape[3]), indexing="ij")
+        self.pattern = torch.stack([torch.sin(3 * xs), torch.cos(2 * ys), xs * ys, torch.sin(xs + ys)]).unsqueeze(0)
+
+    def memory_required(self, input_shape):
+        return 0
+
+    def memory_estimate_key(self):
+        return ("ToyModel",)
+
+    def apply_model(self, x, t, c_crossattn=None, **kwargs):
+        self.calls += 1
+        #the denoised prediction drifts towards a pattern scaled by the prompt
+        strength = c_crossattn.mean(dim=(1, 2)).reshape(-1, 1, 1, 1)
+        sigma = t.reshape(-1, 1, 1, 1)
+        return (x * 0.3 / (1 + sigma) + self.pattern * strength).float()
+
+def make_guider(model, guider_class=comfy.samplers.CFGGuider):
+    guider = guider_class(types.SimpleNamespace(model_options={}))
+    guider.inner_model = model
+    guider.conds = {"positive": [{"model_conds": {"c_crossattn": comfy.conds.CONDCrossAttn(torch.ones((1, 77, 64)))}}],
+                    "negative": [{"model_conds": {"c_crossattn": comfy.conds.CONDCrossAttn(torch.full((1, 77, 64), 0.2))}}]}
+    guider.set_cfg(6.0)
+    return guider
+
+def sample(guider, noise, sigmas):
+    x = noise * sigmas[0]
+    for i in range(len(sigmas) - 1):
+        denoised = guider(x, sigmas[i:i + 1], model_options={})
+        d = (x - denoised) / sigmas[i]
+        x = x + d * (sigmas[i + 1] - sigmas[i])
+    return x
+
+def to_image(x):
+    x = x[0, :3].movedim(0, -1)
+    x = (x - x.min()) / (x.max() - x.min())
+    return (x * 255).to(torch.uint8).numpy()
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("mode,sigma_start,sigma_end,interval", [("drop", 1.0, 0.0, 1), ("cache", 1000.0, 0.0, 2), ("cache", 1000.0, 0.0, 3)])
+def test_uncond_schedule(mode, sigma_start, sigma_end, interval):
+    pytest.importorskip("cv2")
+    pytest.importorskip("skimage")
+    from tests.compare.test_quality import ssim_score, METRICS_PASS_THRESHOLD
+
+    shape = (1, 4, 64, 64)
+    noise = torch.randn(shape, generator=torch.Generator().manual_seed(0))
+    sigmas = torch.cat([torch.linspace(14.6, 0.03, 20), torch.zeros((1,))])
+
+    model = ToyModel(shape)
+    reference = sample(make_guider(model), noise, sigmas)
+    reference_calls = model.calls
+
+    model = ToyModel(shape)
+    guider = make_guider(model, Guider_UncondSchedule)
+    guider.set_schedule(mode, sigma_start, sigma_end, interval)
+    out = sample(guider, noise, sigmas)
+
+    score, diff = ssim_score(to_image(reference), to_image(out))
+    print("{} {}-{} interval {}: {} of {} passes saved, {} model calls instead of {}, ssim {:.4f}".format(mode, sigma_start, sigma_end, interval, guider.model_calls_saved,
+          guider.model_calls + guider.model_calls_saved, model.calls, reference_calls, score))
+    assert guider.model_calls_saved > 0
+    assert score > METRICS_PASS_THRESHOLD["ssim"]
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+import torch
+
+import comfy.model_patcher
+
+"""
+Compares patching lora weights one key at a time with the batched patching of ModelPatcher.patch_weights_batched on cpu
+"""
+
+def make_patcher(count, features):
+    model = torch.nn.Sequential(*[torch.nn.Linear(features, features) for i in range(count)])
+    return comfy.model_patcher.ModelPatcher(model, load_device=torch.device("cpu"), offload_device=torch.device("cpu"))
+
+def make_lora(patcher, rank):
+    patches = {}
+    for i, m in enumerate(patcher.model):
+        up = torch.randn(m.weight.shape[0], rank) * 0.01
+        down = torch.randn(rank, m.weight.shape[1]) * 0.01
+        patches["{}.weight".format(i)] = ("lora", (up, down, float(rank), None, None))
+    return patches
+
+def time_patch(patcher, batched):
+    if not batched:
+        patcher.patch_weights_batched = lambda keys, device_to=None: set()
+    start = time.perf_counter()
+    patcher.patch_model()
+    elapsed = time.perf_counter() - start
+    weights = {k: v.clone() for k, v in patcher.model.state_dict().items()}
+    patcher.unpatch_model()
+    return elapsed, weights
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("rank", [4, 16, 64])
+@pytest.mark.parametrize("key_count", [64, 256])
+def test_batched_patching(rank, key_count):
+    cache_size = comfy.model_patcher.patch_cache.max_size
+    comfy.model_patcher.patch_cache.max_size = 0
+    try:
+        base = make_patcher(key_count, 320)
+        loras = [make_lora(base, rank) for i in range(2)]
+        patchers = []
+        for batched in (False, True):
+            p = base.clone()
+            for lora in loras:
+                p.add_patches(lora, 0.8)
+            patchers.append(p)
+
+        time_patch(patchers[1], True) #warmup
+        single_time, single_weights = time_patch(patchers[0], False)
+        batched_time, batched_weights = time_patch(patchers[1], True)
+    finally:
+        comfy.model_patcher.patch_cache.max_size = cache_size
+
+    for k in single_weights:
+        assert torch.allclose(single_weights[k], batched_weights[k], atol=1e-5)
+    print("rank {} keys {}: per key {:.4f}s batched {:.4f}s".format(rank, key_count, single_time, batched_time))
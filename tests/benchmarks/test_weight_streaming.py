@@ -0,0 +1,51 @@
+import time
+
+import pytest
+import torch
+
+import comfy.ops
+import comfy.weight_streaming
+
+"""
+Runs a stack of cast weight layers with and without comfy.weight_streaming on cpu, the copies are done by the thread copier
+"""
+
+def make_model(count, features):
+    layers = []
+    for i in range(count):
+        layer = comfy.ops.disable_weight_init.Linear(features, features, dtype=torch.float16)
+        torch.nn.init.normal_(layer.weight, std=features ** -0.5)
+        torch.nn.init.zeros_(layer.bias)
+        layer.comfy_cast_weights = True
+        #stands in for the lora patching done on the cast weight in lowvram mode
+        layer.weight_function = lambda w: w * 0.9
+        layers.append(layer)
+    return torch.nn.Sequential(*layers)
+
+def run(model, x, steps):
+    start = time.perf_counter()
+    for i in range(steps):
+        out = model(x)
+    return time.perf_counter() - start, out
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("features", [256, 1024])
+def test_weight_streaming(features):
+    model = make_model(32, features)
+    x = torch.randn(64, features)
+
+    with torch.inference_mode():
+        run(model, x, 1)
+        cast_time, expected = run(model, x, 5)
+
+        streamer = comfy.weight_streaming.WeightStreamer(list(model), torch.device("cpu"), copier=comfy.weight_streaming.ThreadCopier(torch.device("cpu")))
+        for m in model:
+            m.weight_streamer = streamer
+        run(model, x, 1)
+        stream_time, out = run(model, x, 5)
+        streamer.reset()
+
+    assert torch.allclose(out, expected)
+    assert streamer.misses <= 2
+    assert streamer.pool.allocations <= 8
+    print("features {}: cast {:.4f}s streamed {:.4f}s {}".format(features, cast_time, stream_time, streamer.pool.get_stats()))
@@ -0,0 +1,19 @@
+import pytest
+
+from comfy.cli_args import args
+# the executor tests run without a gpu
+args.cpu = True
+
+import nodes
+from tests.executor import graph_nodes
+
+@pytest.fixture
+def int_nodes(monkeypatch):
+    for name, node_class in graph_nodes.NODE_CLASS_MAPPINGS.items():
+        monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, name, node_class)
+    graph_nodes.executions.clear()
+    return graph_nodes
+
+@pytest.fixture
+def server():
+    return graph_nodes.FakeServer()
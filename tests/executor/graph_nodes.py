@@ -0,0 +1,99 @@
+import threading
+
+"""
+Nodes that only add ints, used to run prompts through the executor without loading any model
+"""
+
+executions = []
+
+class IntValue:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("INT", {"default": 0, "min": -1000, "max": 1000})}}
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+
+    def run(self, value):
+        executions.append((self.__class__.__name__, threading.current_thread()))
+        return (value,)
+
+class IntAdd:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"a": ("INT", {"default": 0, "min": -1000, "max": 1000}), "b": ("INT", {"default": 0, "min": -1000, "max": 1000})}}
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+
+    def run(self, a, b):
+        executions.append((self.__class__.__name__, threading.current_thread()))
+        return (a + b,)
+
+class CpuIntAdd(IntAdd):
+    CPU_SAFE = True
+
+class BatchableIntValue(IntValue):
+    BATCHABLE_INPUTS = ("value",)
+
+class BatchIntAdd(IntAdd):
+    BATCH_FUNCTION = "run_batch"
+
+    def run_batch(self, a, b):
+        executions.append(("BatchIntAdd.run_batch", threading.current_thread()))
+        return ([x + b[i if len(b) > i else -1] for i, x in enumerate(a)],)
+
+class IntOutput:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("INT", {"default": 0, "min": -1000, "max": 1000})}}
+    RETURN_TYPES = ()
+    FUNCTION = "run"
+    OUTPUT_NODE = True
+
+    def run(self, value):
+        executions.append((self.__class__.__name__, threading.current_thread()))
+        return {"ui": {"value": [value]}}
+
+class PromptIntOutput(IntOutput):
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("INT", {"default": 0, "min": -1000, "max": 1000})},
+                "hidden": {"prompt": "PROMPT", "extra_pnginfo": "EXTRA_PNGINFO"}}
+
+    def run(self, value, prompt=None, extra_pnginfo=None):
+        return IntOutput.run(self, value)
+
+NODE_CLASS_MAPPINGS = {
+    "IntValue": IntValue,
+    "IntAdd": IntAdd,
+    "CpuIntAdd": CpuIntAdd,
+    "BatchableIntValue": BatchableIntValue,
+    "BatchIntAdd": BatchIntAdd,
+    "IntOutput": IntOutput,
+    "PromptIntOutput": PromptIntOutput,
+}
+
+def value(v, class_type="IntValue"):
+    return {"class_type": class_type, "inputs": {"value": v}}
+
+def add(a, b, class_type="IntAdd"):
+    return {"class_type": class_type, "inputs": {"a": a, "b": b}}
+
+def output(v):
+    return {"class_type": "IntOutput", "inputs": {"value": v}}
+
+class FakeServer:
+    """Records the messages the executor sends instead of sending them to a client."""
+    def __init__(self):
+        self.client_id = None
+        self.last_node_id = None
+        self.last_prompt_id = None
+        self.messages = []
+
+    def send_sync(self, event, data, sid=None):
+        self.messages.append((event, data, threading.current_thread()))
+
+    def queue_updated(self):
+        pass
+
+    def events(self, event):
+        return [m[1] for m in self.messages if m[0] == event]
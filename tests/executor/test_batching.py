@@ -0,0 +1,63 @@
+import comfy_execution.batching
+import execution
+from tests.executor.graph_nodes import add, output, value
+
+"""
+Queued prompts that only differ in their BATCHABLE_INPUTS are fused and their nodes with a BATCH_FUNCTION run once
+"""
+
+def batch_prompt(seed, offset=10):
+    return {
+        "1": value(seed, "BatchableIntValue"),
+        "2": value(offset),
+        "3": add(["1", 0], ["2", 0], "BatchIntAdd"),
+        "4": output(["3", 0]),
+    }
+
+def queue_item(number, prompt):
+    return (number, "prompt{}".format(number), prompt, {"client_id": "client{}".format(number)}, ["4"])
+
+def test_batch_key(int_nodes):
+    key = comfy_execution.batching.batch_key(queue_item(0, batch_prompt(1)))
+    assert key is not None
+    assert comfy_execution.batching.batch_key(queue_item(1, batch_prompt(2))) == key
+    assert comfy_execution.batching.batch_key(queue_item(2, batch_prompt(1, offset=20))) != key
+
+def test_fused_prompts(int_nodes, server):
+    q = execution.PromptQueue(server)
+    q.batch_size = 3
+    q.put(queue_item(0, batch_prompt(1)))
+    q.put(queue_item(1, batch_prompt(1, offset=20)))
+    q.put(queue_item(2, batch_prompt(2)))
+    q.put(queue_item(3, batch_prompt(3)))
+
+    item, item_id = q.get()
+    tasks = item[5]
+    assert [x[0][1] for x in tasks] == ["prompt0", "prompt2", "prompt3"]
+    assert len(q.queue) == 1
+
+    e = execution.PromptExecutor(server)
+    e.execute(item[2], item[1], item[3], item[4])
+    assert e.success
+    assert [x[0] for x in int_nodes.executions].count("BatchIntAdd.run_batch") == 1
+
+    outputs_ui = comfy_execution.batching.split_outputs_ui(item[2], e.outputs_ui, len(tasks))
+    assert [x["4"]["value"] for x in outputs_ui] == [[11], [12], [13]]
+
+def test_fused_outputs_not_sent_during_execution(int_nodes, server):
+    q = execution.PromptQueue(server)
+    q.batch_size = 2
+    q.put(queue_item(0, batch_prompt(1)))
+    q.put(queue_item(1, batch_prompt(2)))
+    item, item_id = q.get()
+    assert len(item[5]) == 2
+
+    #the outputs of a fused run hold the ones of every prompt, they must not reach the client of the first one
+    server.client_id = item[3]["client_id"]
+    e = execution.PromptExecutor(server)
+    e.execute(item[2], item[1], item[3], item[4])
+    assert e.success
+    assert server.events("executed") == []
+
+    e.execute(item[2], item[1], item[3], item[4])
+    assert server.events("executed") == []
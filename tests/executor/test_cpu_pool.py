@@ -0,0 +1,44 @@
+import threading
+
+import torch
+
+import comfy.cli_args
+import comfy.model_management
+import execution
+from tests.executor.graph_nodes import add, output, value
+
+"""
+Nodes marked CPU_SAFE run on the cpu pool while the messages to the client are only sent from the execution thread
+"""
+
+def test_cpu_safe_nodes_run_on_pool(int_nodes, server):
+    e = execution.PromptExecutor(server, cpu_threads=2)
+    prompt = {
+        "1": value(1),
+        "2": value(2),
+        "3": add(["1", 0], ["2", 0], "CpuIntAdd"),
+        "4": add(["3", 0], ["1", 0], "CpuIntAdd"),
+        "5": output(["4", 0]),
+        "6": add(["1", 0], ["2", 0]),
+        "7": output(["6", 0]),
+    }
+    e.execute(prompt, "prompt", {"client_id": "client"}, ["5", "7"])
+
+    assert e.success
+    assert e.outputs_ui["5"] == {"value": [4]}
+    assert e.outputs_ui["7"] == {"value": [3]}
+
+    main_thread = threading.current_thread()
+    for class_type, thread in int_nodes.executions:
+        assert (thread is main_thread) == (class_type != "CpuIntAdd")
+    assert all(m[2] is main_thread for m in server.messages)
+    assert set(m["node"] for m in server.events("executing")) == {"1", "2", "5", "6", "7"}
+    assert sorted(m["node"] for m in server.events("executed")) == ["5", "7"]
+
+def test_cpu_pool_disabled_by_default(int_nodes, server):
+    cpu_threads = comfy.cli_args.parser.parse_args([]).cpu_node_threads
+    assert execution.PromptExecutor(server, cpu_threads=cpu_threads).cpu_pool is None
+
+def test_cpu_pool_disabled_for_gpu_outputs(int_nodes, server, monkeypatch):
+    monkeypatch.setattr(comfy.model_management, "intermediate_device", lambda: torch.device("cuda"))
+    assert execution.PromptExecutor(server, cpu_threads=2).cpu_pool is None
@@ -0,0 +1,54 @@
+from comfy_execution.graph import ExecutionList, dependency_depth, topological_sort
+
+"""
+Graph walks used by validation and execution, they must not recurse on deep graphs
+"""
+
+def node(*inputs):
+    return {"class_type": "Node", "inputs": {"input{}".format(i): [x, 0] for i, x in enumerate(inputs)}}
+
+def chain(length, prefix="n"):
+    prompt = {"{}0".format(prefix): node()}
+    for i in range(1, length):
+        prompt["{}{}".format(prefix, i)] = node("{}{}".format(prefix, i - 1))
+    return prompt
+
+def run(execution_list):
+    order = []
+    unique_id = execution_list.pop_ready()
+    while unique_id is not None:
+        order.append(unique_id)
+        execution_list.complete_node(unique_id)
+        unique_id = execution_list.pop_ready()
+    return order
+
+def test_deep_graph():
+    prompt = chain(20000)
+    order = topological_sort(prompt, ["n19999"])
+    assert order == ["n{}".format(i) for i in range(20000)]
+    assert len(run(ExecutionList(prompt, ["n19999"], {}))) == 20000
+
+def test_stop_at_cached():
+    prompt = chain(10)
+    assert topological_sort(prompt, ["n9"], stop_at={"n4": None}) == ["n{}".format(i) for i in range(5, 10)]
+    execution_list = ExecutionList(prompt, ["n9"], {"n4": None})
+    assert run(execution_list) == ["n{}".format(i) for i in range(5, 10)]
+    assert execution_list.is_empty()
+
+def test_shortest_chain_first():
+    prompt = chain(10, "long")
+    prompt.update(chain(2, "short"))
+    prompt["shared"] = node()
+    prompt["out_long"] = node("long9", "shared")
+    prompt["out_short"] = node("short1", "shared")
+
+    assert dependency_depth(prompt, ["out_long", "out_short"]) == {"out_long": 11, "out_short": 3}
+    order = run(ExecutionList(prompt, ["out_long", "out_short"], {}))
+    assert order.index("out_short") < order.index("long0")
+    assert order[-1] == "out_long"
+
+def test_dependency_cycle():
+    prompt = {"a": node("b"), "b": node("a"), "c": node(), "out": node("a", "c")}
+    execution_list = ExecutionList(prompt, ["out"], {})
+    assert run(execution_list) == ["c"]
+    assert not execution_list.is_empty()
@@ -0,0 +1,115 @@
+import torch
+
+import comfy.model_management
+import comfy_execution.caching
+import execution
+from tests.executor.graph_nodes import add, output, value
+
+"""
+The output cache is keyed by the structure of the graph, not by the node ids, and keeps the outputs of the last
+prompts until there is memory pressure
+"""
+
+def executed_classes(int_nodes):
+    classes = [x[0] for x in int_nodes.executions]
+    int_nodes.executions.clear()
+    return classes
+
+def sum_prompt(a, b, ids=("1", "2", "3", "4")):
+    return {
+        ids[0]: value(a),
+        ids[1]: value(b),
+        ids[2]: add([ids[0], 0], [ids[1], 0]),
+        ids[3]: output([ids[2], 0]),
+    }
+
+def test_same_graph_different_ids(int_nodes, server):
+    e = execution.PromptExecutor(server)
+    e.execute(sum_prompt(1, 2), "a", {}, ["4"])
+    assert len(executed_classes(int_nodes)) == 4
+
+    e.execute(sum_prompt(1, 2, ids=("10", "11", "12", "13")), "b", {}, ["13"])
+    assert e.success
+    assert executed_classes(int_nodes) == []
+    assert e.outputs_ui["13"] == {"value": [3]}
+
+def test_changed_input_executes_downstream_only(int_nodes, server):
+    e = execution.PromptExecutor(server)
+    e.execute(sum_prompt(1, 2), "a", {}, ["4"])
+    executed_classes(int_nodes)
+
+    e.execute(sum_prompt(1, 5), "b", {}, ["4"])
+    assert sorted(executed_classes(int_nodes)) == ["IntAdd", "IntOutput", "IntValue"]
+    assert e.outputs_ui["4"] == {"value": [6]}
+
+def test_signature_depends_on_inputs(int_nodes, server):
+    e = execution.PromptExecutor(server)
+    a = e.load_cached_outputs(sum_prompt(1, 2), {})
+    b = e.load_cached_outputs(sum_prompt(1, 2, ids=("5", "6", "7", "8")), {})
+    c = e.load_cached_outputs(sum_prompt(2, 1), {})
+    assert a["4"] == b["8"]
+    assert a["4"] != c["4"]
+
+def test_workflow_outputs_depend_on_prompt(int_nodes, server):
+    #nodes that save the workflow with their outputs aren't served from the cache of another workflow
+    e = execution.PromptExecutor(server)
+    prompt = sum_prompt(1, 2)
+    prompt["4"]["class_type"] = "PromptIntOutput"
+    e.execute(prompt, "a", {"extra_pnginfo": {"workflow": "a"}}, ["4"])
+    executed_classes(int_nodes)
+
+    other = dict(prompt, **{"5": value(7)})
+    e.execute(other, "b", {"extra_pnginfo": {"workflow": "a"}}, ["4"])
+    assert executed_classes(int_nodes) == ["PromptIntOutput"]
+
+    e.execute(other, "c", {"extra_pnginfo": {"workflow": "c"}}, ["4"])
+    assert executed_classes(int_nodes) == ["PromptIntOutput"]
+
+    e.execute(other, "d", {"extra_pnginfo": {"workflow": "c"}}, ["4"])
+    assert executed_classes(int_nodes) == []
+
+def test_keeps_last_prompts(monkeypatch):
+    monkeypatch.setattr(comfy.model_management, "get_free_memory", lambda dev=None, torch_free_too=False: 1024 * 1024 * 1024)
+    cache = comfy_execution.caching.OutputCache(max_size=0, max_prompts=2, min_free=0)
+    for signature in ["a", "b", "c"]:
+        cache.set(signature, [[torch.zeros(256)]])
+        cache.set_prompt([signature])
+        cache.evict()
+    assert list(cache.entries.keys()) == ["b", "c"]
+
+def test_memory_pressure_eviction(monkeypatch):
+    free = {"memory": 0}
+    monkeypatch.setattr(comfy.model_management, "get_free_memory", lambda dev=None, torch_free_too=False: free["memory"])
+    cache = comfy_execution.caching.OutputCache(max_size=1024 * 1024 * 1024, max_prompts=4, eviction_policy="cost", min_free=2048)
+
+    cache.set("cheap", [[torch.zeros(256)]], cost=0.1)
+    cache.set("expensive", [[torch.zeros(256)]], cost=10.0)
+    cache.set("current", [[torch.zeros(256)]], cost=0.0)
+    cache.set_prompt(["current"])
+
+    free["memory"] = 1024
+    cache.evict()
+    assert list(cache.entries.keys()) == ["expensive", "current"]
+    assert cache.get_stats()["evictions"] == 1
+
+    free["memory"] = 0
+    cache.evict()
+    assert list(cache.entries.keys()) == ["current"]
+
+class Upscaler:
+    """Holds its weights the way spandrel and style models do, in a module attribute."""
+    def __init__(self):
+        self.model = torch.nn.Linear(16, 16)
+
+def test_size_of_wrapped_models():
+    storage = comfy_execution.caching.collect_storage([[Upscaler(), {"control": Upscaler()}]])
+    assert sum(size for size, device in storage.values()) == 2 * (16 * 16 + 16) * 4
+
+def test_evicts_old_outputs_without_memory(monkeypatch):
+    monkeypatch.setattr(comfy.model_management, "get_free_memory", lambda dev=None, torch_free_too=False: 1024 * 1024 * 1024)
+    cache = comfy_execution.caching.OutputCache(max_size=1024 * 1024 * 1024, max_prompts=2, min_free=0)
+    for signature in ["a", "b", "c"]:
+        cache.set(signature, [[1]])
+        cache.set_prompt([signature])
+        cache.evict()
+    assert list(cache.entries.keys()) == ["b", "c"]
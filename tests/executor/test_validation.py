@@ -0,0 +1,37 @@
+import execution
+from tests.executor.graph_nodes import add, output, value
+
+"""
+Prompt validation walks the graph once no matter how many outputs share it
+"""
+
+def wide_prompt(outputs):
+    prompt = {"v": value(1)}
+    last = "v"
+    for i in range(1000):
+        prompt["a{}".format(i)] = add([last, 0], ["v", 0])
+        last = "a{}".format(i)
+    for i in range(outputs):
+        prompt["out{}".format(i)] = output([last, 0])
+    return prompt
+
+def test_validate_sorts_once(int_nodes, monkeypatch):
+    calls = []
+    topological_sort = execution.topological_sort
+    def counting_sort(*args, **kwargs):
+        calls.append(args)
+        return topological_sort(*args, **kwargs)
+    monkeypatch.setattr(execution, "topological_sort", counting_sort)
+
+    valid, error, good_outputs, node_errors = execution.validate_prompt(wide_prompt(200))
+    assert valid is True
+    assert len(good_outputs) == 200
+    assert len(calls) == 1
+
+def test_invalid_input_reported_for_every_output(int_nodes):
+    prompt = wide_prompt(3)
+    prompt["a500"]["inputs"]["b"] = "not an int"
+    valid, error, good_outputs, node_errors = execution.validate_prompt(prompt)
+    assert valid is False
+    assert list(node_errors.keys()) == ["a500"]
+    assert sorted(node_errors["a500"]["dependent_outputs"]) == ["out0", "out1", "out2"]
@@ -0,0 +1,93 @@
+import json
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+
+import pytest
+
+websocket = pytest.importorskip("websocket") #NOTE: websocket-client (https://github.com/websocket-client/websocket-client)
+
+"""
+Runs the server with two cpu process workers, the prompts only use nodes that don't need model files
+"""
+
+def image_prompt(width, inverts=1):
+    prompt = {"1": {"class_type": "EmptyImage", "inputs": {"width": width, "height": 64, "batch_size": 1, "color": 0}}}
+    for i in range(inverts):
+        prompt[str(i + 2)] = {"class_type": "ImageInvert", "inputs": {"image": [str(i + 1), 0]}}
+    prompt["out"] = {"class_type": "PreviewImage", "inputs": {"images": [str(inverts + 1), 0]}}
+    return prompt
+
+class Client:
+    def __init__(self, address):
+        self.address = address
+        self.client_id = str(uuid.uuid4())
+        self.ws = websocket.WebSocket()
+        self.ws.connect("ws://{}/ws?clientId={}".format(address, self.client_id))
+
+    def post(self, route, data):
+        req = urllib.request.Request("http://{}/{}".format(self.address, route), data=json.dumps(data).encode('utf-8'))
+        return urllib.request.urlopen(req).read()
+
+    def queue_prompt(self, prompt):
+        return json.loads(self.post("prompt", {"prompt": prompt, "client_id": self.client_id}))['prompt_id']
+
+    def wait(self, prompt_ids, on_executing=None):
+        remaining = set(prompt_ids)
+        while len(remaining) > 0:
+            out = self.ws.recv()
+            if not isinstance(out, str):
+                continue
+            message = json.loads(out)
+            if message['type'] == 'executing':
+                data = message['data']
+                if data['node'] is None:
+                    remaining.discard(data['prompt_id'])
+                elif on_executing is not None:
+                    on_executing(data)
+
+    def history(self, prompt_id):
+        with urllib.request.urlopen("http://{}/history/{}".format(self.address, prompt_id)) as response:
+            return json.loads(response.read())[prompt_id]
+
+@pytest.fixture(scope="module")
+def client(args_pytest):
+    port = args_pytest["port"] + 1
+    p = subprocess.Popen([sys.executable, 'main.py', '--cpu', '--workers', '2',
+                          '--output-directory', args_pytest["output_dir"],
+                          '--listen', args_pytest["listen"], '--port', str(port)])
+    try:
+        c = None
+        for i in range(30):
+            time.sleep(2)
+            try:
+                c = Client("{}:{}".format(args_pytest["listen"], port))
+                break
+            except ConnectionRefusedError:
+                pass
+        assert c is not None
+        yield c
+    finally:
+        p.kill()
+
+def test_prompts_run_on_workers(client):
+    prompt_ids = [client.queue_prompt(image_prompt(64 + i)) for i in range(6)]
+    client.wait(prompt_ids)
+    for prompt_id in prompt_ids:
+        history = client.history(prompt_id)
+        assert history["status"]["status_str"] == "success"
+        assert len(history["outputs"]["out"]["images"]) == 1
+
+def test_interrupt_reaches_worker(client):
+    prompt_id = client.queue_prompt(image_prompt(2048, inverts=2000))
+
+    def on_executing(data):
+        if data["node"] == "10":
+            client.post("interrupt", {})
+    client.wait([prompt_id], on_executing)
+
+    history = client.history(prompt_id)
+    assert history["status"]["status_str"] == "error"
+    assert "execution_interrupted" in [m[0] for m in history["status"]["messages"]]
@@ -0,0 +1,3 @@
+from comfy.cli_args import args
+# the unit tests run without a gpu
+args.cpu = True
@@ -0,0 +1,56 @@
+import copy
+import types
+
+import pytest
+import torch
+
+import comfy.sampler_helpers
+import comfy.samplers
+from comfy_extras.nodes_deepcache import BlockCache
+
+"""
+State of the DeepCache block cache patch between sampling runs and model clones
+"""
+
+def run_steps(cache, sigmas):
+    x = torch.zeros((2, 4, 8, 8))
+    for sigma in sigmas:
+        options = {"sigmas": torch.tensor([sigma]), "cond_or_uncond": [0, 1]}
+        if cache.load(x, options) is None:
+            cache.store(torch.ones((2, 8, 8, 8)), options)
+
+def test_features_dropped_after_sampling():
+    cache = BlockCache(3, 3, 10.0, 0.0)
+    model_options = {"transformer_options": {"patches": {"unet_block_cache": [cache], "input_block_patch": [lambda h, options: h]}}}
+    run_steps(cache, [8.0, 6.0, 4.0])
+    assert len(cache.features) == 1
+    assert cache.cached_steps == 2
+
+    comfy.sampler_helpers.cleanup_model_patches(model_options)
+    assert len(cache.features) == 0
+    assert cache.sigma is None
+
+def test_clone_gets_empty_cache():
+    cache = BlockCache(3, 3, 10.0, 0.0)
+    model_options = {"transformer_options": {"patches": {"unet_block_cache": [cache]}}}
+    run_steps(cache, [8.0])
+
+    cloned = copy.deepcopy(model_options)["transformer_options"]["patches"]["unet_block_cache"][0]
+    assert cloned is not cache
+    assert len(cloned.features) == 0
+    assert (cloned.depth, cloned.interval, cloned.sigma_start, cloned.sigma_end) == (3, 3, 10.0, 0.0)
+    assert len(cache.features) == 1
+
+def test_features_dropped_after_interrupted_sampling(monkeypatch):
+    cache = BlockCache(3, 3, 10.0, 0.0)
+    model_options = {"transformer_options": {"patches": {"unet_block_cache": [cache]}}}
+    guider = comfy.samplers.CFGGuider(types.SimpleNamespace(model_options=model_options, load_device=torch.device("cpu")))
+    monkeypatch.setattr(comfy.sampler_helpers, "prepare_sampling", lambda model, shape, conds: (None, conds, []))
+    def interrupted(*args, **kwargs):
+        run_steps(cache, [8.0])
+        raise KeyboardInterrupt()
+    monkeypatch.setattr(guider, "inner_sample", interrupted)
+
+    with pytest.raises(KeyboardInterrupt):
+        guider.sample(torch.zeros((1, 4, 8, 8)), torch.zeros((1, 4, 8, 8)), None, torch.tensor([8.0, 0.0]))
+    assert len(cache.features) == 0
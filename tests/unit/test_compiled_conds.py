@@ -0,0 +1,34 @@
+import torch
+
+import comfy.samplers
+
+"""
+Conds compiled once per sampling run by process_conds and reused by get_area_and_mult at every step
+"""
+
+def make_cond(**extra):
+    cond = {"model_conds": {}}
+    cond.update(extra)
+    return cond
+
+def test_compiled_cond_reused():
+    x = torch.zeros((2, 4, 32, 32))
+    timestep = torch.ones((2,))
+    #a device without an index like "mps" is a different object than the device of the input (mps:0)
+    conds = [make_cond(), make_cond(area=(16, 16, 8, 8), strength=0.5)]
+    comfy.samplers.compile_conds(conds, x.shape, "cpu", x.dtype)
+
+    for cond in conds:
+        p = comfy.samplers.get_area_and_mult(cond, x, timestep)
+        assert p.mult is cond["compiled"].mult
+
+def test_recompiled_for_other_shape():
+    x = torch.zeros((2, 4, 32, 32))
+    conds = [make_cond(area=(16, 16, 8, 8))]
+    comfy.samplers.compile_conds(conds, x.shape, x.device, x.dtype)
+
+    x = torch.zeros((1, 4, 32, 32))
+    p = comfy.samplers.get_area_and_mult(conds[0], x, torch.ones((1,)))
+    assert p.mult is not conds[0]["compiled"].mult
+    assert p.mult.shape == (1, 4, 16, 16)
+    assert p.input_x.shape == (1, 4, 16, 16)
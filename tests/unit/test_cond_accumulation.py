@@ -0,0 +1,75 @@
+import torch
+
+import comfy.conds
+import comfy.samplers
+
+"""
+The accumulator buffers calc_cond_batch reuses across steps and the fast path of the full area conds
+"""
+
+class ScaleModel:
+    """Scales the input by the value of the cond so every cond gives a different prediction."""
+    def memory_required(self, input_shape):
+        return 0
+
+    def memory_estimate_key(self):
+        return ("ScaleModel",)
+
+    def apply_model(self, x, t, c_crossattn=None, **kwargs):
+        return x * c_crossattn.mean(dim=(1, 2)).reshape(-1, 1, 1, 1)
+
+def make_cond(value, **kwargs):
+    c = {"model_conds": {"c_crossattn": comfy.conds.CONDCrossAttn(torch.full((1, 77, 64), value))}}
+    c.update(kwargs)
+    return c
+
+def compile_conds(conds, shape):
+    planner = comfy.samplers.CondBatchPlanner()
+    for c in conds:
+        comfy.samplers.compile_conds(c, shape, torch.device("cpu"), torch.float32, planner)
+    return conds
+
+def step(conds, x, timestep):
+    return comfy.samplers.calc_cond_batch(ScaleModel(), conds, x, torch.tensor([timestep]), {})
+
+def test_full_area_fast_path():
+    shape = (1, 4, 64, 64)
+    x = torch.randn(shape)
+    fast = compile_conds([[make_cond(2.0)], [make_cond(0.5)]], shape)
+    #a mask of ones gives the same weights but goes through the accumulators
+    ones = torch.ones((1, 64, 64))
+    accumulated = compile_conds([[make_cond(2.0, mask=ones)], [make_cond(0.5, mask=ones)]], shape)
+
+    out = step(fast, x, 1.0)
+    expected = step(accumulated, x, 1.0)
+    for o, e in zip(out, expected):
+        assert torch.allclose(o, e)
+    assert torch.allclose(out[0], x * 2.0)
+    assert torch.allclose(out[1], x * 0.5)
+
+def make_regional_conds(shape):
+    positive = [make_cond(1.0), make_cond(3.0, area=(32, 32, 0, 0), timestep_end=0.5), make_cond(2.0, area=(32, 32, 16, 16), strength=0.5)]
+    negative = [make_cond(0.5)]
+    return [positive, negative]
+
+def test_accumulators_reset_between_steps():
+    shape = (1, 4, 64, 64)
+    conds = compile_conds(make_regional_conds(shape), shape)
+    planner = conds[0][0]["batch_planner"]
+
+    for x, timestep in [(torch.randn(shape), 1.0), (torch.randn(shape), 1.0), (torch.randn(shape), 0.2)]:
+        out = step(conds, x, timestep)
+        expected = step(compile_conds(make_regional_conds(shape), shape), x, timestep)
+        for o, e in zip(out, expected):
+            assert torch.allclose(o, e)
+    assert len(planner.accumulators) == 1
+
+def test_inactive_cond_index():
+    shape = (1, 4, 32, 32)
+    x = torch.randn(shape)
+    conds = compile_conds([[make_cond(1.0, area=(16, 16, 0, 0)), make_cond(2.0, timestep_start=0.5)], [make_cond(0.5)]], shape)
+
+    #only the regional cond of the positive index runs, its weighted average outside the area is 0
+    out = step(conds, x, 1.0)
+    assert torch.allclose(out[0][:, :, :8, :8], x[:, :, :8, :8])
+    assert torch.allclose(out[1], x * 0.5)
@@ -0,0 +1,52 @@
+import json
+
+import comfy.memory_estimator
+
+"""
+Calibration table of the memory estimator, filled with made up peaks instead of measurements
+"""
+
+KEY = ("Model", "torch.float16", "pytorch")
+MB = 1024 * 1024
+
+def estimator_with(peaks, path=None):
+    estimator = comfy.memory_estimator.MemoryEstimator(path)
+    for batch, peak in peaks.items():
+        estimator.record(KEY, [batch, 4, 64, 64], peak)
+    return estimator
+
+def test_fixed_memory_isnt_scaled():
+    #100MB that don't depend on the batch and 10MB per batch element
+    estimator = estimator_with({2: 120 * MB, 4: 140 * MB})
+    margin = estimator.SAFETY_MARGIN
+    assert estimator.estimate(KEY, [1, 4, 64, 64], 0) == 120 * MB * margin
+    assert estimator.estimate(KEY, [3, 4, 64, 64], 0) == 140 * MB * margin
+    assert estimator.estimate(KEY, [8, 4, 64, 64], 0) == 180 * MB * margin
+    assert estimator.estimate(KEY, [1, 4, 32, 32], 7) == 7
+
+def test_single_measurement():
+    estimator = estimator_with({2: 120 * MB})
+    assert estimator.estimate(KEY, [1, 4, 64, 64], 0) == 120 * MB * estimator.SAFETY_MARGIN
+    assert estimator.estimate(KEY, [4, 4, 64, 64], 0) == 240 * MB * estimator.SAFETY_MARGIN
+
+def test_max_batch():
+    estimator = estimator_with({2: 120 * MB, 4: 140 * MB})
+    assert estimator.max_batch(KEY, [16, 4, 64, 64], 170 * MB * estimator.SAFETY_MARGIN + 1, 1) == 7
+    assert estimator.max_batch(KEY, [4, 4, 64, 64], 1000 * MB, 1) == 4
+    assert estimator.max_batch(KEY, [4, 4, 64, 64], 1, 1) == 1
+    assert estimator.max_batch(KEY, [4, 4, 32, 32], 1000 * MB, 3) == 3
+
+def test_saved_when_updated(tmp_path):
+    path = str(tmp_path / "calibration.json")
+    estimator = estimator_with({2: 120 * MB}, path)
+    assert not (tmp_path / "calibration.json").exists()
+
+    other = estimator_with({4: 140 * MB}, path)
+    other.save_if_updated()
+    estimator.save_if_updated()
+    with open(path) as f:
+        entries = json.load(f)["entries"]
+    assert list(entries.values()) == [{"2": 120 * MB, "4": 140 * MB}]
+
+    loaded = comfy.memory_estimator.MemoryEstimator(path)
+    assert loaded.estimate(KEY, [3, 4, 64, 64], 0) == 140 * MB * loaded.SAFETY_MARGIN
@@ -0,0 +1,65 @@
+import gc
+
+import comfy.model_eviction
+
+"""
+Order in which the eviction policies unload models
+"""
+
+GB = 1024 * 1024 * 1024
+
+class Model:
+    pass
+
+def use(policy, models, order):
+    for name in order:
+        policy.record_use(models[name])
+
+def eviction_order(policy, models, sizes={}, refcounts={}):
+    return sorted(models, key=lambda a: policy.sort_key(models[a], sizes.get(a, GB), refcounts.get(a, 0)))
+
+def test_default_policy():
+    policy = comfy.model_eviction.get_policy("default")
+    models = {"a": Model(), "b": Model(), "c": Model()}
+    #models not referenced by any output anymore go first, then the smallest
+    order = eviction_order(policy, models, sizes={"a": 3 * GB, "b": GB, "c": 2 * GB}, refcounts={"a": 0, "b": 1, "c": 0})
+    assert order == ["c", "a", "b"]
+
+def test_lru_and_lfu():
+    models = {"a": Model(), "b": Model(), "c": Model()}
+    lru = comfy.model_eviction.get_policy("lru")
+    lfu = comfy.model_eviction.get_policy("lfu")
+    for policy in (lru, lfu):
+        use(policy, models, ["a", "a", "a", "b", "c", "b"])
+    assert eviction_order(lru, models) == ["a", "c", "b"]
+    assert eviction_order(lfu, models) == ["c", "b", "a"]
+
+def test_reload_cost():
+    policy = comfy.model_eviction.get_policy("gdsf")
+    model = Model()
+    assert policy.model_stats(model).reload_cost() == 0
+    policy.model_stats(model).size = 2 * GB
+    assert policy.model_stats(model).reload_cost() == 2.0
+    policy.record_load(model, 2 * GB, 5.0)
+    assert policy.model_stats(model).reload_cost() == 5.0
+
+def test_stats_forgotten_with_model():
+    policy = comfy.model_eviction.get_policy("lru")
+    model = Model()
+    policy.record_load(model, GB, 1.0)
+    assert policy.get_stats()["models"] == 1
+    del model
+    gc.collect()
+    assert policy.get_stats()["models"] == 0
+
+def test_gdsf_keeps_expensive_models():
+    #two models that are cheap to reload used in turn after an expensive one, only one of them fits next to it
+    trace = []
+    for i in range(20):
+        trace.append([("big", 6 * GB, 20.0)])
+        trace.append([("small_a", 3 * GB, 0.5)])
+        trace.append([("small_b", 3 * GB, 0.5)])
+    lru = comfy.model_eviction.simulate(comfy.model_eviction.get_policy("lru"), trace, 9 * GB)
+    gdsf = comfy.model_eviction.simulate(comfy.model_eviction.get_policy("gdsf"), trace, 9 * GB)
+    assert lru["misses"] == len(trace)
+    assert gdsf["reload_time"] == 20.0 + 40 * 0.5
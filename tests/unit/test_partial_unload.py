@@ -0,0 +1,91 @@
+import pytest
+import torch
+
+import comfy.model_management
+import comfy.model_patcher
+import comfy.ops
+
+"""
+Partially unloaded models, the modules moved to the offload device keep the cast state of the patcher that moved them
+"""
+
+def make_patcher(device):
+    model = torch.nn.Sequential(*[comfy.ops.disable_weight_init.Linear(256, 256) for i in range(4)])
+    for m in model:
+        torch.nn.init.normal_(m.weight)
+        torch.nn.init.zeros_(m.bias)
+    return comfy.model_patcher.ModelPatcher(model, load_device=device, offload_device=torch.device("cpu"))
+
+def make_lora(patcher):
+    patches = {}
+    for i in range(len(patcher.model)):
+        patches["{}.weight".format(i)] = ("lora", (torch.randn(256, 8), torch.randn(8, 256), None, None, None))
+    return patches
+
+def partially_unload(patcher):
+    loaded = comfy.model_management.current_loaded_models[comfy.model_management.current_loaded_models.index(comfy.model_management.LoadedModel(patcher))]
+    loaded.model_partially_unload(patcher.model_size() // 2)
+    assert loaded.partially_unloaded
+    return loaded
+
+def cast_state(patcher):
+    return [hasattr(m, "prev_comfy_cast_weights") for m in patcher.model]
+
+@pytest.fixture
+def device():
+    if not torch.cuda.is_available():
+        pytest.skip("needs a device to partially unload the models from")
+    yield torch.device("cuda")
+    comfy.model_management.unload_all_models()
+
+def test_clone_of_partially_unloaded_model(device):
+    patcher = make_patcher(device)
+    lora = make_lora(patcher)
+    patcher.add_patches(lora, 0.5)
+    original = {k: v.clone() for k, v in patcher.model.state_dict().items()}
+
+    comfy.model_management.load_models_gpu([patcher])
+    expected = patcher.model(torch.ones(1, 256, device=device))
+    partially_unload(patcher)
+    assert any(cast_state(patcher))
+
+    #a clone with the same patches must not take over the weights of the partially unloaded model
+    clone = patcher.clone()
+    comfy.model_management.load_models_gpu([clone])
+    assert not any(cast_state(clone))
+    assert torch.allclose(clone.model(torch.ones(1, 256, device=device)), expected)
+
+    comfy.model_management.unload_all_models()
+    for k, v in clone.model.state_dict().items():
+        assert torch.equal(v.cpu(), original[k])
+
+def test_partially_unloaded_model_is_reloaded(device):
+    patcher = make_patcher(device)
+    patcher.add_patches(make_lora(patcher), 0.5)
+    comfy.model_management.load_models_gpu([patcher])
+    expected = patcher.model(torch.ones(1, 256, device=device))
+    resident = patcher.model[0].weight
+    loaded = partially_unload(patcher)
+    assert torch.allclose(patcher.model(torch.ones(1, 256, device=device)), expected)
+
+    #only the offloaded modules are loaded back, the resident ones aren't unloaded and patched again
+    comfy.model_management.load_models_gpu([patcher])
+    assert not loaded.partially_unloaded
+    assert not patcher.model_lowvram
+    assert not any(cast_state(patcher))
+    assert patcher.model[0].weight is resident
+    for v in patcher.model.state_dict().values():
+        assert v.device.type == "cuda"
+    assert torch.allclose(patcher.model(torch.ones(1, 256, device=device)), expected)
+
+def test_partially_load_within_memory(device):
+    patcher = make_patcher(device)
+    comfy.model_management.load_models_gpu([patcher])
+    partially_unload(patcher)
+    offloaded = len(patcher.partially_unloaded_modules)
+    assert offloaded >= 2
+
+    module_mem = comfy.model_management.module_size(patcher.model[0])
+    assert patcher.partially_load(device, module_mem) == module_mem
+    assert len(patcher.partially_unloaded_modules) == offloaded - 1
+    assert patcher.model_lowvram
@@ -0,0 +1,73 @@
+import gc
+
+import pytest
+import torch
+
+import comfy.model_patcher
+import comfy.pinned_memory
+
+"""
+Host memory pool for offloaded weights, the pool tests use the pageable backend so they run on cpu
+"""
+
+def test_host_memory_pool():
+    pool = comfy.pinned_memory.HostMemoryPool(64 * 1024 * 1024, backend=comfy.pinned_memory.PageableBackend())
+    sizes = [3 * 1024 * 1024, 1024, 5 * 1024 * 1024 + 7] * 4
+
+    for i in range(10):
+        buffers = [pool.get(size) for size in sizes]
+        for buf in buffers:
+            pool.release(buf)
+
+    stats = pool.get_stats()
+    assert stats["allocations"] == len(sizes)
+    assert stats["hits"] == 9 * len(sizes)
+    assert stats["in_use"] == 0
+    assert stats["free"] <= pool.max_size
+
+def test_host_memory_pool_limits():
+    pool = comfy.pinned_memory.HostMemoryPool(8 * 1024 * 1024, backend=comfy.pinned_memory.PageableBackend())
+    a = pool.get(6 * 1024 * 1024)
+    assert pool.get(4 * 1024 * 1024) is None
+    assert pool.get_stats()["fallbacks"] == 1
+
+    pool.release(a)
+    b = pool.get(4 * 1024 * 1024) #drops the free 6MB buffer to make room
+    assert b is not None
+    assert pool.get_stats()["free"] == 0
+
+    del b
+    gc.collect()
+    assert pool.get_stats()["in_use"] == 0
+
+def make_patcher(device):
+    model = torch.nn.Sequential(*[torch.nn.Linear(256, 256) for i in range(4)]).to(device)
+    comfy.pinned_memory.move_module(model, torch.device("cpu"))
+    return comfy.model_patcher.ModelPatcher(model, load_device=device, offload_device=torch.device("cpu"))
+
+def make_lora(patcher):
+    patches = {}
+    for i in range(len(patcher.model)):
+        patches["{}.weight".format(i)] = ("lora", (torch.randn(256, 8), torch.randn(8, 256), None, None, None))
+    return patches
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="needs a device to load the models to")
+def test_lora_backups_after_offload(monkeypatch):
+    monkeypatch.setattr(comfy.pinned_memory, "pool", comfy.pinned_memory.HostMemoryPool(64 * 1024 * 1024))
+    device = torch.device("cuda")
+    patchers = [make_patcher(device) for i in range(2)]
+    originals = [{k: v.clone() for k, v in p.model.state_dict().items()} for p in patchers]
+
+    for p in patchers:
+        p.add_patches(make_lora(p), 0.5)
+        p.patch_model(device_to=device)
+
+    #offloading a third model reuses the pool buffers the loaded models gave back
+    other = make_patcher(device)
+
+    for p, original in zip(patchers, originals):
+        p.unpatch_model(device_to=p.offload_device)
+        for k, v in p.model.state_dict().items():
+            assert v.device.type == "cpu"
+            assert torch.equal(v, original[k])
+    del other
@@ -0,0 +1,92 @@
+import types
+
+import torch
+
+import comfy.conds
+from comfy.k_diffusion import sampling as k_diffusion_sampling
+from comfy_extras.nodes_custom_sampler import Guider_UncondSchedule
+
+"""
+Steps of the uncond caching guider with samplers that call the model more than once per step
+"""
+
+class RecordingModel:
+    """Records the sigma and batch size of every call, the negative pass is batched with the positive one."""
+    def __init__(self):
+        self.calls = []
+
+    def memory_required(self, input_shape):
+        return 0
+
+    def memory_estimate_key(self):
+        return ("RecordingModel",)
+
+    def apply_model(self, x, t, c_crossattn=None, **kwargs):
+        self.calls.append((t[0].item(), x.shape[0]))
+        return x * 0.5 + c_crossattn.mean(dim=(1, 2)).reshape(-1, 1, 1, 1)
+
+def make_guider(model):
+    guider = Guider_UncondSchedule(types.SimpleNamespace(model_options={}))
+    guider.inner_model = model
+    guider.conds = {"positive": [{"model_conds": {"c_crossattn": comfy.conds.CONDCrossAttn(torch.ones((1, 77, 64)))}}],
+                    "negative": [{"model_conds": {"c_crossattn": comfy.conds.CONDCrossAttn(torch.full((1, 77, 64), 0.2))}}]}
+    guider.set_cfg(6.0)
+    return guider
+
+def test_cache_interval_counts_sampler_steps():
+    model = RecordingModel()
+    guider = make_guider(model)
+    guider.set_schedule("cache", 1000.0, 0.0, 2)
+    sigmas = torch.cat([torch.linspace(10.0, 0.5, 9), torch.zeros((1,))])
+    guider.reset_schedule(sigmas)
+
+    k_diffusion_sampling.sample_heun(guider, torch.randn((1, 4, 8, 8)) * 10.0, sigmas, extra_args={"model_options": {}}, disable=True)
+
+    #heun calls the model at the sigma of the step and at the one of the next step
+    steps = sigmas.tolist()
+    assert len(model.calls) == 2 * (len(steps) - 2) + 1
+    for sigma, batch in model.calls:
+        step = steps.index(sigma)
+        assert batch == (2 if step % 2 == 0 else 1)
+    assert guider.model_calls_saved == 8
+
+def test_steps_without_sigmas():
+    guider = make_guider(RecordingModel())
+    guider.set_schedule("cache", 1000.0, 0.0, 2)
+    assert [guider.sampler_step(s) for s in [10.0, 8.0, 8.0, 6.0, 6.0, 4.0]] == [0, 1, 1, 2, 2, 3]
+
+def test_steps_with_sigmas():
+    guider = make_guider(RecordingModel())
+    guider.set_schedule("cache", 1000.0, 0.0, 2)
+    guider.reset_schedule(torch.tensor([10.0, 8.0, 6.0, 0.0]))
+    #dpm2 and dpmpp_2s call the model between the sigmas of two steps
+    assert [guider.sampler_step(s) for s in [10.0, 9.0, 8.0, 7.0, 6.0, 3.0]] == [0, 0, 1, 1, 2, 2]
+
+def test_model_calls_with_cfg_1():
+    model = RecordingModel()
+    guider = make_guider(model)
+    guider.set_cfg(1.0)
+    guider.set_schedule("cache", 5.0, 0.0, 2)
+    sigmas = torch.cat([torch.linspace(10.0, 0.5, 9), torch.zeros((1,))])
+    guider.reset_schedule(sigmas)
+
+    k_diffusion_sampling.sample_euler(guider, torch.randn((1, 4, 8, 8)) * 10.0, sigmas, extra_args={"model_options": {}}, disable=True)
+    #the uncond is never computed so nothing is saved
+    assert all(batch == 1 for sigma, batch in model.calls)
+    assert guider.model_calls == len(model.calls)
+    assert guider.model_calls_saved == 0
+
+def test_computed_steps_run_post_cfg_functions():
+    model = RecordingModel()
+    guider = make_guider(model)
+    guider.set_schedule("cache", 1000.0, 0.0, 2)
+    sigmas = torch.cat([torch.linspace(10.0, 0.5, 5), torch.zeros((1,))])
+    guider.reset_schedule(sigmas)
+    called = []
+    def post_cfg(args):
+        called.append(args["sigma"][0].item())
+        return args["denoised"]
+
+    k_diffusion_sampling.sample_euler(guider, torch.randn((1, 4, 8, 8)) * 10.0, sigmas, extra_args={"model_options": {"sampler_post_cfg_function": [post_cfg]}}, disable=True)
+    assert len(called) == 5
+    assert guider.model_calls == sum(batch for sigma, batch in model.calls)
@@ -0,0 +1,115 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+import comfy.model_management
+import comfy.model_patcher
+import comfy.weight_dedup
+
+"""
+Deduplicated weights of models loaded from the same files, moving a model gives its weights new storage
+"""
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(args, "dedup_weights", True)
+    registry = comfy.weight_dedup.WeightRegistry()
+    monkeypatch.setattr(comfy.weight_dedup, "registry", registry)
+    return registry
+
+def make_patcher(device=torch.device("cpu")):
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(*[torch.nn.Linear(256, 256) for i in range(4)])
+    return comfy.model_patcher.ModelPatcher(model, load_device=device, offload_device=torch.device("cpu"))
+
+def make_lora(patcher):
+    patches = {}
+    for i in range(len(patcher.model)):
+        patches["{}.weight".format(i)] = ("lora", (torch.randn(256, 8), torch.randn(8, 256), None, None, None))
+    return patches
+
+def round_trip(patcher):
+    #what moving the model to the gpu and back does to its weights
+    for p in patcher.model.parameters():
+        p.data = p.data.clone()
+    patcher.unpatch_model(device_to=patcher.offload_device)
+
+def test_dedup(registry):
+    a, b = make_patcher(), make_patcher()
+    size = comfy.model_management.module_size(a.model)
+    assert registry.dedup_module(a.model) == 0
+    assert registry.dedup_module(b.model) == size
+    assert registry.shared_size(a.model) == 0
+    assert registry.shared_size(b.model) == size
+    assert comfy.model_management.module_size(b.model, exclude_shared=True) == 0
+
+def test_shared_after_patching(registry):
+    a, b = make_patcher(), make_patcher()
+    registry.dedup_module(a.model)
+    size = registry.dedup_module(b.model)
+    original = {k: v.clone() for k, v in a.model.state_dict().items()}
+
+    #patching replaces the parameter objects of b
+    b.add_patches(make_lora(b), 0.5)
+    b.patch_model(device_to=b.offload_device)
+    b.unpatch_model(device_to=b.offload_device)
+    assert registry.shared_size(b.model) == size
+    for k, v in a.model.state_dict().items():
+        assert torch.equal(v, original[k])
+
+def test_shared_after_unload(registry):
+    patchers = [make_patcher() for i in range(3)]
+    for p in patchers:
+        registry.dedup_module(p.model)
+    size = comfy.model_management.module_size(patchers[0].model)
+
+    round_trip(patchers[1])
+    assert registry.shared_size(patchers[1].model) == size
+
+    #the model the others borrowed their weights from
+    round_trip(patchers[0])
+    assert registry.shared_size(patchers[1].model) == size
+    assert registry.shared_size(patchers[2].model) == size
+
+    for p in patchers[1:]:
+        for k, v in p.model.state_dict().items():
+            assert v.data_ptr() == patchers[0].model.state_dict()[k].data_ptr()
+
+def test_patched_weights_not_reshared(registry):
+    a, b = make_patcher(), make_patcher()
+    registry.dedup_module(a.model)
+    size = registry.dedup_module(b.model)
+    weight_size = b.model[0].weight.nelement() * 4
+
+    b.add_patches({"0.weight": ("diff", (torch.zeros(256, 256),))}, 1.0)
+    round_trip(b)
+    assert registry.shared_size(b.model) == size - weight_size
+
+def test_changed_weights_not_reshared(registry):
+    a, b = make_patcher(), make_patcher()
+    registry.dedup_module(a.model)
+    size = registry.dedup_module(b.model)
+    weight_size = b.model[0].weight.nelement() * 4
+
+    #a change the sampled hash doesn't see
+    b.model[0].weight.data = b.model[0].weight.data.clone()
+    b.model[0].weight.data[0, 1] += 1.0
+    assert comfy.weight_dedup.sampled_hash(b.model[0].weight) == comfy.weight_dedup.sampled_hash(a.model[0].weight)
+    registry.reshare_module(b.model)
+    assert registry.shared_size(b.model) == size - weight_size
+    assert a.model[0].weight[0, 1] != b.model[0].weight[0, 1]
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="needs a device to load the models to")
+def test_shared_after_load_cycle(registry):
+    device = torch.device("cuda")
+    a, b = make_patcher(device), make_patcher(device)
+    registry.dedup_module(a.model)
+    size = registry.dedup_module(b.model)
+    #the patched weights aren't shared again
+    weight_size = b.model[0].weight.nelement() * 4
+
+    for p in (b, a):
+        p.add_patches({"0.weight": ("lora", (torch.randn(256, 8), torch.randn(8, 256), None, None, None))}, 0.5)
+        p.patch_model(device_to=device)
+        p.unpatch_model(device_to=p.offload_device)
+        assert registry.shared_size(b.model) == size - weight_size
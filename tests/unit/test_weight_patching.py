@@ -0,0 +1,171 @@
+import pytest
+import torch
+
+import comfy.model_management
+import comfy.model_patcher
+
+"""
+Batched lora patching must give the same weights as patching every key on its own, including for the keys it can't batch
+"""
+
+@pytest.fixture(autouse=True)
+def no_patch_cache(monkeypatch):
+    monkeypatch.setattr(comfy.model_patcher.patch_cache, "max_size", 0)
+
+def lora(shape, rank, alpha=None, dora=None):
+    return ("lora", (torch.randn(shape[0], rank), torch.randn(rank, shape[1]), alpha, None, dora))
+
+def expected_weight(weight, patches):
+    out = weight.clone()
+    for strength, v, strength_model in patches:
+        up, down, alpha = v[1][0], v[1][1], v[1][2]
+        scale = 1.0 if alpha is None else alpha / down.shape[0]
+        out = out * strength_model + strength * scale * (up @ down)
+    return out
+
+def make_patcher(shapes):
+    model = torch.nn.Sequential(*[torch.nn.Linear(s[1], s[0], bias=False) for s in shapes])
+    return comfy.model_patcher.ModelPatcher(model, load_device=torch.device("cpu"), offload_device=torch.device("cpu"))
+
+def test_batched_lora_signature():
+    weight = torch.zeros(8, 4)
+    plain = [(1.0, lora((8, 4), 2), 1.0)]
+    assert comfy.model_patcher.batched_lora_signature(plain, weight) is not None
+    assert comfy.model_patcher.batched_lora_signature(plain, weight) == comfy.model_patcher.batched_lora_signature([(0.5, lora((8, 4), 2, alpha=4.0), 1.0)], weight)
+    assert comfy.model_patcher.batched_lora_signature(plain, weight) != comfy.model_patcher.batched_lora_signature([(1.0, lora((8, 4), 3), 1.0)], weight)
+    assert comfy.model_patcher.batched_lora_signature([(1.0, lora((8, 4), 2), 0.5)], weight) is None
+    assert comfy.model_patcher.batched_lora_signature([(1.0, lora((8, 4), 2, dora=torch.ones(8, 1)), 1.0)], weight) is None
+    assert comfy.model_patcher.batched_lora_signature([(1.0, ("diff", (torch.ones(8, 4),)), 1.0)], weight) is None
+
+@pytest.mark.parametrize("batch_patch_memory", [None, 64 * 32 * 4 * 2])
+def test_batched_matches_per_key(batch_patch_memory, monkeypatch):
+    if batch_patch_memory is not None:
+        #two weights per chunk
+        monkeypatch.setattr(comfy.model_patcher.ModelPatcher, "BATCH_PATCH_MEMORY", batch_patch_memory)
+    shapes = [(64, 32)] * 5 + [(32, 64)] * 3
+    patcher = make_patcher(shapes)
+    original = {k: v.clone() for k, v in patcher.model.state_dict().items()}
+
+    patches = {}
+    for i, shape in enumerate(shapes):
+        patches["{}.weight".format(i)] = lora(shape, 4, alpha=2.0 if i % 2 == 0 else None)
+    patcher.add_patches(patches, 0.7)
+    patcher.add_patches({"0.weight": lora(shapes[0], 4), "1.weight": lora(shapes[1], 4)}, 0.5)
+    #not batchable: the strength_model isn't 1
+    patcher.add_patches({"7.weight": lora(shapes[7], 4)}, 1.0, strength_model=0.5)
+
+    #0 and 1 have two loras, 2 to 4 and 5 to 6 one, 7 patches on its own
+    patched = patcher.patch_weights_batched(list(patcher.patches.keys()))
+    assert patched == set("{}.weight".format(i) for i in range(7))
+    patcher.unpatch_model()
+
+    patcher.patch_model()
+    for k, weight in patcher.model.state_dict().items():
+        assert torch.allclose(weight, expected_weight(original[k], patcher.patches[k]), atol=1e-4)
+
+    patcher.unpatch_model()
+    for k, weight in patcher.model.state_dict().items():
+        assert torch.equal(weight, original[k])
+
+def test_mismatched_lora():
+    shapes = [(64, 32)] * 3
+    patcher = make_patcher(shapes)
+    original = {k: v.clone() for k, v in patcher.model.state_dict().items()}
+
+    #same key names but made for a weight with 16 in features, like a SD1.x lora on a SD2.x model
+    mismatched = lora((64, 16), 4)
+    assert comfy.model_patcher.batched_lora_signature([(1.0, mismatched, 1.0)], patcher.model[0].weight) is None
+    patcher.add_patches({"0.weight": mismatched, "1.weight": lora(shapes[1], 4), "2.weight": lora(shapes[2], 4)}, 1.0)
+
+    patcher.patch_model()
+    assert torch.equal(patcher.model[0].weight, original["0.weight"])
+    for k in ("1.weight", "2.weight"):
+        assert torch.allclose(patcher.model.state_dict()[k], expected_weight(original[k], patcher.patches[k]), atol=1e-4)
+    patcher.unpatch_model()
+
+def test_batched_failure_falls_back(monkeypatch):
+    shapes = [(64, 32)] * 3
+    patcher = make_patcher(shapes)
+    original = {k: v.clone() for k, v in patcher.model.state_dict().items()}
+    patcher.add_patches({"{}.weight".format(i): lora(shapes[i], 4) for i in range(3)}, 1.0)
+
+    def fail(keys, device_to=None):
+        raise RuntimeError("bmm failed")
+    monkeypatch.setattr(patcher, "patch_weight_group", fail)
+    assert patcher.patch_weights_batched(list(patcher.patches.keys())) == set()
+
+    patcher.patch_model()
+    for k, weight in patcher.model.state_dict().items():
+        assert torch.allclose(weight, expected_weight(original[k], patcher.patches[k]), atol=1e-4)
+    patcher.unpatch_model()
+
+def test_strength_updates_match_patching(monkeypatch):
+    #the weight is recomputed from the backup on every third update
+    monkeypatch.setattr(comfy.model_patcher.ModelPatcher, "MAX_DELTA_UPDATES", 2)
+    shapes = [(64, 32)] * 2
+    base = make_patcher(shapes)
+    original = {k: v.clone() for k, v in base.model.state_dict().items()}
+    patches = {"{}.weight".format(i): lora(shapes[i], 4, alpha=2.0) for i in range(2)}
+
+    loaded = base.clone()
+    loaded.add_patches(patches, 0.5)
+    loaded.patch_model()
+    counts = []
+    for strength in [0.2, 0.9, -0.3, 0.6, 1.0]:
+        n = base.clone()
+        n.add_patches(patches, strength)
+        assert len(n.strength_delta("0.weight", loaded.patches["0.weight"])) == 1
+        assert n.can_switch_patches(loaded)
+        n.switch_patches(loaded)
+        counts.append(n.delta_updates["0.weight"])
+        for k, weight in n.model.state_dict().items():
+            assert torch.allclose(weight, expected_weight(original[k], n.patches[k]), atol=1e-4)
+        loaded = n
+    assert counts == [1, 2, 0, 1, 2]
+
+    loaded.unpatch_model()
+    for k, weight in loaded.model.state_dict().items():
+        assert torch.equal(weight, original[k])
+
+def test_switch_patches_matches_patching():
+    shapes = [(64, 32)] * 3
+    base = make_patcher(shapes)
+    original = {k: v.clone() for k, v in base.model.state_dict().items()}
+
+    loaded = base.clone()
+    loaded.add_patches({"{}.weight".format(i): lora(shapes[i], 4) for i in range(3)}, 0.5)
+    loaded.patch_model()
+
+    #0 keeps its patch, 1 gets another lora and 2 isn't patched anymore
+    n = base.clone()
+    n.add_patches({"0.weight": loaded.patches["0.weight"][0][1], "1.weight": lora(shapes[1], 4)}, 0.5)
+    assert n.can_switch_patches(loaded)
+    n.switch_patches(loaded)
+    for k, weight in n.model.state_dict().items():
+        assert torch.allclose(weight, expected_weight(original[k], n.patches.get(k, [])), atol=1e-4)
+
+    n.unpatch_model()
+    for k, weight in n.model.state_dict().items():
+        assert torch.equal(weight, original[k])
+
+def test_unload_clones_switches_all_or_none(monkeypatch):
+    shapes = [(64, 32)] * 2
+    base = make_patcher(shapes)
+    original = {k: v.clone() for k, v in base.model.state_dict().items()}
+    patches = {"{}.weight".format(i): lora(shapes[i], 4) for i in range(2)}
+    a = base.clone()
+    a.add_patches(patches, 0.5)
+    c = base.clone()
+    c.add_patches(patches, 0.8)
+    c.patch_model()
+
+    #the target has the same weights as a but the ones loaded are the weights of c
+    target = a.clone()
+    monkeypatch.setattr(comfy.model_management, "current_loaded_models", [comfy.model_management.LoadedModel(a), comfy.model_management.LoadedModel(c)])
+    assert comfy.model_management.unload_model_clones(target, force_unload=False) is True
+    assert len(comfy.model_management.current_loaded_models) == 0
+
+    target.patch_model()
+    for k, weight in target.model.state_dict().items():
+        assert torch.allclose(weight, expected_weight(original[k], target.patches[k]), atol=1e-4)
+    target.unpatch_model()
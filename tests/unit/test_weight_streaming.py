@@ -0,0 +1,71 @@
+import torch
+
+import comfy.ops
+import comfy.weight_streaming
+
+"""
+The weight streamer learns the order the layers run in and never changes the results
+"""
+
+class Reversed(torch.nn.Module):
+    def __init__(self, layers):
+        super().__init__()
+        self.layers = torch.nn.ModuleList(layers)
+
+    def forward(self, x):
+        for layer in reversed(self.layers):
+            x = layer(x)
+        return x
+
+def make_layers(count, features):
+    layers = []
+    for i in range(count):
+        layer = comfy.ops.disable_weight_init.Linear(features, features)
+        torch.nn.init.normal_(layer.weight, std=features ** -0.5)
+        torch.nn.init.normal_(layer.bias)
+        layer.comfy_cast_weights = True
+        layers.append(layer)
+    return layers
+
+def stream(layers):
+    streamer = comfy.weight_streaming.WeightStreamer(layers, torch.device("cpu"), copier=comfy.weight_streaming.ThreadCopier(torch.device("cpu")))
+    for m in layers:
+        m.weight_streamer = streamer
+    return streamer
+
+def test_learns_execution_order():
+    layers = make_layers(8, 16)
+    model = Reversed(layers)
+    x = torch.randn(4, 16)
+    with torch.inference_mode():
+        expected = model(x)
+        streamer = stream(layers)
+        assert torch.allclose(model(x), expected)
+        misses = streamer.misses
+        #the order given at creation was wrong, the second run follows the learned one
+        assert torch.allclose(model(x), expected)
+        assert streamer.misses == misses + 1
+        streamer.reset()
+
+def test_dtype_change():
+    layers = make_layers(4, 16)
+    model = torch.nn.Sequential(*layers)
+    x = torch.randn(4, 16)
+    with torch.inference_mode():
+        streamer = stream(layers)
+        model(x)
+        out = model(x.to(torch.float64))
+        streamer.reset()
+    assert out.dtype == torch.float64
+    assert streamer.pending is None
+    assert streamer.in_use == []
+    assert streamer.pool.get_stats()["free_size"] > 0
+
+def test_cast_bias_weight_without_cast_op():
+    #custom node layers call cast_bias_weight on modules that don't inherit CastWeightBiasOp
+    layer = torch.nn.Linear(16, 16)
+    layer.weight_function = None
+    layer.bias_function = lambda b: b * 2
+    weight, bias = comfy.ops.cast_bias_weight(layer, torch.randn(1, 16, dtype=torch.float16))
+    assert weight.dtype == torch.float16
+    assert torch.allclose(bias, (layer.bias * 2).to(torch.float16))